@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+import instrumentation as instr
+
+GROUPS_CSV = "data/groups/groups_w_buckets.csv"
+LOGO_DIR   = "data/logos_preprocessed/"
+MANIFEST   = "data/logo_manifest.json" #preprocessed file -> domains, from preprocess_logo
+BUNDLE_DIR = "data/groups/bundle/"
+LIGHT_BUNDLE_DIR = "data/groups/bundle_light/" #built by load_bundle when BUNDLE_DIR is stale, no images and no summary
+BUNDLE_IMAGES = True #also store the normalized image matrix + pHash array used by logo_service
+TOP_CLUSTERS = 50 #largest clusters kept presorted in stats.json
+BUNDLE_SUMMARY = True #per cluster medoid, intra-cluster SSIM and registrable domain count (summary.npy + medoids.txt)
+SUMMARY_MAX_FILES = 40 #bigger clusters get their medoid/SSIM from an evenly spaced sample of this many logos
+BUNDLE_VERSION = 2 #bumped when the bundle layout changes, older bundles are rebuilt
+SECOND_LEVEL = {"co", "com", "org", "net", "gov", "edu", "ac", "or", "ne", "go", "gob", "nic"} #co.uk, com.au, or.jp ...
+SUMMARY_DTYPE = [("size", "<i4"), ("logos", "<i4"), ("registrable", "<i4"), ("ssim_min", "<f4"), ("ssim_mean", "<f4")]
+
+def filename_to_domain(fname):
+    base = os.path.splitext(fname)[0]
+    return ".".join(base.split("_")[:-1])
+
+#content hash of the groups table, the bundle stays valid when groups.csv is copied to data/groups/
+def source_hash(groups_csv):
+    with open(groups_csv, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+def read_groups(groups_csv):
+    import csv
+    with open(groups_csv, newline="", encoding="utf-8") as f:
+        return [(int(r["group_id"]), r["domains"].split(";")) for r in csv.DictReader(f)]
+
+# domain -> preprocessed logo file, replaces the os.listdir + startswith scan done for every rendered logo
+def logo_files(logo_dir, manifest):
+    if not os.path.isdir(logo_dir):
+        return [], {}
+    file_domains = {}
+    if os.path.exists(manifest):
+        with open(manifest, encoding="utf-8") as f:
+            file_domains = {e["file"]: e["domains"] for e in json.load(f).values()}
+    files = sorted(f for f in os.listdir(logo_dir) if f.endswith(".png"))
+    domain_file = {}
+    for fname in files:
+        for d in file_domains.get(fname) or [filename_to_domain(fname)]:
+            domain_file.setdefault(d, fname)
+    return files, domain_file
+
+#registrable part of a host name (example.co.uk for shop.example.co.uk), a public suffix list heuristic without the dependency
+def registrable_domain(domain):
+    labels = domain.split(":")[0].split("/")[0].split(".")
+    if len(labels) >= 3 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+def spread_sample(items, n):
+    if len(items) <= n:
+        return items
+    step = len(items) / n
+    return [items[int(i * step)] for i in range(n)]
+
+# medoid (the logo with the highest summed SSIM to the others) and min/mean pairwise SSIM of one cluster's distinct logos
+def medoid_and_ssim(paths):
+    import numpy as np
+    from PIL import Image
+    from skimage.metrics import structural_similarity as ssim
+    if len(paths) == 1:
+        return 0, 1.0, 1.0
+    imgs = [np.array(Image.open(p)) for p in paths]
+    scores = np.ones((len(imgs), len(imgs)), dtype=np.float32)
+    for i in range(len(imgs)):
+        for j in range(i + 1, len(imgs)):
+            scores[i, j] = scores[j, i] = ssim(imgs[i], imgs[j])
+    pairs = scores[np.triu_indices(len(imgs), k=1)]
+    return int(scores.sum(axis=1).argmax()), float(pairs.min()), float(pairs.mean())
+
+# one summary row + medoid file per group, row order = groups csv order
+def cluster_summary(groups, domain_file, logo_dir):
+    import numpy as np
+    summary = np.zeros(len(groups), dtype=SUMMARY_DTYPE)
+    medoids = []
+    for k, (_, doms) in enumerate(groups):
+        files = sorted({domain_file[d] for d in doms if d in domain_file})
+        medoid, lo, mean = "", 1.0, 1.0
+        if files:
+            sample = spread_sample(files, SUMMARY_MAX_FILES)
+            m, lo, mean = medoid_and_ssim([os.path.join(logo_dir, f) for f in sample])
+            medoid = sample[m]
+        summary[k] = (len(doms), len(files), len({registrable_domain(d) for d in doms}), lo, mean)
+        medoids.append(medoid)
+    return summary, medoids
+
+# writes the bundle next to the groups table:
+#   domains.txt + offsets.npy    all domains in group order, group k is domains[offsets[k]:offsets[k+1]]
+#   group_ids.npy, sizes.npy     one entry per group
+#   index.json                   domain -> [group_id, logo file]
+#   stats.json                   totals, size distribution, largest / most variable / most spread clusters
+#   summary.npy, medoids.txt     size, distinct logos, registrable domains, SSIM min/mean and medoid file per group (BUNDLE_SUMMARY)
+#   files.txt, images.npy, phash.npy, file_group.npy   normalized logo matrix for logo_service (BUNDLE_IMAGES)
+# everything is written to a fresh <out_dir>.tmp and swapped in at the end (swap_dir), files readers have mapped or opened
+# are never rewritten in place
+def build_bundle(groups_csv=GROUPS_CSV, logo_dir=LOGO_DIR, manifest=MANIFEST, out_dir=BUNDLE_DIR, images=BUNDLE_IMAGES, summary=BUNDLE_SUMMARY):
+    import shutil
+    import numpy as np
+    t0 = time.perf_counter()
+    final_dir = out_dir.rstrip("/\\")
+    out_dir = final_dir + ".tmp"
+    shutil.rmtree(out_dir, ignore_errors=True)
+    Path(out_dir).mkdir(parents=True)
+    groups = read_groups(groups_csv)
+    files, domain_file = logo_files(logo_dir, manifest)
+
+    group_ids = np.array([gid for gid, _ in groups], dtype=np.int32)
+    sizes = np.array([len(doms) for _, doms in groups], dtype=np.int32)
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    with open(os.path.join(out_dir, "domains.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(d for _, doms in groups for d in doms))
+    np.save(os.path.join(out_dir, "group_ids.npy"), group_ids)
+    np.save(os.path.join(out_dir, "sizes.npy"), sizes)
+    np.save(os.path.join(out_dir, "offsets.npy"), offsets)
+
+    domain_group = {d: gid for gid, doms in groups for d in doms}
+    index = {d: [gid, domain_file.get(d)] for d, gid in domain_group.items()}
+    with open(os.path.join(out_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+    values, counts = np.unique(sizes, return_counts=True)
+    largest = np.argsort(-sizes, kind="stable")[:TOP_CLUSTERS]
+    stats = {
+        "clusters": len(groups),
+        "logos": int(sizes.sum()),
+        "size_counts": {int(v): int(c) for v, c in zip(values, counts)},
+        "largest": [int(k) for k in largest], #row positions, largest cluster first
+        "source_md5": source_hash(groups_csv),
+        "version": BUNDLE_VERSION,
+        "built": time.time(),
+    }
+
+    if summary:
+        with instr.timer("cluster_summary"):
+            table, medoids = cluster_summary(groups, domain_file, logo_dir)
+        np.save(os.path.join(out_dir, "summary.npy"), table)
+        with open(os.path.join(out_dir, "medoids.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(medoids))
+        #clusters with several distinct logos, least similar first (brand consistency)
+        multi = np.flatnonzero(table["logos"] > 1)
+        stats["variable"] = [int(k) for k in multi[np.argsort(table["ssim_min"][multi], kind="stable")][:TOP_CLUSTERS]]
+        #one logo over the most distinct registrable domains first (fraud detection)
+        spread = np.flatnonzero(table["registrable"] > 1)
+        stats["spread"] = [int(k) for k in spread[np.argsort(-table["registrable"][spread], kind="stable")][:TOP_CLUSTERS]]
+        stats["summary"] = True
+
+    if images and files:
+        from batch_hash import phash_batch
+        from logo_service import load_normalized
+        mat = np.lib.format.open_memmap(os.path.join(out_dir, "images.npy"), mode="w+", dtype=np.uint8, shape=(len(files), 128, 128))
+        hashes = np.zeros(len(files), dtype=np.uint64)
+        file_group = np.full(len(files), -1, dtype=np.int32)
+        file_domains = {}
+        for d, fname in domain_file.items():
+            file_domains.setdefault(fname, []).append(d)
+        for i, fname in enumerate(files):
+            mat[i] = np.array(load_normalized(os.path.join(logo_dir, fname)))
+            file_group[i] = next((domain_group[d] for d in file_domains.get(fname, []) if d in domain_group), -1)
+        hashes[:] = phash_batch(mat)
+        mat.flush()
+        del mat
+        np.save(os.path.join(out_dir, "phash.npy"), hashes)
+        np.save(os.path.join(out_dir, "file_group.npy"), file_group)
+        with open(os.path.join(out_dir, "files.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(files))
+        stats["images"] = len(files)
+        stats["logo_dir"] = os.path.abspath(logo_dir)
+
+    # stats.json is written last, a bundle without it is incomplete
+    with open(os.path.join(out_dir, "stats.json"), "w", encoding="utf-8") as f:
+        json.dump(stats, f)
+    swap_dir(out_dir, final_dir)
+    print(f"[BUNDLE] {len(groups)} groups, {len(files) if images else 0} images → {final_dir} in {time.perf_counter() - t0:.1f}s")
+    return final_dir
+
+# replaces final_dir by new_dir, the old bundle is renamed aside first and deleted once the new one is in place
+# open readers keep working: their mapped arrays and open text files point at the unlinked old files
+def swap_dir(new_dir, final_dir):
+    import shutil
+    old_dir = final_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(final_dir):
+        os.replace(final_dir, old_dir)
+    os.replace(new_dir, final_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def is_fresh(groups_csv=GROUPS_CSV, out_dir=BUNDLE_DIR):
+    out_dir = out_dir.rstrip("/\\")
+    if not os.path.exists(out_dir) and os.path.exists(out_dir + ".old"):
+        return False #killed between the two renames of swap_dir, the next build puts a bundle back
+    path = os.path.join(out_dir, "stats.json")
+    if not os.path.exists(path) or not os.path.exists(groups_csv):
+        return False
+    with open(path, encoding="utf-8") as f:
+        stats = json.load(f)
+    return stats.get("version") == BUNDLE_VERSION and stats.get("source_md5") == source_hash(groups_csv)
+
+LAZY_FILES = ("domains.txt", "index.json", "medoids.txt", "files.txt")
+
+# read side: arrays are memory mapped, the domain list and index are only parsed when first used
+# the text files are opened right away, so a rebuild swapped in later can't mix another bundle's rows into this one
+class Bundle:
+    def __init__(self, out_dir=BUNDLE_DIR):
+        import numpy as np
+        self.dir = out_dir
+        with open(os.path.join(out_dir, "stats.json"), encoding="utf-8") as f:
+            self.stats = json.load(f)
+        self._files = {name: open(os.path.join(out_dir, name), encoding="utf-8")
+                       for name in LAZY_FILES if os.path.exists(os.path.join(out_dir, name))}
+        self.group_ids = np.load(os.path.join(out_dir, "group_ids.npy"), mmap_mode="r")
+        self.sizes = np.load(os.path.join(out_dir, "sizes.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(out_dir, "offsets.npy"), mmap_mode="r")
+        self._domains = None
+        self._index = None
+        self._medoids = None
+        self.summary = np.load(os.path.join(out_dir, "summary.npy"), mmap_mode="r") if self.stats.get("summary") else None
+
+    #whole content of one of the LAZY_FILES, read once from the handle opened in __init__
+    def _read(self, name):
+        f = self._files.pop(name)
+        with f:
+            return f.read()
+
+    @property
+    def domains(self):
+        if self._domains is None:
+            self._domains = self._read("domains.txt").split("\n")
+        return self._domains
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = json.loads(self._read("index.json"))
+        return self._index
+
+    def __len__(self):
+        return len(self.group_ids)
+
+    # domains of the group at row k (row order = groups csv order)
+    def group(self, k):
+        return self.domains[self.offsets[k]:self.offsets[k + 1]]
+
+    def logo_for(self, domain):
+        entry = self.index.get(domain)
+        return entry[1] if entry else None
+
+    def largest(self, n, min_size=2):
+        return [k for k in self.stats["largest"][:n] if self.sizes[k] >= min_size]
+
+    # representative logo of the group at row k, None for bundles built without the summary
+    def medoid(self, k):
+        if self.summary is None:
+            return None
+        if self._medoids is None:
+            self._medoids = self._read("medoids.txt").split("\n")
+        return self._medoids[k] or None
+
+    # rows with several distinct logos, lowest intra-cluster SSIM first
+    def most_variable(self, n):
+        return self.stats.get("variable", [])[:n]
+
+    # rows whose logo is used by the most distinct registrable domains
+    def most_spread(self, n, min_registrable=2):
+        return [k for k in self.stats.get("spread", [])[:n] if self.summary["registrable"][k] >= min_registrable]
+
+    def search(self, text, limit=50):
+        text = text.lower()
+        hits = []
+        for k in range(len(self)):
+            if any(text in d for d in self.group(k)):
+                hits.append({"group_id": int(self.group_ids[k]), "domains": self.group(k)})
+                if len(hits) == limit:
+                    break
+        return hits
+
+    def has_images(self):
+        return "images" in self.stats and os.path.exists(os.path.join(self.dir, "images.npy"))
+
+    # (files, images, phash, file_group), images stay on disk and are paged in on access
+    def image_arrays(self):
+        import numpy as np
+        files = self._read("files.txt").split("\n")
+        return (files,
+                np.load(os.path.join(self.dir, "images.npy"), mmap_mode="r"),
+                np.load(os.path.join(self.dir, "phash.npy")),
+                np.load(os.path.join(self.dir, "file_group.npy")))
+
+# opens the bundle for read-only consumers (the frontend), BUNDLE_DIR is only ever rebuilt by grouping runs
+# when the groups table changed since it was built a light bundle (no images, no SSIM summary) is built in LIGHT_BUNDLE_DIR
+# instead: no pairwise SSIM in the frontend process, and logo_service keeps its image matrix
+def load_bundle(groups_csv=GROUPS_CSV, out_dir=BUNDLE_DIR, light_dir=LIGHT_BUNDLE_DIR):
+    if is_fresh(groups_csv, out_dir):
+        return Bundle(out_dir)
+    print(f"[WARN] {out_dir} is older than {groups_csv}, run group_logos_buckets for cluster summaries and the logo matrix")
+    if not is_fresh(groups_csv, light_dir):
+        build_bundle(groups_csv, out_dir=light_dir, images=False, summary=False)
+    return Bundle(light_dir)
+
+if __name__ == "__main__":
+    import sys
+    build_bundle(sys.argv[1] if len(sys.argv) > 1 else GROUPS_CSV)
+
+# Artifact bundle:
+# Compiles the groups table into memory-mapped arrays, a domain index and precomputed stats (plus the normalized logo matrix
+# and pHash array for logo_service) so the frontend and the service open it without parsing the CSV or decoding images.
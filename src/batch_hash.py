@@ -0,0 +1,157 @@
+import os
+import math
+from functools import lru_cache
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8 #64 bit hashes, the imagehash defaults
+HIGHFREQ_FACTOR = 4 #pHash works on a 32x32 image like imagehash.phash
+BLOCK = 8192 #images resized and hashed together, bounds the float stack to BLOCK x 32 x 32
+HASH_WORKERS = os.cpu_count() or 1 #threads hashing chunks of files in hash_files
+RESIZE_CHUNK = 256 #same-shape images per resize matrix product, bounds the float64 copy (256 x 128 x 128 x 8 bytes)
+LANCZOS = Image.Resampling.LANCZOS if hasattr(Image, "Resampling") else Image.ANTIALIAS
+
+# bool matrices (N x 8 x 8) -> uint64, first element is the most significant bit like int(str(imagehash), 16)
+def pack_bits(diff):
+    packed = np.packbits(diff.reshape(len(diff), -1), axis=1)
+    return packed.view(">u8").ravel().astype(np.uint64)
+
+PRECISION_BITS = 22 #pillow's fixed point precision for 8 bit resampling (32 - 8 - 2)
+
+# pillow's lanczos filter, same double arithmetic as Resample.c so the rounded coefficients match bit for bit
+def _lanczos(x):
+    def sinc(v):
+        if v == 0.0:
+            return 1.0
+        v = v * math.pi
+        return math.sin(v) / v
+    return sinc(x) * sinc(x / 3) if -3.0 <= x < 3.0 else 0.0
+
+# out_size x in_size matrix of pillow's fixed point LANCZOS coefficients (precompute_coeffs + normalize_coeffs_8bpc)
+@lru_cache(maxsize=64)
+def lanczos_kernel(in_size, out_size):
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = 3.0 * filterscale
+    kernel = np.zeros((out_size, in_size))
+    for xx in range(out_size):
+        center = (xx + 0.5) * scale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), in_size)
+        w = [_lanczos((x - center + 0.5) / filterscale) for x in range(xmin, xmax)]
+        ww = sum(w)
+        for x, v in zip(range(xmin, xmax), w):
+            v = v / ww if ww != 0.0 else v
+            kernel[xx, x] = int(-0.5 + v * (1 << PRECISION_BITS)) if v < 0 else int(0.5 + v * (1 << PRECISION_BITS))
+    return kernel
+
+# one resampling pass as a matrix product over the whole stack, float64 is exact here (integer sums far below 2**53)
+# then pillow's rounding: + half, arithmetic shift, clip to 0..255
+def _resample(acc):
+    acc += 1 << (PRECISION_BITS - 1)
+    return np.clip(np.floor(acc / (1 << PRECISION_BITS)), 0, 255).astype(np.uint8)
+
+# N x H x W uint8 stack -> one N x h x w stack per size, the same pixels as Image.resize(size, LANCZOS) per image
+# pillow runs the horizontal pass first (rounded to uint8) then the vertical one, the horizontal kernels of all sizes
+# are stacked so the whole stack goes through one matrix product
+def resize_pixels(stack, sizes):
+    pixels = stack.astype(np.float64)
+    width, height = stack.shape[2], stack.shape[1]
+    kernels = [lanczos_kernel(width, w) if w != width else np.eye(width) for w, _ in sizes]
+    across = _resample(pixels @ np.concatenate(kernels).T)
+    outs, col = [], 0
+    for (w, h), k in zip(sizes, kernels):
+        part = across[:, :, col:col + len(k)] if w != width else stack
+        col += len(k)
+        outs.append(_resample(lanczos_kernel(height, h) @ part.astype(np.float64)) if h != height else part)
+    return outs
+
+# LANCZOS resizes of 2D uint8 arrays to every size in sizes, arrays of the same shape are resized together
+# in chunks of RESIZE_CHUNK (preprocessed logos all share one shape), a shape seen once goes through PIL instead
+def resize_arrays(arrays, sizes):
+    outs = [np.empty((len(arrays), h, w), dtype=np.uint8) for w, h in sizes]
+    by_shape = defaultdict(list)
+    for k, a in enumerate(arrays):
+        by_shape[a.shape].append(k)
+    for idx in by_shape.values():
+        if len(idx) == 1:
+            img = Image.fromarray(arrays[idx[0]])
+            for out, size in zip(outs, sizes):
+                out[idx[0]] = np.asarray(img.resize(size, LANCZOS))
+            continue
+        for start in range(0, len(idx), RESIZE_CHUNK):
+            chunk = idx[start:start + RESIZE_CHUNK]
+            for out, resized in zip(outs, resize_pixels(np.stack([arrays[k] for k in chunk]), sizes)):
+                out[chunk] = resized
+    return outs
+
+#images can be PIL images or 2D uint8 arrays (rows of a decoded stack such as the bundle matrix)
+def gray_array(img):
+    if isinstance(img, Image.Image):
+        return np.asarray(img.convert("L"))
+    return np.asarray(img, dtype=np.uint8)
+
+def resize_stack(images, size):
+    return resize_arrays([gray_array(img) for img in images], [size])[0]
+
+# one scipy DCT over the whole N x 32 x 32 stack (both axes), same transform imagehash runs per image
+def phash_pixels(pixels):
+    import scipy.fftpack
+    dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=1), axis=2)
+    low = dct[:, :HASH_SIZE, :HASH_SIZE].reshape(len(pixels), -1)
+    med = np.median(low, axis=1)
+    return pack_bits(low > med[:, None])
+
+def ahash_pixels(pixels):
+    flat = pixels.reshape(len(pixels), -1)
+    return pack_bits(flat > flat.mean(axis=1)[:, None])
+
+def dhash_pixels(pixels):
+    return pack_bits(pixels[:, :, 1:] > pixels[:, :, :-1])
+
+def phash_batch(images):
+    size = HASH_SIZE * HIGHFREQ_FACTOR
+    hashes = np.zeros(len(images), dtype=np.uint64)
+    for start in range(0, len(images), BLOCK):
+        hashes[start:start + BLOCK] = phash_pixels(resize_stack(images[start:start + BLOCK], (size, size)))
+    return hashes
+
+# N x 3 (aHash, dHash, pHash) for images already in memory (PIL images or 2D uint8 arrays)
+def hash_images(images):
+    return hash_arrays([gray_array(img) for img in images])
+
+def hash_arrays(arrays):
+    size = HASH_SIZE * HIGHFREQ_FACTOR
+    a, d, p = resize_arrays(arrays, [(HASH_SIZE, HASH_SIZE), (HASH_SIZE + 1, HASH_SIZE), (size, size)])
+    out = np.zeros((len(arrays), 3), dtype=np.uint64)
+    out[:, 0] = ahash_pixels(a)
+    out[:, 1] = dhash_pixels(d)
+    out[:, 2] = phash_pixels(p)
+    return out
+
+def _hash_chunk(paths):
+    arrays = []
+    for path in paths:
+        with Image.open(path) as img:
+            arrays.append(np.asarray(img.convert("L")))
+    return hash_arrays(arrays)
+
+# N x 3 (aHash, dHash, pHash) for a list of image files, every file is decoded once for the three resizes
+# chunks of RESIZE_CHUNK files run on HASH_WORKERS threads, png decoding and the matrix products release the GIL
+def hash_files(paths, workers=HASH_WORKERS):
+    out = np.zeros((len(paths), 3), dtype=np.uint64)
+    starts = range(0, len(paths), RESIZE_CHUNK)
+    chunks = [paths[start:start + RESIZE_CHUNK] for start in starts]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as pool:
+        for start, hashes in zip(starts, pool.map(_hash_chunk, chunks)):
+            out[start:start + len(hashes)] = hashes
+    return out
+
+# Batched perceptual hashing:
+# aHash/dHash/pHash for a whole stack of images as packed uint64, bit for bit the values imagehash gives per image
+# (PIL's LANCZOS coefficients applied as one matrix product per image shape, same scipy DCT run once over the stack),
+# without the per image ImageHash objects and PIL resizes. Cost is still linear in the files: about 1-1.3s per 2k
+# preprocessed logos on one core, roughly a minute per 100k, most of it png decoding. tests/test_batch_hash.py pins the
+# bit compatibility, a Pillow release that changes its resampler shows up there.
@@ -1,32 +1,117 @@
-import pandas as pd
 import os
-import glob
+import csv
 import random
+from collections import defaultdict
+import numpy as np
+from outofcore_group import iter_json_object, name_key
 
-BATCHES_DIR = "batches/"
-OUTPUT_DIR = "batches_review/"
-N_PER_BATCH = 5  
+RESULTS_CSV = "data/pipeline_results.csv" #extraction results written by pipeline.py, its failures are sampled
+FAILED_CSV  = "data/failed_sites.csv" #failures written by download_logos.py
+STATE_FILE  = "data/crawl_state.json" #every saved logo (download_logos, pipeline, crawl queue, recrawl), the successes are sampled from it
+GROUPS_CSV  = "data/groups/groups_w_buckets.csv"
+OUTPUT_DIR  = "batches_review/"
+OUTPUT_CSV  = os.path.join(OUTPUT_DIR, "review_set.csv")
+N_PER_STRATUM = 5 #domains kept for manual review in every stratum
+SEED = 42 #same review set for the same results
+SIZE_BUCKETS = [(1, "1"), (5, "2-5"), (20, "6-20"), (float("inf"), "21+")]
+SUCCESS_FIELDS = ["domain", "status", "strategy", "filename", "hash", "url"]
 
-def sample_from_each_batch():
+# cluster size of every grouped domain, groups.csv is streamed once into two numpy arrays (64 bit domain hash, size)
+# sorted by hash, about 12 bytes per domain instead of a dict of strings
+class ClusterSizes:
+    def __init__(self, path=GROUPS_CSV):
+        keys, sizes = [], []
+        if os.path.exists(path):
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    domains = row["domains"].split(";")
+                    keys.append(np.fromiter((name_key(d) for d in domains), dtype=np.uint64, count=len(domains)))
+                    sizes.append(np.full(len(domains), len(domains), dtype=np.uint32))
+        self.keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.uint64)
+        self.sizes = np.concatenate(sizes) if sizes else np.zeros(0, dtype=np.uint32)
+        order = np.argsort(self.keys)
+        self.keys, self.sizes = self.keys[order], self.sizes[order]
+
+    def get(self, domain):
+        key = np.uint64(name_key(domain))
+        i = np.searchsorted(self.keys, key)
+        return int(self.sizes[i]) if i < len(self.keys) and self.keys[i] == key else None
+
+def size_bucket(size):
+    if size is None:
+        return "unknown"
+    for limit, label in SIZE_BUCKETS:
+        if size <= limit:
+            return label
+
+# successes by winning strategy and cluster size, pipeline failures by reason
+def stratum(row, sizes):
+    if row["status"] == "success":
+        return f"ok|{(row['strategy'] or 'unknown').split(':')[0]}|size:{size_bucket(sizes.get(row['domain']))}"
+    return f"fail|{row['reason'] or row['status']}"
+
+#crawl_state entries as success rows, streamed so the state file is never loaded whole
+def iter_successes(path=STATE_FILE):
+    if not os.path.exists(path) or os.stat(path).st_size == 0:
+        return
+    for domain, entry in iter_json_object(path):
+        yield {"domain": domain, "status": "success", **{k: entry.get(k, "") for k in SUCCESS_FIELDS[2:]}}
+
+#download_logos failures, "dead" rows keep the preflight reason before the ':', other messages are exception texts
+def failed_stratum(row):
+    return f"fail|download:{row['status']}|{(row['message'] or '').split(':')[0][:40]}"
+
+# reservoir sampling (algorithm R) per stratum: one scan, memory is N_PER_STRATUM rows per stratum whatever the corpus size
+def stratified_reservoir(rows, key, k=N_PER_STRATUM, seed=SEED):
+    rng = random.Random(seed)
+    reservoirs = defaultdict(list)
+    seen = defaultdict(int)
+    for row in rows:
+        s = key(row)
+        seen[s] += 1
+        if len(reservoirs[s]) < k:
+            reservoirs[s].append(row)
+        else:
+            j = rng.randrange(seen[s])
+            if j < k:
+                reservoirs[s][j] = row
+    return reservoirs, seen
+
+#reservoirs of one csv, (stratum -> rows, stratum -> rows seen); a missing file has no rows
+def sample_csv(path, key, k, fields, keep=None):
+    if not os.path.exists(path):
+        return {}, {}
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fields.extend(c for c in reader.fieldnames or [] if c not in fields)
+        return stratified_reservoir(filter(keep, reader), key, k)
+
+def sample_review_set():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-     # find all CSV batch files in the batches dir, sorted alphabetically
-    batch_files = sorted(glob.glob(os.path.join(BATCHES_DIR, "batch_*.csv")))
+    fields = list(SUCCESS_FIELDS)
+    sizes = ClusterSizes()
+    # one reservoir per (strategy, size bucket) key, so rare buckets such as 21+ get their own N_PER_STRATUM rows
+    reservoirs, seen = stratified_reservoir(iter_successes(), lambda row: stratum(row, sizes))
+    #pipeline successes are already in crawl_state, only its failures are read here
+    for path, key, keep in ((RESULTS_CSV, lambda row: stratum(row, sizes), lambda row: row["status"] != "success"),
+                            (FAILED_CSV, failed_stratum, None)):
+        more, more_seen = sample_csv(path, key, N_PER_STRATUM, fields, keep)
+        reservoirs.update(more)
+        seen.update(more_seen)
+
     total_sampled = 0
-    for batch in batch_files:
-        df = pd.read_csv(batch)
-        # Read each batch as a DataFrame and take 5
-        sampled = df.sample(min(N_PER_BATCH, len(df)), random_state=42)
-        out_csv = os.path.join(OUTPUT_DIR, os.path.basename(batch))
-        sampled.to_csv(out_csv, index=False)
-        print(f"Sampled {len(sampled)} from {os.path.basename(batch)}")
-        total_sampled += len(sampled)
-    print(f"\nTotal domenii eșantionate: {total_sampled}")
+    with open(OUTPUT_CSV, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["stratum"] + fields)
+        writer.writeheader()
+        for s in sorted(reservoirs):
+            for row in reservoirs[s]:
+                writer.writerow({"stratum": s, **row})
+            print(f"Sampled {len(reservoirs[s])}/{seen[s]} from {s}")
+            total_sampled += len(reservoirs[s])
+    print(f"\nTotal domenii eșantionate: {total_sampled} → {OUTPUT_CSV}")
 
 if __name__ == "__main__":
-    sample_from_each_batch()
+    sample_review_set()
 
 #Script for detecting false positives:
-#Used to take a small but representative sample from all extracted batches (from the large Parquet file), run the script on this subset, and manually check for any false positives among the extracted logos.
-
-
-
+#Used to take a small but representative sample of the extraction results in one pass, stratified by winning strategy and cluster size (every saved logo in crawl_state) and by failure reason (pipeline results and download_logos failures), and manually check for any false positives among the extracted logos.
@@ -1,26 +1,17 @@
-import pandas as pd
 import os
-
-PARQUET_FILE = "data\logos.snappy.parquet"
-BATCH_SIZE = 150
-BATCHES_DIR = "batches/"
+from parquet_ingest import PARQUET_FILE, WORK_DIR, write_work_shards, rows_per_shard
 
 def split_parquet_to_batches():
-    os.makedirs(BATCHES_DIR, exist_ok=True)
-    df = pd.read_parquet(PARQUET_FILE)
-    domains = df['domain'].drop_duplicates().reset_index(drop=True)
-    total = len(domains)
-    # iterate through the domains list in steps of BATCH_SIZE
-    for i in range(0, total, BATCH_SIZE):
-        # slice out the next batch of domains
-        batch = domains.iloc[i:i+BATCH_SIZE]
-        # build the filename for this batch and save it as csv
-        batch_csv = os.path.join(BATCHES_DIR, f"batch_{i//BATCH_SIZE+1:03d}.csv")
-        batch.to_frame(name="domain").to_csv(batch_csv, index=False)
-        print(f"Written: {batch_csv} ({len(batch)} domains)")
+    shard_rows = rows_per_shard()
+    print(f"Shard size: {shard_rows} domains (target runtime per shard)")
+    # stream the parquet, dedupe per hash partition and write the work shards
+    shards, total, dups = write_work_shards(PARQUET_FILE, WORK_DIR, shard_rows)
+    for shard in shards:
+        print(f"Written: {shard}")
+    print(f"\n{total} unique domains in {len(shards)} shards under {WORK_DIR} ({dups} duplicates dropped)")
 
 if __name__ == "__main__":
     split_parquet_to_batches()
 
 #Script for splitting the large Parquet file:
-#Used to break the big Parquet file into smaller CSV batches, so I can process, validate, or debug the data more easily, piece by piece.
+#Used to break the big Parquet file into hash-partitioned Parquet work shards (sized by how long a shard takes to crawl), streaming the input so it works for any number of domains.
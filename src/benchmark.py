@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import random
+import argparse
+import resource
+import tracemalloc
+import threading
+from pathlib import Path
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+SOURCE_DIR    = "data/logos_preprocessed/" #real logos the synthetic variants are made from
+BENCH_DIR     = "data/bench/"
+BASELINE_JSON = "data/bench/baseline.json"
+SCALES        = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+HTML_FIXTURES = 200 #local homepages served for the fetch/parse stages
+REGRESSION_TOL = 1.20 #a stage 20% slower than the baseline is reported as a regression
+SEED = 42 #same corpus on every machine
+MEASURE_MEMORY = True #peak memory per stage from an extra tracemalloc run of the stage, off with --skip-memory
+
+# page templates covering the main find_logo_url strategies
+HTML_TEMPLATES = [
+    '<html><body><header class="site-header"><a href="/"><img class="logo" src="/{site}/logo.png" alt="{site} logo"></a></header><p>{filler}</p></body></html>',
+    '<html><body><nav class="navbar"><div class="brand"><svg width="40" height="20"><rect width="40" height="20" fill="#c00"/></svg></div></nav><p>{filler}</p></body></html>',
+    '<html><head><meta property="og:image" content="/{site}/logo.png"></head><body><main>{filler}</main></body></html>',
+    '<html><head><link rel="icon" href="/{site}/logo.png"></head><body><footer class="footer"><img src="/{site}/partner.png" alt="partner logo"></footer>{filler}</body></html>',
+]
+
+# one synthetic variant of a real logo: rescaled, slightly rotated, recoloured and padded like a re-exported file
+def make_variant(img, rng):
+    from PIL import Image, ImageEnhance, ImageOps
+    img = img.convert("RGB")
+    scale = rng.uniform(0.6, 2.0)
+    img = img.resize((max(8, int(img.width * scale)), max(8, int(img.height * scale))), Image.BILINEAR)
+    img = img.rotate(rng.uniform(-3, 3), expand=True, fillcolor=(255, 255, 255))
+    img = ImageEnhance.Brightness(img).enhance(rng.uniform(0.8, 1.2))
+    img = ImageEnhance.Color(img).enhance(rng.uniform(0.5, 1.5))
+    return ImageOps.expand(img, border=rng.randint(0, 24), fill=(255, 255, 255))
+
+#build (or reuse) the raw corpus for a scale, filenames keep the domain_tld_N.png shape the pipeline expects
+def generate_corpus(n, out_dir):
+    from PIL import Image
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    existing = [f for f in os.listdir(out_dir) if f.endswith(".png")]
+    if len(existing) >= n:
+        return sorted(existing)[:n]
+    sources = sorted(f for f in os.listdir(SOURCE_DIR) if f.endswith(".png"))
+    rng = random.Random(SEED)
+    names = []
+    for i in range(n):
+        src = sources[i % len(sources)]
+        base = "_".join(os.path.splitext(src)[0].split("_")[:-1]) or "logo"
+        name = f"{base}_{i}.png"
+        with Image.open(os.path.join(SOURCE_DIR, src)) as img:
+            make_variant(img, rng).save(os.path.join(out_dir, name), format="PNG")
+        names.append(name)
+    return names
+
+#write the local homepages + a logo per site, returns the site names
+def generate_html_fixtures(html_dir, n=HTML_FIXTURES):
+    import shutil
+    sources = sorted(f for f in os.listdir(SOURCE_DIR) if f.endswith(".png"))
+    rng = random.Random(SEED)
+    sites = []
+    for i in range(n):
+        site = f"site_{i}"
+        site_dir = os.path.join(html_dir, site)
+        Path(site_dir).mkdir(parents=True, exist_ok=True)
+        filler = " ".join(rng.choice(["lorem", "ipsum", "dolor", "brand", "product"]) for _ in range(rng.randint(50, 2000)))
+        with open(os.path.join(site_dir, "index.html"), "w", encoding="utf-8") as f:
+            f.write(HTML_TEMPLATES[i % len(HTML_TEMPLATES)].format(site=site, filler=filler))
+        for img_name in ("logo.png", "partner.png"):
+            shutil.copy(os.path.join(SOURCE_DIR, sources[rng.randrange(len(sources))]), os.path.join(site_dir, img_name))
+        sites.append(site)
+    return sites
+
+#static file server on a free localhost port, runs in a daemon thread
+def serve_directory(directory):
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# runs one stage, records wall time and peak python memory, items is a count or a function of the stage's result
+# tracemalloc hooks every allocation and slows the code it traces, so memory is measured in a separate run of the stage
+# (which also warms the os caches, timings are always warm ones) and the timed run is not traced
+def run_stage(metrics, name, fn, items=None):
+    peak = None
+    if MEASURE_MEMORY:
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t0
+    if callable(items):
+        items = items(result)
+    count = items if items is not None else (len(result) if hasattr(result, "__len__") else None)
+    peak_mb = round(peak / 2**20, 2) if peak is not None else None
+    metrics[name] = {"seconds": round(elapsed, 4), "peak_mb": peak_mb, "items": count}
+    print(f"[BENCH] {name:<18} {elapsed:9.3f}s  peak={peak_mb if peak_mb is not None else '-':>8}MB  items={count}")
+    return result
+
+# parse stage replays recorded responses keyed by the full url, icon/favicon/og urls included, so it measures
+# BeautifulSoup + strategies only and never touches the network; an url that wasn't recorded fails the run
+def bench_network(metrics, work_dir):
+    import download_logos
+    html_dir = os.path.join(work_dir, "html")
+    sites = generate_html_fixtures(html_dir)
+    server = serve_directory(html_dir)
+    host = f"127.0.0.1:{server.server_address[1]}"
+    fetch_url = download_logos.fetch_url
+    try:
+        pages = run_stage(metrics, "fetch", lambda: {s: fetch_url(f"http://{host}/{s}/", try_http_fallback=False) for s in sites})
+        # untimed recording pass, the fixtures are served over plain http
+        recorded = {f"https://{host}/{s}": resp for s, resp in pages.items()}
+        def recording_fetch(url, try_http_fallback=True, **kwargs):
+            if url not in recorded:
+                recorded[url] = fetch_url(url.replace("https://", "http://", 1), try_http_fallback=False)
+            return recorded[url]
+        misses = []
+        def replay_fetch(url, try_http_fallback=True, **kwargs):
+            if url not in recorded:
+                misses.append(url)
+            return recorded.get(url)
+        parse = lambda: [download_logos.find_logo_url(f"{host}/{s}", fallback_brand_search=False) for s in sites]
+        try:
+            download_logos.fetch_url = recording_fetch
+            parse()
+            download_logos.fetch_url = replay_fetch
+            found = run_stage(metrics, "parse", parse)
+        finally:
+            download_logos.fetch_url = fetch_url
+        if misses:
+            raise RuntimeError(f"parse stage asked for {len(set(misses))} urls that were not recorded, e.g. {misses[0]}")
+        metrics["parse"]["found"] = sum(1 for url, _, _ in found if url)
+    finally:
+        server.shutdown()
+
+# the matcher group_logos_buckets runs (USE_CASCADE): batch hashes, band + fingerprint candidates, cascade filters + SSIM
+def bench_cascade(metrics, paths, feats):
+    import cascade_match as cm
+    hashes = run_stage(metrics, "hash", lambda: cm.packed_hashes(paths))
+    pairs, cross_links, _ = run_stage(metrics, "candidates", lambda: cm.cascade_candidates(hashes, feats),
+                                      items=lambda found: len(found[0]) + len(found[1]))
+    def verify():
+        cm.load_gray.cache_clear() #every run starts with a cold decode cache, like a grouping run
+        return cm.verify_candidates(pairs, cross_links, hashes, feats, paths)[0]
+    return run_stage(metrics, "cascade", verify, items=len(pairs) + len(cross_links))
+
+# the legacy matcher (USE_CASCADE = False): imagehash pHash per file, prefix buckets, SSIM on every candidate
+def bench_buckets(metrics, paths, prefix=""):
+    import group_logos_buckets as glb
+    phashes = run_stage(metrics, prefix + "hash", lambda: [glb.calc_phash(p) for p in paths])
+    pairs = run_stage(metrics, prefix + "candidates", lambda: list(glb.candidate_pairs(phashes)))
+    def verify():
+        graph = glb.defaultdict(set)
+        for i, j in pairs:
+            if glb.calc_ssim(paths[i], paths[j]) >= glb.SSIM_THR:
+                graph[i].add(j)
+                graph[j].add(i)
+        return graph
+    return run_stage(metrics, prefix + "ssim", verify, items=len(pairs))
+
+#both_matchers also times the matcher that is switched off, its stages get a "buckets_"/"cascade_" prefix
+def bench_images(metrics, work_dir, n, both_matchers=False):
+    from preprocess_logo import preprocess_image
+    import group_logos_buckets as glb
+    raw_dir = os.path.join(work_dir, "raw")
+    pre_dir = os.path.join(work_dir, "preprocessed")
+    Path(pre_dir).mkdir(parents=True, exist_ok=True)
+    names = generate_corpus(n, raw_dir)
+    paths = [os.path.join(pre_dir, name) for name in names]
+
+    def preprocess():
+        return [preprocess_image(os.path.join(raw_dir, name), path) for name, path in zip(names, paths)]
+    feats = run_stage(metrics, "preprocess", preprocess)
+    if glb.USE_CASCADE:
+        graph = bench_cascade(metrics, paths, feats)
+        if both_matchers:
+            bench_buckets(metrics, paths, prefix="buckets_")
+    else:
+        graph = bench_buckets(metrics, paths)
+        if both_matchers:
+            cascade = {}
+            bench_cascade(cascade, paths, feats)
+            metrics.update({f"cascade_{k}": v for k, v in cascade.items()})
+    comps = run_stage(metrics, "clustering", lambda: glb.connected_components(graph, len(names)))
+    metrics["clustering"]["groups"] = len(comps)
+    metrics["matcher"] = "cascade" if glb.USE_CASCADE else "buckets"
+
+def load_baseline():
+    if os.path.exists(BASELINE_JSON):
+        with open(BASELINE_JSON, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+# prints current vs baseline per stage, returns the stages slower than REGRESSION_TOL
+def compare(metrics, baseline):
+    regressions = []
+    print(f"\n{'stage':<18} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    if baseline.get("matcher") not in (None, metrics.get("matcher")):
+        print(f"[WARN] baseline was taken with the {baseline['matcher']} matcher, this run uses {metrics.get('matcher')}")
+    for stage, m in metrics.items():
+        if not isinstance(m, dict) or stage not in baseline:
+            continue
+        base = baseline[stage]["seconds"]
+        ratio = m["seconds"] / base if base else float("inf")
+        flag = " REGRESSION" if ratio > REGRESSION_TOL else ""
+        print(f"{stage:<18} {base:10.3f} {m['seconds']:10.3f} {ratio:7.2f}{flag}")
+        if flag:
+            regressions.append(stage)
+        if baseline[stage].get("groups") not in (None, m.get("groups")):
+            print(f"  [WARN] {stage}: groups changed {baseline[stage]['groups']} → {m.get('groups')}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark on synthetic logo corpora")
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--skip-network", action="store_true", help="only run the image stages")
+    parser.add_argument("--both-matchers", action="store_true", help="also time the matcher grouping is not configured to use")
+    parser.add_argument("--skip-memory", action="store_true", help="don't run every stage a second time under tracemalloc")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline for the scale")
+    args = parser.parse_args()
+    global MEASURE_MEMORY
+    MEASURE_MEMORY = not args.skip_memory
+
+    work_dir = os.path.join(BENCH_DIR, args.scale)
+    metrics = {}
+    if not args.skip_network:
+        bench_network(metrics, work_dir)
+    bench_images(metrics, work_dir, SCALES[args.scale], args.both_matchers)
+    # ru_maxrss is KB on linux
+    metrics["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(f"[BENCH] max RSS {metrics['max_rss_mb']}MB")
+
+    with open(os.path.join(work_dir, "results.json"), "w", encoding="utf-8") as f:
+        json.dump(metrics, f, indent=2)
+
+    baseline = load_baseline()
+    if args.save_baseline:
+        baseline[args.scale] = metrics
+        with open(BASELINE_JSON, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"[INFO] Baseline for {args.scale} saved to {BASELINE_JSON}")
+    elif args.scale in baseline:
+        regressions = compare(metrics, baseline[args.scale])
+        print(f"\n{len(regressions)} stage(s) slower than baseline: {', '.join(regressions) or '-'}")
+    else:
+        print(f"[INFO] No baseline for {args.scale}, run with --save-baseline to create one")
+
+if __name__ == "__main__":
+    main()
+
+# Benchmark harness:
+# Builds synthetic corpora (1k/10k/100k variants of the preprocessed logos + local HTML pages) and times every stage
+# (fetch, parse, preprocess, hash, candidates, cascade/ssim, clustering) so changes can be compared against a stored baseline.
+# The image stages follow the matcher group_logos_buckets is configured with, --both-matchers times the other one too.
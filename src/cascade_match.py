@@ -0,0 +1,177 @@
+import os
+import json
+import math
+from collections import defaultdict, Counter
+from functools import lru_cache
+from PIL import Image
+import numpy as np
+from skimage.metrics import structural_similarity as ssim
+import instrumentation as instr
+
+RAW_DIR  = "data/logos_preprocessed/"
+FEATURES = "data/logo_features.json" #colour histogram + aspect ratio written by preprocess_logo
+BAND_BITS = 16 #candidate generation: two logos are candidates if any 16 bit band of their pHash or dHash is identical
+MAX_BAND_BUCKET = 2000 #bands shared by more images than this (blank/white logos) don't generate candidates
+USE_FINGERPRINTS = True #logos sharing an identical precomputed fingerprint (trim/icon/zoom) become extra candidates
+FP_CLASSES = {"trim": "trim", "icon": "trim", "zoom": "zoom"} #views looked up in the same index, only icon and trim are mixed
+MIN_FP_BITS = 6 #fingerprints with fewer set (or unset) bits are near-uniform images and would link unrelated logos
+SSIM_THR = 0.75
+SSIM_CACHE = 4096 #decoded images kept in memory for the SSIM verifier
+
+# cascade filters from cheapest to most expensive, None disables a filter
+# hashes are hamming distance limits, aspect is max |log(a1/a2)|, colour is min histogram intersection
+CASCADE = {
+    "phash": 12,
+    "dhash": 16,
+    "ahash": 14,
+    "aspect": 0.35,
+    "colour": 0.45,
+}
+
+#packed 64 bit hashes, a hash is just an int so the distance is a popcount of the xor
+#batch_hash gives the same bits as imagehash's average_hash/dhash/phash for a whole list of files at once
+def packed_hashes(paths):
+    from batch_hash import hash_files
+    return [tuple(int(h) for h in row) for row in hash_files(paths)]
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def load_features():
+    if not os.path.exists(FEATURES):
+        return {}
+    with open(FEATURES, encoding="utf-8") as f:
+        return json.load(f)
+
+@lru_cache(maxsize=SSIM_CACHE)
+def load_gray(path):
+    return np.array(Image.open(path))
+
+#histogram intersection, 1.0 for identical colour distributions
+def hist_intersection(h1, h2):
+    return float(np.minimum(np.asarray(h1), np.asarray(h2)).sum())
+
+# candidate pairs from exact band lookups on the packed pHash/dHash, no all-pairs comparison
+def band_candidates(hashes):
+    bands_per_hash = 64 // BAND_BITS
+    mask = (1 << BAND_BITS) - 1
+    index = defaultdict(list)
+    for i, (_, dh, ph) in enumerate(hashes):
+        for kind, h in (("p", ph), ("d", dh)):
+            for b in range(bands_per_hash):
+                index[(kind, b, (h >> (b * BAND_BITS)) & mask)].append(i)
+    pairs = set()
+    for members in index.values():
+        if len(members) < 2 or len(members) > MAX_BAND_BUCKET:
+            continue
+        for x in range(len(members)):
+            for y in range(x + 1, len(members)):
+                pairs.add((members[x], members[y]))
+    return sorted(pairs)
+
+# exact hash-index lookup over the fingerprints from preprocess_logo, two logos sharing a fingerprint value of the same view
+# (trim/trim, icon/icon, zoom/zoom) or the icon of a icon+wordmark logo and the trimmed icon-only logo (icon/trim) are candidates
+#returns (i, j) -> cross, cross is True for icon/trim pairs, the whole-image filters don't apply to them
+def fingerprint_links(feats):
+    index = defaultdict(dict)
+    for i, f in enumerate(feats):
+        for view, value in ((f or {}).get("fp") or {}).items():
+            bits = bin(int(value, 16)).count("1")
+            if view in FP_CLASSES and MIN_FP_BITS <= bits <= 64 - MIN_FP_BITS:
+                index[(FP_CLASSES[view], value)].setdefault(i, set()).add(view)
+    links = {}
+    for members in index.values():
+        if 2 <= len(members) <= MAX_BAND_BUCKET:
+            order = sorted(members)
+            for x in range(len(order)):
+                for y in range(x + 1, len(order)):
+                    a, b = members[order[x]], members[order[y]]
+                    cross = not (a & b) #no view in common, so one side matched with its icon and the other with its trim
+                    links[(order[x], order[y])] = links.get((order[x], order[y]), False) or cross
+    return links
+
+# runs the cascade on one pair, returns the name of the filter that rejected it or None if SSIM confirmed it
+#verify=False skips SSIM (the icon/trim fingerprint pairs, their whole images are not supposed to look alike)
+def reject_reason(i, j, hashes, feats, paths, cascade=CASCADE, verify=True):
+    ah1, dh1, ph1 = hashes[i]
+    ah2, dh2, ph2 = hashes[j]
+    if cascade.get("phash") is not None and hamming(ph1, ph2) > cascade["phash"]:
+        return "phash"
+    if cascade.get("dhash") is not None and hamming(dh1, dh2) > cascade["dhash"]:
+        return "dhash"
+    if cascade.get("ahash") is not None and hamming(ah1, ah2) > cascade["ahash"]:
+        return "ahash"
+    f1, f2 = feats[i], feats[j]
+    if f1 and f2:
+        if cascade.get("aspect") is not None and abs(math.log(max(f1["aspect"], 1e-3) / max(f2["aspect"], 1e-3))) > cascade["aspect"]:
+            return "aspect"
+        # logos with no foreground colour (pure white) have an empty histogram, nothing to compare then
+        if cascade.get("colour") is not None and sum(f1["hist"]) and sum(f2["hist"]) and hist_intersection(f1["hist"], f2["hist"]) < cascade["colour"]:
+            return "colour"
+    if verify and ssim(load_gray(paths[i]), load_gray(paths[j])) < SSIM_THR:
+        return "ssim"
+    return None
+
+# band candidates plus the fingerprint links, returns (pairs for the full cascade, icon/trim pairs, fingerprint link count)
+# same view fingerprint links are extra candidates for the full cascade, icon/trim links only face the colour filter
+def cascade_candidates(hashes, feats):
+    links = {}
+    if USE_FINGERPRINTS:
+        with instr.timer("fingerprint_links"):
+            links = fingerprint_links(feats)
+    with instr.timer("candidates"):
+        pairs = sorted(set(band_candidates(hashes)) | {p for p, cross in links.items() if not cross})
+    cross_links = sorted(p for p, cross in links.items() if cross)
+    return pairs, cross_links, len(links)
+
+# runs the filters on every candidate, returns the graph (index -> set of neighbours) and the per filter counters
+def verify_candidates(pairs, cross_links, hashes, feats, paths, cascade=CASCADE):
+    graph = defaultdict(set)
+    stats = Counter(candidates=len(pairs), fingerprint_cross=len(cross_links))
+    with instr.timer("cascade_all"), instr.profiled("cascade_loop"):
+        for i, j in cross_links:
+            if reject_reason(i, j, hashes, feats, paths, {"colour": cascade.get("colour")}, verify=False):
+                stats["rejected_fingerprint_cross"] += 1
+                continue
+            stats["matched_fingerprint_cross"] += 1
+            graph[i].add(j)
+            graph[j].add(i)
+        for i, j in pairs:
+            reason = reject_reason(i, j, hashes, feats, paths, cascade)
+            if reason:
+                stats[f"rejected_{reason}"] += 1
+                continue
+            stats["matched"] += 1
+            graph[i].add(j)
+            graph[j].add(i)
+    return graph, stats
+
+# same output as build_similarity_graph (index -> set of neighbours) plus per filter counters
+def build_cascade_graph(filenames, raw_dir=RAW_DIR, cascade=CASCADE):
+    paths = [os.path.join(raw_dir, f) for f in filenames]
+    with instr.timer("hashes_all", images=len(filenames)):
+        hashes = packed_hashes(paths)
+    all_feats = load_features()
+    feats = [all_feats.get(f) for f in filenames]
+
+    pairs, cross_links, n_links = cascade_candidates(hashes, feats)
+    graph, stats = verify_candidates(pairs, cross_links, hashes, feats, paths, cascade)
+    stats["fingerprint_links"] = n_links
+    for name, n in stats.items():
+        instr.count("cascade", n, stage=name)
+    return graph, stats
+
+def print_stats(stats):
+    remaining = stats["candidates"]
+    print(f"[CASCADE] {stats.get('fingerprint_links', 0)} pairs share a fingerprint, {stats.get('fingerprint_cross', 0)} of them icon/trim")
+    print(f"[CASCADE] icon/trim pairs: matched {stats.get('matched_fingerprint_cross', 0)}, colour filter eliminated {stats.get('rejected_fingerprint_cross', 0)}")
+    print(f"[CASCADE] {remaining} candidate pairs")
+    for name in list(CASCADE) + ["ssim"]:
+        n = stats.get(f"rejected_{name}", 0)
+        print(f"[CASCADE] {name:<7} eliminated {n:>8} ({n / max(remaining, 1):6.1%} of pairs reaching it)")
+        remaining -= n
+    print(f"[CASCADE] matched {stats.get('matched', 0)}")
+
+# Cascade matcher for the grouping stage:
+# Logos sharing a precomputed fingerprint of the same view are extra candidates (icon/trim pairs only face the colour filter), other candidates come from exact lookups on 16 bit bands of packed pHash/dHash, then every pair goes through
+# cheap filters (hash distances, aspect ratio, colour histogram) and only the survivors are verified with SSIM.
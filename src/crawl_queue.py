@@ -0,0 +1,382 @@
+import os
+import csv
+import json
+import time
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+import instrumentation as instr
+
+QUEUE_DB      = "data/crawl_queue.sqlite" #one file on a filesystem every worker host can reach
+N_SHARDS      = 64 #domains are spread over shards by hash, each worker drains its own shard first
+LEASE_BATCH   = 20 #domains leased at a time
+LEASE_SECONDS = 300 #a lease not renewed for this long goes back to pending (worker died or hung)
+HEARTBEAT     = 60 #seconds between lease renewals, well below LEASE_SECONDS
+MAX_ATTEMPTS  = 3 #leases lost on the same domain before it's marked failed (a domain that keeps killing workers)
+IDLE_WAIT     = 10 #seconds a worker waits when nothing is pending but other workers still hold leases
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    domain TEXT PRIMARY KEY,
+    shard INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', -- pending, leased, done, failed, dead
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_shard_status ON tasks (shard, status);
+CREATE INDEX IF NOT EXISTS tasks_status_lease ON tasks (status, lease_until);
+-- results of finished domains, merged into logo_hashes.json / crawl_state.json (and the manifest) once the queue is drained
+CREATE TABLE IF NOT EXISTS logo_hashes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, -- workers pull the rows added since their last batch for deduplication
+    hash TEXT UNIQUE NOT NULL,
+    filename TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS crawl_state (
+    domain TEXT PRIMARY KEY,
+    entry TEXT NOT NULL -- crawl_state.json entry as json
+);
+-- STREAM_PREPROCESS: one row per (logo, domain) the worker's StreamPreprocessor handled, for logo_manifest.json / logo_features.json
+CREATE TABLE IF NOT EXISTS manifest (
+    hash TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    file TEXT NOT NULL, -- preprocessed file
+    features TEXT, -- logo_features.json entry of the file as json
+    PRIMARY KEY (hash, domain)
+);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    shard INTEGER,
+    heartbeat REAL
+);
+"""
+
+def shard_of(domain, n_shards=N_SHARDS):
+    from parquet_ingest import domain_hash
+    return domain_hash(domain) % n_shards
+
+# sqlite's own file locks do the coordination: every state change is one BEGIN IMMEDIATE transaction
+# rollback journal instead of WAL, WAL's shared memory index doesn't work across hosts on a network filesystem
+class CrawlQueue:
+    def __init__(self, path=QUEUE_DB, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = sqlite3.connect(path, timeout=60)
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    #one connection per call, so the heartbeat thread and the crawl loop never share one
+    @contextmanager
+    def transaction(self):
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=DELETE")
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    # adds domains as pending, already queued ones are left alone so a rerun only adds the new domains
+    def fill(self, domains, chunk=10_000):
+        added, batch = 0, []
+        def flush():
+            with self.transaction() as db:
+                before = db.total_changes
+                db.executemany("INSERT OR IGNORE INTO tasks (domain, shard, updated) VALUES (?, ?, ?)", batch)
+                return db.total_changes - before
+        now = time.time()
+        for domain in domains:
+            batch.append((domain, shard_of(domain), now))
+            if len(batch) >= chunk:
+                added += flush()
+                batch = []
+        if batch:
+            added += flush()
+        return added
+
+    # home shard: the one with pending work and the fewest live workers, so workers start spread out
+    def register(self, worker):
+        now = time.time()
+        with self.transaction() as db:
+            rows = db.execute("""
+                SELECT t.shard, COUNT(*) AS pending,
+                       (SELECT COUNT(*) FROM workers w WHERE w.shard = t.shard AND w.heartbeat > ?) AS live
+                FROM tasks t WHERE t.status = 'pending' GROUP BY t.shard ORDER BY live, pending DESC LIMIT 1
+            """, (now - self.lease_seconds,)).fetchall()
+            shard = rows[0][0] if rows else 0
+            db.execute("INSERT OR REPLACE INTO workers (worker, host, pid, shard, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                       (worker, socket.gethostname(), os.getpid(), shard, now))
+        return shard
+
+    #expired leases go back to pending, or to failed once a domain has lost MAX_ATTEMPTS leases
+    def _requeue_expired(self, db, now):
+        expired = db.execute("SELECT COUNT(*) FROM tasks WHERE status = 'leased' AND lease_until < ?", (now,)).fetchone()[0]
+        if expired:
+            db.execute("""UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                          result = CASE WHEN attempts >= ? THEN 'lease expired' ELSE result END, worker = NULL, updated = ?
+                          WHERE status = 'leased' AND lease_until < ?""", (self.max_attempts, self.max_attempts, now, now))
+            instr.count("queue_requeued", expired)
+        return expired
+
+    # leases up to n domains from the home shard, or steals from the tail of the biggest pending shard when it's empty
+    # (the owner of that shard takes from the head, so the two don't keep hitting the same rows)
+    def lease(self, worker, shard, n=LEASE_BATCH):
+        now = time.time()
+        with self.transaction() as db:
+            self._requeue_expired(db, now)
+            rows = db.execute("SELECT domain FROM tasks WHERE shard = ? AND status = 'pending' ORDER BY rowid LIMIT ?", (shard, n)).fetchall()
+            stolen = False
+            if not rows:
+                victim = db.execute("SELECT shard FROM tasks WHERE status = 'pending' GROUP BY shard ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+                if victim:
+                    rows = db.execute("SELECT domain FROM tasks WHERE shard = ? AND status = 'pending' ORDER BY rowid DESC LIMIT ?", (victim[0], n)).fetchall()
+                    stolen = True
+            domains = [r[0] for r in rows]
+            db.executemany("UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE domain = ?",
+                           [(worker, now + self.lease_seconds, now, d) for d in domains])
+            db.execute("UPDATE workers SET heartbeat = ? WHERE worker = ?", (now, worker))
+        if stolen and domains:
+            instr.count("queue_stolen", len(domains))
+        return domains
+
+    #extends every lease the worker still holds
+    def heartbeat(self, worker):
+        now = time.time()
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET lease_until = ? WHERE worker = ? AND status = 'leased'", (now + self.lease_seconds, worker))
+            db.execute("UPDATE workers SET heartbeat = ? WHERE worker = ?", (now, worker))
+
+    # done/failed/dead for a batch of leased domains in one transaction, finished is [(domain, status, result)]
+    # logos maps a done domain to (hash, filename, crawl state entry), stored only while the worker still holds the lease
+    # (a lost lease drops the result, whoever holds the domain now will report it)
+    # preprocessed maps a done domain to (preprocessed file, features) when the worker streams into a StreamPreprocessor
+    # returns the lost domains and the (id, hash, filename) rows other workers added after since_id
+    def complete_batch(self, worker, finished, logos, since_id=0, preprocessed=None):
+        preprocessed = preprocessed or {}
+        lost = set()
+        now = time.time()
+        with self.transaction() as db:
+            for domain, status, result in finished:
+                cur = db.execute("UPDATE tasks SET status = ?, result = ?, worker = NULL, updated = ? WHERE domain = ? AND worker = ? AND status = 'leased'",
+                                 (status, result, now, domain, worker))
+                if cur.rowcount != 1:
+                    lost.add(domain)
+                elif domain in logos:
+                    img_hash, filename, entry = logos[domain]
+                    db.execute("INSERT OR IGNORE INTO logo_hashes (hash, filename) VALUES (?, ?)", (img_hash, filename))
+                    db.execute("INSERT OR REPLACE INTO crawl_state (domain, entry) VALUES (?, ?)", (domain, json.dumps(entry)))
+                    if domain in preprocessed:
+                        out, features = preprocessed[domain]
+                        db.execute("INSERT OR REPLACE INTO manifest (hash, domain, file, features) VALUES (?, ?, ?, ?)",
+                                   (img_hash, domain, out, json.dumps(features)))
+            new = db.execute("SELECT id, hash, filename FROM logo_hashes WHERE id > ? ORDER BY id", (since_id,)).fetchall()
+        return lost, new
+
+    # writes every stored result into logo_hashes.json, crawl_state.json and the preprocess manifest/features at once
+    # (atomic replaces) and clears them from the queue, run when the queue is drained so the json files are rewritten
+    # once instead of per batch
+    def merge_results(self):
+        import download_logos as dl
+        from crawl_state import load_state, save_state
+        with self.transaction() as db:
+            hashes = db.execute("SELECT hash, filename FROM logo_hashes").fetchall()
+            states = db.execute("SELECT domain, entry FROM crawl_state").fetchall()
+            preprocessed = db.execute("SELECT hash, domain, file, features FROM manifest ORDER BY rowid").fetchall()
+            if not hashes and not states and not preprocessed:
+                return 0
+            if preprocessed:
+                merge_manifest(preprocessed)
+            on_disk = dl.load_existing_hashes()
+            on_disk.update(hashes)
+            dl.save_existing_hashes(on_disk)
+            disk_state = load_state()
+            disk_state.update((domain, json.loads(entry)) for domain, entry in states)
+            save_state(disk_state)
+            db.execute("DELETE FROM logo_hashes")
+            db.execute("DELETE FROM crawl_state")
+            db.execute("DELETE FROM manifest")
+        return len(states)
+
+    #leases held by a worker that stops cleanly go back to pending right away instead of waiting for them to expire
+    def release(self, worker):
+        with self.transaction() as db:
+            db.execute("UPDATE tasks SET status = 'pending', worker = NULL, attempts = attempts - 1 WHERE worker = ? AND status = 'leased'", (worker,))
+            db.execute("DELETE FROM workers WHERE worker = ?", (worker,))
+
+    def counts(self):
+        with self.transaction() as db:
+            self._requeue_expired(db, time.time())
+            return dict(db.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+
+def _write_json(path, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+#(hash, domain, file, features json) rows into logo_manifest.json / logo_features.json, same entries StreamPreprocessor.add makes
+def merge_manifest(rows):
+    from preprocess_logo import MANIFEST, FEATURES, add_domains
+    manifest, features = {}, {}
+    if os.path.exists(MANIFEST):
+        with open(MANIFEST, encoding="utf-8") as f:
+            manifest = json.load(f)
+    if os.path.exists(FEATURES):
+        with open(FEATURES, encoding="utf-8") as f:
+            features = json.load(f)
+    for img_hash, domain, out, feats in rows:
+        entry = manifest.setdefault(img_hash, {"file": out, "domains": []})
+        add_domains(entry, [domain])
+        if entry["file"] not in features and feats != "null":
+            features[entry["file"]] = json.loads(feats)
+    _write_json(MANIFEST, manifest)
+    _write_json(FEATURES, features)
+
+# renews the worker's leases every HEARTBEAT seconds from a daemon thread, but only when the crawl loop reported
+# progress (beat()) since the last renewal, a hung loop stops renewing and its leases expire
+class Heartbeat:
+    def __init__(self, queue, worker, interval=HEARTBEAT):
+        self.queue, self.worker, self.interval = queue, worker, interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._progress = 0
+
+    #called by the crawl loop after every domain
+    def beat(self):
+        self._progress += 1
+
+    def _run(self):
+        seen = self._progress
+        while not self._stop.wait(self.interval):
+            if self._progress == seen:
+                instr.count("heartbeat_skipped")
+                continue
+            seen = self._progress
+            try:
+                self.queue.heartbeat(self.worker)
+            except sqlite3.Error as e:
+                print(f"[WARN] heartbeat failed: {e!r}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def work(queue=None, worker=None):
+    import download_logos as dl
+    from preflight import split_alive_dead
+    from crawl_state import load_state, update_state
+    queue = queue or CrawlQueue()
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    dl.ensure_dirs()
+    instr.start_run("crawl_worker")
+    with queue.transaction(): #merge_results rewrites the json files under the same lock
+        existing_hashes = dl.load_existing_hashes()
+        state = load_state()
+        sink = None
+        if dl.STREAM_PREPROCESS:
+            #never saved by the worker, its manifest entries go through the queue db like the hashes
+            #a logo another worker already preprocessed in this run is preprocessed again once here (same file, same features)
+            from preprocess_logo import StreamPreprocessor
+            sink = StreamPreprocessor()
+    since_id = 0
+    shard = queue.register(worker)
+    counts = {"done": 0, "failed": 0, "dead": 0, "lost": 0}
+    print(f"[WORKER] {worker} starting on shard {shard}")
+    try:
+        with Heartbeat(queue, worker) as heartbeat, instr.profiled("crawl_worker_loop"):
+            while True:
+                batch = queue.lease(worker, shard)
+                if not batch:
+                    left = queue.counts()
+                    if not left.get("leased"):
+                        break
+                    time.sleep(IDLE_WAIT) #other workers' leases may still expire and come back
+                    continue
+                domains, finished, logos, preprocessed = batch, [], {}, {}
+                if dl.PREFLIGHT:
+                    domains, dead = split_alive_dead(batch)
+                    finished += [(d, "dead", f"{reason}: {details}") for d, reason, details in dead]
+                    heartbeat.beat()
+                for domain in domains:
+                    try:
+                        with instr.timer("domain", domain=domain):
+                            logo_url, strategy, filename, img_hash, message, resp = dl.download_domain(domain, existing_hashes, sink)
+                        dl.record_domain_hash(domain, img_hash, filename)
+                        logos[domain] = (img_hash, filename, update_state(state, domain, logo_url, strategy, filename, img_hash, resp))
+                        entry = sink.manifest.get(img_hash) if sink is not None else None
+                        if entry and domain in entry["domains"]: #not there when preprocessing failed
+                            preprocessed[domain] = (entry["file"], sink.features.get(entry["file"]))
+                        finished.append((domain, "done", message))
+                        print(f"[SUCCESS] {domain} → {logo_url} [{strategy}] (hash={img_hash})")
+                    except Exception as e:
+                        finished.append((domain, "failed", str(e)))
+                        print(f"[FAILURE] {domain} → {e!r}")
+                    heartbeat.beat()
+                #results go to the queue db with the task updates, the other workers' new logos come back for deduplication
+                lost, new = queue.complete_batch(worker, finished, logos, since_id, preprocessed)
+                for row_id, img_hash, filename in new:
+                    existing_hashes.setdefault(img_hash, filename)
+                    since_id = row_id
+                with open(dl.FAILED_CSV, "a", newline="", encoding="utf-8") as cf:
+                    writer = csv.writer(cf)
+                    for domain, status, result in finished:
+                        if domain in lost:
+                            counts["lost"] += 1
+                            continue
+                        counts[status] += 1
+                        if status != "done":
+                            writer.writerow([domain, "fail" if status == "failed" else status, result])
+    finally:
+        queue.release(worker)
+        left = queue.counts()
+        if not left.get("pending") and not left.get("leased"):
+            print(f"[WORKER] queue drained, {queue.merge_results()} crawl state entries merged into the json files")
+        for name, n in counts.items():
+            instr.count("queue_result", n, status=name)
+        instr.finish_run()
+    print(f"\n[WORKER] {worker}: {counts['done']} done, {counts['failed']} failed, {counts['dead']} dead, {counts['lost']} leases lost")
+    return counts
+
+def fill_from_parquet(path=None):
+    from parquet_ingest import PARQUET_FILE, iter_domains
+    queue = CrawlQueue()
+    added = queue.fill(iter_domains(path or PARQUET_FILE))
+    print(f"[QUEUE] {added} new domains queued in {QUEUE_DB}")
+    print(f"[QUEUE] {queue.counts()}")
+
+if __name__ == "__main__":
+    import sys
+    command = sys.argv[1] if len(sys.argv) > 1 else "work"
+    if command == "fill":
+        fill_from_parquet(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif command == "status":
+        print(CrawlQueue().counts())
+    elif command == "merge": #results of a run that was stopped before the queue drained
+        print(f"[QUEUE] {CrawlQueue().merge_results()} crawl state entries merged")
+    else:
+        work()
+
+# Crawl queue:
+# Durable sqlite work queue for running many download_logos workers (one host or several sharing a filesystem):
+# `fill` shards the parquet domain list into it, every `work` process leases batches, renews them with heartbeats,
+# steals from the biggest shard once its own is empty, and leases of dead workers go back to pending automatically.
+# Per domain results are stored in the queue db and merged into logo_hashes.json / crawl_state.json once, when it drains.
+# With STREAM_PREPROCESS every worker preprocesses its downloads too, the manifest/features entries are merged the same way.
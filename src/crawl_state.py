@@ -0,0 +1,55 @@
+import os
+import json
+import time
+import threading
+
+STATE_FILE = "data/crawl_state.json"
+
+_lock = threading.Lock()
+
+# {domain: {"url", "strategy", "hash", "filename", "etag", "last_modified", "checked", "changed"}}
+def load_state():
+    if os.path.exists(STATE_FILE) and os.stat(STATE_FILE).st_size > 0:
+        with open(STATE_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+def save_state(state):
+    with _lock:
+        tmp = STATE_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, STATE_FILE)
+
+#last seen logo of a domain, resp is the asset response when we have it (its ETag/Last-Modified are kept for revalidation)
+def update_state(state, domain, logo_url, strategy, filename, img_hash, resp=None):
+    now = int(time.time())
+    with _lock:
+        entry = state.setdefault(domain, {})
+        if entry.get("hash") != img_hash:
+            entry["changed"] = now
+        if entry.get("url") != logo_url:
+            entry.pop("etag", None)
+            entry.pop("last_modified", None)
+        entry.update({"url": logo_url, "strategy": strategy, "hash": img_hash, "filename": filename, "checked": now})
+        if resp is not None:
+            for key, header in (("etag", "ETag"), ("last_modified", "Last-Modified")):
+                if resp.headers.get(header):
+                    entry[key] = resp.headers[header]
+        return entry
+
+def touch(state, domain):
+    with _lock:
+        state[domain]["checked"] = int(time.time())
+
+#conditional request headers for the stored asset
+def validators(entry):
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+# Crawl state:
+# Per domain last seen logo URL, strategy, content hash, stored file and HTTP validators, written by every crawl and read by recrawl.
@@ -23,48 +23,69 @@ def classify_browser_access(reason):
         return "maybe"
     return "maybe"
 
-def diagnose_error(domain):
+#reason for a homepage response that didn't lead to a logo (403 WAF pages, parked/test pages, js redirects...)
+def classify_response(resp):
+    txt = resp.text.lower()
+     # check for known anti-bot systems or access restrictions
+    if resp.status_code == 403:
+        if "cloudflare" in txt:
+            return "blocked-bot-waf", "Cloudflare 403"
+        if "incapsula" in txt:
+            return "blocked-bot-waf", "Incapsula 403"
+        return "blocked-bot-waf", "HTTP 403 Forbidden"
+    if "robots" in txt and "noindex" in txt:
+        return "blocked-bot-waf", "robots noindex found"
+    if "apache http server test page" in txt or "testing123" in txt:
+        return "server-default-page", "Default/test page served"
+    if "certificate expired" in txt or "certificate verify failed" in txt:
+        return "ssl", "SSL cert expired/failed"
+    if resp.status_code == 200 and len(resp.text) < 500:
+        if "window.location" in txt or "redirect" in txt:
+            return "redirect", "HTML redirect/script"
+        return "unexpected-html", f"200 OK but suspiciously short ({len(resp.text)} bytes)"
+    if resp.status_code == 404:
+        return "not-found", "HTTP 404"
+    return "other-http", f"HTTP {resp.status_code}"
+
+#reason for an exception raised by the homepage GET
+def classify_exception(e):
+    from net_policy import CircuitOpen, is_dns_error
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return classify_response(e.response)
+    if isinstance(e, requests.exceptions.SSLError):
+        return "ssl", str(e) #expired ssl certificate
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return "timeout", str(e) # conn timeout
+    if isinstance(e, CircuitOpen):
+        return "connection-error", str(e) #the host already failed several times in this run
+    if isinstance(e, requests.exceptions.ConnectionError): #general error
+        msg = str(e)
+        if is_dns_error(e) or "getaddrinfo failed" in msg or "NXDOMAIN" in msg:
+            return "dns", msg
+        return "connection-error", msg
+    msg = str(e)
+    if "timed out" in msg:
+        return "timeout", msg
+    return "unknown", msg
+
+# failure is the exception download_domain raised: its homepage response (or the error of that fetch) is classified
+# directly, only a domain without either gets a new GET
+def diagnose_error(domain, failure=None):
+    if getattr(failure, "homepage", None) is not None:
+        return classify_response(failure.homepage)
+    if getattr(failure, "error", None) is not None:
+        return classify_exception(failure.error)
     url = "https://" + domain
     try:
         resp = requests.get(url, headers=HEADERS, timeout=8, verify=True, allow_redirects=True)
-        txt = resp.text.lower()
-         # check for known anti-bot systems or access restrictions
-        if resp.status_code == 403:
-            if "cloudflare" in txt:
-                return "blocked-bot-waf", "Cloudflare 403"
-            if "incapsula" in txt:
-                return "blocked-bot-waf", "Incapsula 403"
-            return "blocked-bot-waf", "HTTP 403 Forbidden"
-        if "robots" in txt and "noindex" in txt:
-            return "blocked-bot-waf", "robots noindex found"
-        if "apache http server test page" in txt or "testing123" in txt:
-            return "server-default-page", "Default/test page served"
-        if "certificate expired" in txt or "certificate verify failed" in txt:
-            return "ssl", "SSL cert expired/failed"
-        if resp.status_code == 200 and len(resp.text) < 500:
-            if "window.location" in txt or "redirect" in txt:
-                return "redirect", "HTML redirect/script"
-            return "unexpected-html", f"200 OK but suspiciously short ({len(resp.text)} bytes)"
-        if resp.status_code == 404:
-            return "not-found", "HTTP 404"
-        return "other-http", f"HTTP {resp.status_code}"
-    except requests.exceptions.SSLError as ssl_e:
-        return "ssl", str(ssl_e) #expired ssl certificate
-    except requests.exceptions.ConnectTimeout as ce:
-        return "timeout", str(ce) # conn timeout
-    except requests.exceptions.ConnectionError as ce: #general error
-        msg = str(ce)
-        if "Name or service not known" in msg or "getaddrinfo failed" in msg or "NXDOMAIN" in msg:
-            return "dns", msg
-        return "connection-error", msg
     except Exception as e:
-        msg = str(e)
-        if "timed out" in msg:
-            return "timeout", msg
-        return "unknown", msg
+        return classify_exception(e)
+    return classify_response(resp)
 
 def test_sites_from_failed_csv():
+    from preflight import preflight_domains, is_dead
     seen = set()
+    domains = []
     results = []
     with open(FAILED_CSV, newline="", encoding="utf-8") as f:
         reader = csv.DictReader(f)
@@ -73,17 +94,24 @@ def test_sites_from_failed_csv():
             if domain in seen:
                 continue
             seen.add(domain)
-            print(f"\nTesting: {domain}")
+            domains.append(domain)
+
+    #probe everything in bulk first, dead domains keep the preflight reason and skip the full GET
+    for domain, pre_reason, pre_details in preflight_domains(domains):
+        print(f"\nTesting: {domain}")
+        if is_dead(pre_reason):
+            reason, details = pre_reason, pre_details
+        else:
             reason, details = diagnose_error(domain)
-            browser_accessible = classify_browser_access(reason)
-            print(f"  Reason: {reason}\n  Details: {details[:180]}...\n  Browser Accessible: {browser_accessible}")
-            results.append({
-                "domain": domain,
-                "reason": reason,
-                "details": details,
-                "browser_accessible": browser_accessible
-            })
             time.sleep(1) #small delay to avoid overload of remote servers to not get flagged as bot 
+        browser_accessible = classify_browser_access(reason)
+        print(f"  Reason: {reason}\n  Details: {details[:180]}...\n  Browser Accessible: {browser_accessible}")
+        results.append({
+            "domain": domain,
+            "reason": reason,
+            "details": details,
+            "browser_accessible": browser_accessible
+        })
 
    
     with open(OUT_CSV, "w", newline="", encoding="utf-8") as cf:
@@ -7,16 +7,39 @@ from bs4 import BeautifulSoup #navigate html or xml
 from pathlib import Path
 import hashlib
 import json
+import threading
+from preflight import split_alive_dead
+import instrumentation as instr
+import net_policy
+import watchlist
+from strategy_stats import site_pattern, load_stats, save_stats, record_win, order_from_stats
+from crawl_state import load_state, save_state, update_state
 
 # config 
 SUBSET_CSV    = "batches/batch_023.csv"
 OUTPUT_DIR    = "data/logos/"
 FAILED_CSV    = "data/failed_sites.csv"
-HTTP_TIMEOUT  = 8 #number of seconds to wait for a servers response before giving up
+PREFLIGHT     = True #probe dns/tcp/tls first and skip dead domains before the full fetch
+STREAM_PREPROCESS = False #normalize fetched bytes in memory, the run writes the original + the preprocessed png and nothing else
+WATCHLIST     = True #match every saved logo against the protected brand logos in data/watchlist/, alerts go to data/watchlist_alerts.jsonl
+INLINE_SVG    = "#inline-svg" #logo_url suffix of svgs taken from the homepage markup, they have no asset url of their own
 USER_AGENT    = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko)" #mimics real browser to not get detected as bot and get blocked by websites 
 
+#find_logo_url strategies, the default order favours precision (strict header rules before og:image/favicon)
+STRATEGY_ORDER = ["img-header-logo", "svg-inline-header", "link-logo", "og-image", "twitter-image", "icon", "brand-homepage", "favicon"]
+EXPENSIVE_STRATEGIES = {"icon", "brand-homepage", "favicon"} #these need extra fetches, always tried after the cheap ones
+ADAPTIVE_ORDER = False #reorder strategies from data/strategy_stats.json, off by default because it can trade precision for speed
+FETCH_BUDGET = 4 #max fetches per domain: homepage, icon, favicon and brand homepages all count
+MAX_BRAND_FALLBACKS = 2 #max foreign homepages tried by the brand-homepage strategy
+FAVICON_RESERVE = 1 #fetches the brand-homepage lookups leave unspent, the domain's own /favicon.ico comes after them
+#wins per strategy, global and per site pattern, loaded in main and saved at the end of a run
+STRATEGY_STATS = {"global": {}, "patterns": {}}
+_hashes_lock = threading.Lock()
+
 #store the hash to logo map for deduplication on the big parquet to compare all of the domains not only the ones from singural batches 
 HASHES_FILE = "data/logo_hashes.json"
+#every domain -> logo hash, a hash saved once can be used by many domains (franchises, regional sites)
+DOMAIN_HASHES_CSV = "data/domain_hashes.csv"
 
 def load_existing_hashes():
     if os.path.exists(HASHES_FILE):
@@ -29,50 +52,94 @@ def load_existing_hashes():
             return json.load(f)
     return {}
 
-#persistent hash map for all runs
+#persistent hash map for all runs, written to a tmp file and swapped in so a reader never sees half a file
 def save_existing_hashes(existing_hashes):
-    with open(HASHES_FILE, "w", encoding="utf-8") as f:
+    tmp = HASHES_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(existing_hashes, f)
+    os.replace(tmp, HASHES_FILE)
+
+#append domain -> hash so preprocessing and grouping can fan duplicates back out to every domain
+def record_domain_hash(domain, img_hash, filename):
+    new_file = not os.path.exists(DOMAIN_HASHES_CSV) or os.stat(DOMAIN_HASHES_CSV).st_size == 0
+    with open(DOMAIN_HASHES_CSV, "a", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["domain", "hash", "filename"])
+        writer.writerow([domain, img_hash, filename])
 
 #ensure necessary directories exist
 def ensure_dirs():
     Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
     Path(os.path.dirname(FAILED_CSV)).mkdir(parents=True, exist_ok=True)
 
-#load clean and deduplicate domains
-def load_and_clean_domains():
-    seen = set()
-    cleaned = []
+#rows of the subset file, SUBSET_CSV can also be a parquet work shard from batches_parquet
+def iter_subset_rows():
+    if SUBSET_CSV.endswith(".parquet"):
+        from parquet_ingest import iter_domains
+        for d in iter_domains(SUBSET_CSV):
+            yield {"domain": d}
+        return
     with open(SUBSET_CSV, newline="", encoding="utf-8") as f:
         reader = csv.DictReader(f) #returns each row as a dictionary insteand of a list
         if "domain" not in reader.fieldnames:
             raise KeyError("Expected 'domain' column in subset CSV")
-        for row in reader:
-            raw = row["domain"]
-            dom = raw.strip().lower().rstrip(" ,/\\") #remove whitespace, truns to lowercae and removes , /
-            if not dom: continue
-            if dom not in seen:#add the domain to a set so it ll not clean it again
-                seen.add(dom)
-                cleaned.append(dom) 
+        yield from reader
+
+#load clean and deduplicate domains
+def load_and_clean_domains():
+    seen = set()
+    cleaned = []
+    rows = iter_subset_rows()
+    for row in rows:
+        raw = row["domain"]
+        dom = raw.strip().lower().rstrip(" ,/\\") #remove whitespace, truns to lowercae and removes , /
+        if not dom: continue
+        if dom not in seen:#add the domain to a set so it ll not clean it again
+            seen.add(dom)
+            cleaned.append(dom) 
             
     return cleaned
 
-#fetching an URL via HTTP GET
-def fetch_url(url, try_http_fallback=True):
+#GET + timing: ttfb is requests' elapsed (until headers arrive), download is the rest of the body
+#timeouts come from net_policy (observed latency percentiles), hosts with an open circuit breaker raise CircuitOpen right away
+def timed_get(url, headers=None):
+    net_policy.check(url)
+    t0 = time.perf_counter()
     try:
-        resp = requests.get(url, timeout=HTTP_TIMEOUT, headers={"User-Agent": USER_AGENT})
+        resp = requests.get(url, timeout=net_policy.timeouts(), headers={"User-Agent": USER_AGENT, **(headers or {})})
+    except Exception as e:
+        net_policy.record_failure(url, e)
+        raise
+    total = time.perf_counter() - t0
+    ttfb = resp.elapsed.total_seconds()
+    net_policy.record_success(url, ttfb)
+    instr.observe("ttfb", ttfb, url=url)
+    instr.observe("download", max(total - ttfb, 0.0), url=url, bytes=len(resp.content))
+    return resp
+
+#fetching an URL via HTTP GET, hedge=True for logo assets (a second copy is sent if the first one is slow)
+#errors collects the exceptions (https first), so a failure can be diagnosed without fetching the page again
+def fetch_url(url, try_http_fallback=True, hedge=False, errors=None):
+    get = (lambda u: net_policy.hedged(lambda: timed_get(u))) if hedge else timed_get
+    try:
+        resp = get(url)
         resp.raise_for_status()
         return resp
     except Exception as e:
-        if try_http_fallback and url.startswith("https://"):
+        if errors is not None:
+            errors.append(e)
+        #dns failures and open breakers are per host, plain http would fail the same way
+        if try_http_fallback and url.startswith("https://") and not isinstance(e, net_policy.CircuitOpen) and not net_policy.is_dns_error(e):
             #fallback trying with http
             http_url = "http://" + url[8:]
             try:
-                resp = requests.get(http_url, timeout=HTTP_TIMEOUT, headers={"User-Agent": USER_AGENT})
+                resp = get(http_url)
                 resp.raise_for_status() #rasie errors with status code
                 return resp
-            except Exception:
-                pass
+            except Exception as e:
+                if errors is not None:
+                    errors.append(e)
         # Returnăm None dacă nu poate fi accesat, nu logăm aici!
         return None
 
@@ -91,32 +158,26 @@ def is_logo_context(el):
         el = el.parent
     return False
 
-def extract_svg_logo(soup, safe_name):
+def extract_svg_logo(soup):
     #loop through all svgs
     for svg in soup.find_all("svg"):
-        #through the heuristic checks if the svg is likely the main logo, convert tag to string and returns file path
+        #through the heuristic checks if the svg is likely the main logo, convert tag to string and return the markup
+        #it stays in memory, download_domain hashes and stores it once
         if is_logo_context(svg):
-            svg_str = str(svg) #getting the entire svg xml from html code 
-            svg_path = os.path.join(OUTPUT_DIR, f"{safe_name}.svg")
-            with open(svg_path, "w", encoding="utf-8") as f:
-                f.write(svg_str)
-            return svg_path
+            return str(svg) #getting the entire svg xml from html code 
     return None
 
-#extracting the main logo url or svg 
-def find_logo_url(domain, fallback_brand_search=True):
-    base = f"https://{domain}"
-    safe = domain.replace(".", "_")
-    resp = fetch_url(base)
-    if resp is None:
-        # site cannot be reached 
-        return None, "site-unreachable", None
-
-    #parsw w beautifulsoup
-    soup = BeautifulSoup(resp.text, "html.parser")
+#a logical fetch (https + http fallback) charged to the domain budget, None once the budget is used up
+def budget_fetch(url, budget, errors=None):
+    if budget["left"] <= 0:
+        instr.count("fetch_budget_exhausted")
+        return None
+    budget["left"] -= 1
+    return fetch_url(url, errors=errors)
 
 # 1 look for likely img tags that could represent logo 
-    imgs = soup.find_all("img", src=True)
+def strat_img_header(ctx):
+    imgs = ctx["soup"].find_all("img", src=True)
     header_imgs = []
     for img in imgs:
         # gather possible logo indicators from src, alt, class, and id
@@ -140,102 +201,185 @@ def find_logo_url(domain, fallback_brand_search=True):
         #sometimes logo is the smallest in the header
         header_imgs.sort(key=lambda x: x[0])
         #return the image url
-        return urljoin(base, header_imgs[0][1]), "img-header-logo", None
+        return urljoin(ctx["base"], header_imgs[0][1]), "img-header-logo", None
 
 # 2 look for inline svg logo
-    svg_path = extract_svg_logo(soup, safe)
-    if svg_path:
-        return svg_path, "svg-inline-header", svg_path
+def strat_svg_inline(ctx):
+    svg_str = extract_svg_logo(ctx["soup"])
+    if svg_str:
+        return ctx["base"] + INLINE_SVG, "svg-inline-header", svg_str
 
 # 3 check for link rel = logo
-    logo_link = soup.find("link", rel=lambda x: x and "logo" in x.lower())
+def strat_link_logo(ctx):
+    logo_link = ctx["soup"].find("link", rel=lambda x: x and "logo" in x.lower())
     if logo_link and logo_link.get("href"):
-        return urljoin(base, logo_link["href"]), "link-logo", None
+        return urljoin(ctx["base"], logo_link["href"]), "link-logo", None
 
 # 4 check for meta tags pointing to a logo
-    og = soup.find("meta", property="og:image")
+def strat_og_image(ctx):
+    og = ctx["soup"].find("meta", property="og:image")
     if og and og.get("content"):
-        return urljoin(base, og["content"]), "og-image", None
-    tw = soup.find("meta", attrs={"name": "twitter:image"})
+        return urljoin(ctx["base"], og["content"]), "og-image", None
+
+def strat_twitter_image(ctx):
+    tw = ctx["soup"].find("meta", attrs={"name": "twitter:image"})
     if tw and tw.get("content"):
-        return urljoin(base, tw["content"]), "twitter-image", None
+        return urljoin(ctx["base"], tw["content"]), "twitter-image", None
 
 #5 last resosrt favicon 
-    icon = soup.find("link", rel=lambda x: x and "icon" in x.lower())
+def strat_icon(ctx):
+    icon = ctx["soup"].find("link", rel=lambda x: x and "icon" in x.lower())
     if icon and icon.get("href"):
         try:
-            icon_url = urljoin(base, icon["href"])
-            resp_icon = fetch_url(icon_url)
+            icon_url = urljoin(ctx["base"], icon["href"])
+            resp_icon = budget_fetch(icon_url, ctx["budget"])
             if resp_icon.status_code == 200:
                 return icon_url, "icon", None
         except Exception:
             pass
 
 # 6 logo links <a> anchors that include brand or logo as words 
-    if fallback_brand_search:
-        brand_links = soup.find_all("a", class_=lambda x: x and ("brand" in x.lower() or "logo" in x.lower()))
-        checked = set()
-        for link in brand_links:
-            href = link.get("href")
-            if not href: continue
-            abs_url = urljoin(base, href)
-            netloc = urlparse(abs_url).netloc # extracts domain example.com
-            if netloc and netloc != domain and netloc not in checked:
-                checked.add(netloc) 
-                #avoid infinite loops 
-                logo, strat, svg_path = find_logo_url(netloc, fallback_brand_search=False) #call the funciton on the new link
-                if logo:
-                    return logo, f"brand-homepage:{netloc}", svg_path
+def strat_brand_homepage(ctx):
+    if not ctx["brand_search"]:
+        return None
+    brand_links = ctx["soup"].find_all("a", class_=lambda x: x and ("brand" in x.lower() or "logo" in x.lower()))
+    checked = set()
+    for link in brand_links:
+        href = link.get("href")
+        if not href: continue
+        abs_url = urljoin(ctx["base"], href)
+        netloc = urlparse(abs_url).netloc # extracts domain example.com
+        if netloc and netloc != ctx["domain"] and netloc not in checked:
+            # every foreign homepage is a whole new fetch, cap how many we try
+            if len(checked) >= MAX_BRAND_FALLBACKS:
+                instr.count("brand_fallback_capped")
+                break
+            checked.add(netloc) 
+            #avoid infinite loops, the brand homepage runs on this domain's budget minus the favicon reserve
+            sub_budget = {"left": max(0, ctx["budget"]["left"] - FAVICON_RESERVE)}
+            spent_before = sub_budget["left"]
+            logo, strat, svg_str = find_logo_url(netloc, fallback_brand_search=False, budget=sub_budget) #call the funciton on the new link
+            ctx["budget"]["left"] -= spent_before - sub_budget["left"]
+            if logo:
+                return logo, f"brand-homepage:{netloc}", svg_str
 
 # 7 last fallback favicon.ico directly
-    favicon_url = urljoin(base, "/favicon.ico")
+def strat_favicon(ctx):
+    favicon_url = urljoin(ctx["base"], "/favicon.ico")
     try:
-        resp_favicon = fetch_url(favicon_url)
+        resp_favicon = budget_fetch(favicon_url, ctx["budget"])
         if resp_favicon.status_code == 200:
             return favicon_url, "favicon", None
     except Exception:
         pass
 
+STRATEGIES = {
+    "img-header-logo": strat_img_header,
+    "svg-inline-header": strat_svg_inline,
+    "link-logo": strat_link_logo,
+    "og-image": strat_og_image,
+    "twitter-image": strat_twitter_image,
+    "icon": strat_icon,
+    "brand-homepage": strat_brand_homepage,
+    "favicon": strat_favicon,
+}
+
+#extracting the main logo url or svg 
+#diag (optional dict) gets the homepage response, or the exception of its fetch, for diagnosing a failure later
+def find_logo_url(domain, fallback_brand_search=True, budget=None, diag=None):
+    t0 = time.perf_counter()
+    top_level = budget is None
+    if budget is None:
+        budget = {"left": FETCH_BUDGET}
+    base = f"https://{domain}"
+    safe = domain.replace(".", "_")
+    errors = []
+    resp = budget_fetch(base, budget, errors)
+    if diag is not None:
+        diag["homepage"], diag["error"] = resp, (errors[0] if errors else None)
+    if resp is None:
+        # site cannot be reached 
+        return None, "site-unreachable", None
+
+    #parsw w beautifulsoup
+    with instr.timer("parse", domain=domain):
+        soup = BeautifulSoup(resp.text, "html.parser")
+    pattern = site_pattern(soup, resp.text)
+    ctx = {"domain": domain, "base": base, "safe": safe, "soup": soup, "budget": budget, "brand_search": fallback_brand_search}
+
+    order = STRATEGY_ORDER
+    if ADAPTIVE_ORDER:
+        order = order_from_stats(STRATEGY_STATS, pattern, STRATEGY_ORDER, EXPENSIVE_STRATEGIES)
+    for name in order:
+        found = STRATEGIES[name](ctx)
+        if found:
+            if top_level:
+                record_win(STRATEGY_STATS, found[1], pattern)
+                instr.observe("find_logo", time.perf_counter() - t0, domain=domain, strategy=found[1], pattern=pattern, fetches=FETCH_BUDGET - budget["left"])
+            return found
+
 #everything fails no logo status
     return None, "no-logo", None
 
-def save_image_from_url(resp, domain, existing_hashes):
-    #read bytes of image from hhtp response
-    img_bytes = resp.content
-    #calculate the hash to check for duplicates 
-    img_hash = hashlib.md5(img_bytes).hexdigest()
-    #if the hash exists, reuse the filename
-    if img_hash in existing_hashes:
-        return existing_hashes[img_hash], img_hash
-    # otherwise build a new filename using the domain and a timestamp to avoid name clashes
-    timestamp = int(time.time())
-    safe = domain.replace(".", "_")
-    #save it as png 
-    filename = f"{safe}_{timestamp}.png"
-    path = os.path.join(OUTPUT_DIR, filename)
-    with open(path, "wb") as f:
-        f.write(img_bytes)
-        #record hash and filename to prove saving this image
-    existing_hashes[img_hash] = filename
+#download_domain failure, keeps what the homepage fetch returned (response or exception) for debug_sites.diagnose_error
+class LogoNotFound(ValueError):
+    def __init__(self, message, homepage=None, error=None):
+        super().__init__(message)
+        self.homepage = homepage
+        self.error = error
+
+# stores logo bytes once per content hash, the filename is domain_<hash prefix> so the same logo fetched again
+# (tomorrow, or by a recrawl) keeps the same name instead of getting a new timestamp
+#every saved logo (new or already known) is also matched against the watchlist, reuse by a new domain is what it looks for
+#the pipeline calls this from several threads, the check-then-store on existing_hashes runs under _hashes_lock
+def save_bytes(data, domain, ext, existing_hashes):
+    img_hash = hashlib.md5(data).hexdigest()
+    with _hashes_lock:
+        #if the hash exists, reuse the filename
+        filename = existing_hashes.get(img_hash)
+        if filename is None:
+            safe = domain.replace(".", "_")
+            filename = f"{safe}_{img_hash[:12]}{ext}"
+            path = os.path.join(OUTPUT_DIR, filename)
+            if not os.path.exists(path):
+                with open(path, "wb") as f:
+                    f.write(data)
+            #record hash and filename to prove saving this image
+            existing_hashes[img_hash] = filename
+    if WATCHLIST:
+        watchlist.check(domain, data, filename, img_hash)
     return filename, img_hash
 
-def save_svg_from_path(svg_path, domain, existing_hashes):
-    with open(svg_path, "rb") as f:
-        svg_bytes = f.read()
-    svg_hash = hashlib.md5(svg_bytes).hexdigest()
-    if svg_hash in existing_hashes:
-        return existing_hashes[svg_hash], svg_hash
-    timestamp = int(time.time())
-    safe = domain.replace(".", "_")
-    filename = f"{safe}_{timestamp}.svg"
-    dest_path = os.path.join(OUTPUT_DIR, filename)
-    with open(dest_path, "wb") as f:
-        f.write(svg_bytes)
-    existing_hashes[svg_hash] = filename
-    return filename, svg_hash
+#full requests pass for one domain: find the logo, download it and store it deduplicated by hash
+#sink is a preprocess_logo.StreamPreprocessor in streaming mode, it normalizes the same bytes without reading the file back
+#raises on failure so callers can log it or escalate the domain to the browser pass
+#the asset response is returned too (None for inline svgs) so crawl_state keeps its ETag/Last-Modified for recrawl
+def download_domain(domain, existing_hashes, sink=None):
+    # try to find the logo URL/strategy/inline SVG markup for this domain
+    diag = {}
+    logo_url, strategy, svg_str = find_logo_url(domain, diag=diag)
+    if not logo_url:
+        raise LogoNotFound("No logo URL found by any strategy", diag.get("homepage"), diag.get("error"))
+      # handle inline SVG logos extracted directly from the HTML, nothing to fetch
+    resp = None
+    if svg_str:
+        data, ext, kind = svg_str.encode("utf-8"), ".svg", "SVG inline extracted"
+    else:
+        resp = fetch_url(logo_url, hedge=True)
+        if resp is None:
+            raise LogoNotFound(f"Logo URL could not be fetched: {logo_url}", diag.get("homepage"))
+         # handle SVG logos that are served as files at a URL, raster ones (png jpg ico ...) are saved as png
+        data = resp.content
+        ext, kind = (".svg", "SVG URL downloaded") if logo_url.endswith(".svg") else (".png", "Downloaded")
+    filename, img_hash = save_bytes(data, domain, ext, existing_hashes)
+    if sink is not None:
+        sink.add(data, filename, img_hash, domain)
+    return logo_url, strategy, filename, img_hash, f"{kind}. hash={img_hash}", resp
 
 def main():
     ensure_dirs()
+    instr.start_run("download_logos")
+    STRATEGY_STATS.update(load_stats())
     #load the list of domain to process and the number of it
     domains = load_and_clean_domains()
     total = len(domains)
@@ -243,6 +387,11 @@ def main():
     fail = 0
     #hash mapping
     existing_hashes = load_existing_hashes()
+    crawl_state = load_state()
+    sink = None
+    if STREAM_PREPROCESS:
+        from preprocess_logo import StreamPreprocessor
+        sink = StreamPreprocessor()
 
 # ensure that the failure CSV file exists and has a header
     if not os.path.exists(FAILED_CSV) or os.stat(FAILED_CSV).st_size == 0:
@@ -250,45 +399,47 @@ def main():
             writer = csv.writer(cf)
             writer.writerow(["domain", "status", "message"])
 
-    for domain in domains:
-        try:
-            # try to find the logo URL/strategy/SVG path for this domain
-            logo_url, strategy, svg_path = find_logo_url(domain)
-            if not logo_url:
-                raise ValueError("No logo URL found by any strategy")
-              # handle inline SVG logos extracted directly from the HTML
-            if strategy == "svg-inline-header":
-                filename, img_hash = save_svg_from_path(logo_url, domain, existing_hashes)
-                message = f"SVG inline extracted. hash={img_hash}"
-                 # handle SVG logos that are served as files at a URL
-            elif logo_url.endswith(".svg"):
-                resp = fetch_url(logo_url)
-                safe = domain.replace(".", "_")
-                svg_path = os.path.join(OUTPUT_DIR, f"{safe}_{int(time.time())}.svg")
-                with open(svg_path, "wb") as f:
-                    f.write(resp.content)
-                filename, img_hash = save_svg_from_path(svg_path, domain, existing_hashes)
-                message = f"SVG URL downloaded. hash={img_hash}"
-                #handle raster bitmap image logos png jpg etc.
-            else:
-                resp = fetch_url(logo_url)
-                filename, img_hash = save_image_from_url(resp, domain, existing_hashes)
-                message = f"Downloaded. hash={img_hash}"
-            print(f"[SUCCESS] {domain} → {logo_url} [{strategy}] (hash={img_hash})")
-            success += 1
-        except Exception as e:
-            print(f"[FAILURE] {domain} → {e!r}")
-            with open(FAILED_CSV, "a", newline="", encoding="utf-8") as cf:
-                writer = csv.writer(cf)
-                writer.writerow([domain, "fail", str(e)])
-            fail += 1
+    #cheap dns/tcp/tls probe so dead domains don't pay the http timeouts twice (https + http), its connect times also seed net_policy
+    if PREFLIGHT:
+        domains, dead = split_alive_dead(domains)
+        with open(FAILED_CSV, "a", newline="", encoding="utf-8") as cf:
+            writer = csv.writer(cf)
+            for domain, reason, details in dead:
+                print(f"[DEAD] {domain} → {reason}")
+                writer.writerow([domain, "dead", f"{reason}: {details}"])
+        fail += len(dead)
+        instr.count("dead", len(dead))
+
+    with instr.profiled("download_loop"):
+        for domain in domains:
+            try:
+                with instr.timer("domain", domain=domain):
+                    logo_url, strategy, filename, img_hash, message, resp = download_domain(domain, existing_hashes, sink)
+                record_domain_hash(domain, img_hash, filename)
+                update_state(crawl_state, domain, logo_url, strategy, filename, img_hash, resp)
+                #strategy hit rate, brand-homepage:<netloc> is counted as one strategy
+                instr.count("strategy_hit", strategy=strategy.split(":")[0])
+                print(f"[SUCCESS] {domain} → {logo_url} [{strategy}] (hash={img_hash})")
+                success += 1
+            except Exception as e:
+                instr.count("failure")
+                print(f"[FAILURE] {domain} → {e!r}")
+                with open(FAILED_CSV, "a", newline="", encoding="utf-8") as cf:
+                    writer = csv.writer(cf)
+                    writer.writerow([domain, "fail", str(e)])
+                fail += 1
 
 #prints
     rate = (success / total) * 100 if total else 0
     save_existing_hashes(existing_hashes)
+    save_stats(STRATEGY_STATS)
+    save_state(crawl_state)
+    if sink is not None:
+        sink.save()
     print(f"\nProcessed {total} domains: {success} successes, {fail} failures")
     print(f"Success rate: {rate:.1f}%")
     print(f"Failures logged in {FAILED_CSV}")
+    instr.finish_run()
 
 if __name__ == "__main__":
     main()
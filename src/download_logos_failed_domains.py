@@ -1,19 +1,17 @@
-import os
 import csv
-import hashlib
 import time
+from types import SimpleNamespace
 from urllib.parse import urljoin
 from bs4 import BeautifulSoup
 from playwright.sync_api import sync_playwright
-from pathlib import Path
+from requests.structures import CaseInsensitiveDict
+import instrumentation as instr
+import download_logos as dl
 
 # --- Config ---
 INPUT_CSV    = "data/failed_diagnostics.csv"
-OUTPUT_DIR   = "data/logo_extraction_browser_accessible.csv/"
 RESULTS_CSV  = "data/results_playwright.csv"
-
-# --- Setup ---
-Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+#logos are stored like the requests pass: download_logos.OUTPUT_DIR, deduplicated by hash, watchlist checked in save_bytes
 
 def is_logo_context(el):
     good = ["logo", "header", "nav", "brand", "site-header", "site-logo"]
@@ -56,25 +54,19 @@ def extract_logo(soup, base_url):
 
     return None
 
-def save_logo(content, domain, ext):
-    hash_md5 = hashlib.md5(content).hexdigest()
-      #build the filename using domain and hash to avoid name collisions and deduplicate
-    filename = f"{domain}_{hash_md5}.{ext}"
-    path = os.path.join(OUTPUT_DIR, filename)
-    with open(path, "wb") as f:
-        f.write(content)
-    return filename, hash_md5
-
-def process_domain(domain):
+# browser pass for one domain: renders the homepage and finds the logo, returns (logo url, strategy, bytes, ext, response)
+# the response only carries the asset's headers (ETag/Last-Modified) for crawl_state, None for inline svgs
+# raises on failure
+def fetch_logo(domain):
     base_url = f"https://{domain}"
     #launch playwright browser session headless mode no GUI
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True) #open source core of chrome
-        # create a new browser context with a custom user-agent
-        context = browser.new_context(user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64)")
-        page = context.new_page()
         try:
-            page.goto(base_url, timeout=15000) #15secs in case of slow sites 
+            # create a new browser context with a custom user-agent
+            context = browser.new_context(user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64)")
+            page = context.new_page()
+            page.goto(base_url, timeout=15000) #15secs in case of slow sites
             time.sleep(2)   # wait 2 seconds to allow any js rendered content to load
             content = page.content() # extract the HTML content after all JS is done
             soup = BeautifulSoup(content, "html.parser")  # parse the HTML with Bs for easier element searching
@@ -82,38 +74,55 @@ def process_domain(domain):
 
             if logo is None:
                 raise ValueError("No logo found")
-            # 1 inline svg logo 
+            # 1 inline svg logo, same url marker as the requests pass so recrawl knows there is no asset to revalidate
             if isinstance(logo, tuple) and logo[0] == "inline_svg":
-                svg_content = logo[1].encode('utf-8') #convert svg to bytes  for deduplication
-                filename, img_hash = save_logo(svg_content, domain, "svg")
-                strategy = "inline-svg"
-                #2 normal image or favicon
-            else:
-                response = page.request.get(logo)
-                if response.ok:
-                    img_content = response.body()
-                    # extract file extension from URL fallback to png if unknown
-                    ext = logo.split("?")[0].split(".")[-1][:4] or "png"
-                    filename, img_hash = save_logo(img_content, domain, ext)
-                    strategy = "img-or-favicon"
-                else:
-                    raise ValueError("Image fetch failed")
-
+                return base_url + dl.INLINE_SVG, "inline-svg", logo[1].encode("utf-8"), ".svg", None
+            #2 normal image or favicon
+            response = page.request.get(logo)
+            if not response.ok:
+                raise ValueError("Image fetch failed")
+            # svg files stay svg, rasters are stored as .png like download_domain does
+            ext = ".svg" if logo.split("?")[0].lower().endswith(".svg") else ".png"
+            return logo, "img-or-favicon", response.body(), ext, SimpleNamespace(headers=CaseInsensitiveDict(response.headers))
+        finally:
             browser.close()
-            return domain, "success", strategy, filename, img_hash, ""  # on success, return details domain, status, strategy used, filename, hash, no error
-        except Exception as e:
-            browser.close()
-            return domain, "fail", "", "", "", str(e)
+
+# same contract as download_logos.download_domain: the bytes go through save_bytes (hash dedup, watchlist) and the sink
+def download_domain(domain, existing_hashes, sink=None):
+    logo_url, strategy, data, ext, resp = fetch_logo(domain)
+    filename, img_hash = dl.save_bytes(data, domain, ext, existing_hashes)
+    if sink is not None:
+        sink.add(data, filename, img_hash, domain)
+    return logo_url, strategy, filename, img_hash, f"Browser downloaded. hash={img_hash}", resp
+
+def process_domain(domain, existing_hashes, sink=None):
+    try:
+        _, strategy, filename, img_hash, _, _ = download_domain(domain, existing_hashes, sink)
+        return domain, "success", strategy, filename, img_hash, ""  # on success, return details domain, status, strategy used, filename, hash, no error
+    except Exception as e:
+        return domain, "fail", "", "", "", str(e)
 
 def main():
+    instr.start_run("download_logos_failed_domains")
     results = []
     with open(INPUT_CSV, encoding="utf-8") as f:
         reader = csv.DictReader(f)
-        domains = [row["domain"] for row in reader]
-
+        #dead domains (dns, tcp, tls failures from the preflight/diagnostics) never reach the browser
+        domains = [row["domain"] for row in reader if row.get("browser_accessible", "").lower() != "no"]
+
+    dl.ensure_dirs()
+    existing_hashes = dl.load_existing_hashes()
+    sink = None
+    if dl.STREAM_PREPROCESS:
+        from preprocess_logo import StreamPreprocessor
+        sink = StreamPreprocessor()
     for domain in domains:
         print(f"Processing {domain}...")
-        res = process_domain(domain)
+        with instr.timer("browser_domain", domain=domain):
+            res = process_domain(domain, existing_hashes, sink)
+        if res[1] == "success":
+            dl.record_domain_hash(domain, res[4], res[3])
+        instr.count("browser_status", status=res[1], strategy=res[2])
         print(res)
         results.append(res)
 
@@ -122,12 +131,17 @@ def main():
         writer.writerow(["domain", "status", "strategy", "filename", "hash", "error"])
         writer.writerows(results)
 
+    dl.save_existing_hashes(existing_hashes)
+    if sink is not None:
+        sink.save()
     success_count = sum(1 for r in results if r[1] == "success")
     print(f"\nFinal results: {success_count}/{len(results)} logos extracted successfully.")
+    instr.finish_run()
 
 if __name__ == "__main__":
     main()
 
 
     # Secondary script to reprocess failed domains
-# Attempts logo extraction again for sites that didn’t work in the first round 
\ No newline at end of file
+# Attempts logo extraction again for sites that didn’t work in the first round
+# Logos land in the same deduplicated store as the requests pass, so preprocessing, grouping and recrawl see them.
@@ -1,12 +1,15 @@
-import os, csv
+import os, csv, json, hashlib
 from collections import defaultdict, deque
-from PIL import Image
-import imagehash, numpy as np
-from skimage.metrics import structural_similarity as ssim
+import instrumentation as instr
 
 RAW_DIR   = "data/logos_preprocessed/"
 PHASH_THR = 12 #preprocess then gets the hamming distance, lower than threshold
 SSIM_THR  = 0.75 #structural similarity index threshold for high similarity, pixel patterns, greater  than threshold
+MANIFEST  = "data/logo_manifest.json" #written by preprocess_logo, hash -> file + all domains using it
+USE_CASCADE = True #cascade matcher (band lookups + cheap filters before SSIM) instead of pHash prefix buckets
+OUT_OF_CORE = False #memory bounded grouping (outofcore_group) for corpora that don't fit in RAM
+GROUPS_OUT = "groups.csv"
+BUILD_BUNDLE = True #compile the groups into the artifact bundle read by streamlitFE and logo_service
 
 # remove the file extension, the filenames are formatted as domain_subdomain_timestamp, rebuild the domain, ignoring the timestamp, 
 def filename_to_domain(fname):
@@ -19,12 +22,46 @@ def filename_to_domain(fname):
 def load_images():
     return [f for f in os.listdir(RAW_DIR) if f.endswith(".png")]
 
+#preprocessed file -> every domain that uses that logo, empty if preprocessing ran without a manifest
+def load_manifest():
+    if not os.path.exists(MANIFEST):
+        return {}
+    with open(MANIFEST, encoding="utf-8") as f:
+        return {entry["file"]: entry["domains"] for entry in json.load(f).values()}
+
+# collapse byte identical preprocessed images, only one representative per content hash is clustered
+# returns the representatives and rep -> all filenames with the same bytes
+def collapse_duplicates(filenames):
+    by_hash = {}
+    members = defaultdict(list)
+    for f in filenames:
+        with open(os.path.join(RAW_DIR, f), "rb") as fh:
+            h = hashlib.md5(fh.read()).hexdigest()
+        rep = by_hash.setdefault(h, f)
+        members[rep].append(f)
+    return list(by_hash.values()), members
+
+#fan a representative back out to all the domains behind it
+def domains_for(rep, members, manifest):
+    domains = []
+    for f in members[rep]:
+        for d in manifest.get(f) or [filename_to_domain(f)]:
+            if d not in domains:
+                domains.append(d)
+    return domains
+
+# image libraries are only imported by the functions that need them, listing/manifest/clustering don't pay for them
 #compute the perceptual hash pHash for an image file
 def calc_phash(path):
+    import imagehash
+    from PIL import Image
     return imagehash.phash(Image.open(path))
 
 #compute structural similarity index between two images
 def calc_ssim(a,b):
+    import numpy as np
+    from PIL import Image
+    from skimage.metrics import structural_similarity as ssim
     img1 = np.array(Image.open(a))
     img2 = np.array(Image.open(b))
     return ssim(img1, img2)
@@ -32,29 +69,40 @@ def calc_ssim(a,b):
 
 #clustering 
 
-def build_similarity_graph(filenames):
-    # 1 compute pHash for all images
-    phashes = [calc_phash(os.path.join(RAW_DIR,f)) for f in filenames]
-    graph = defaultdict(set)
+# 2 Create “buckets” based on the first 8 hex chars of the pHash
+# this drastically reduces the number of pairwise comparisons we need to make, gets the complexity lower, comparing every pair is infeasbile
+def make_buckets(phashes):
     buckets = defaultdict(list)
-     # 2 Create “buckets” based on the first 8 hex chars of the pHash
-    # this drastically reduces the number of pairwise comparisons we need to make, gets the complexity lower, comparing every pair is infeasbile
     for i,h in enumerate(phashes):
         buckets[str(h)[:8]].append(i)
+    return buckets
 
-    # 3 for each bucket, compare all images within the bucket pairwise
-    for bucket in buckets.values():
+# 3 for each bucket, compare all images within the bucket pairwise and yield the pairs close enough for SSIM
+def candidate_pairs(phashes):
+    for bucket in make_buckets(phashes).values():
         for i in bucket:
             for j in bucket:
                 if j <= i: continue #avoid duplicate and self-comparison
                 # 4 if the pHash distance is less than threshold, check further
                 if phashes[i] - phashes[j] <= PHASH_THR:
-                    p1 = os.path.join(RAW_DIR, filenames[i])
-                    p2 = os.path.join(RAW_DIR, filenames[j])
-                    # 5 if SSIM also high enough, consider images visually similar
-                    if calc_ssim(p1, p2) >= SSIM_THR:
-                        graph[i].add(j)
-                        graph[j].add(i)
+                    yield i, j
+
+def build_similarity_graph(filenames, raw_dir=RAW_DIR):
+    # 1 compute pHash for all images
+    with instr.timer("phash_all", images=len(filenames)):
+        phashes = [calc_phash(os.path.join(raw_dir,f)) for f in filenames]
+    graph = defaultdict(set)
+    with instr.timer("ssim_all"), instr.profiled("ssim_loop"):
+        for i, j in candidate_pairs(phashes):
+            p1 = os.path.join(raw_dir, filenames[i])
+            p2 = os.path.join(raw_dir, filenames[j])
+            # 5 if SSIM also high enough, consider images visually similar
+            with instr.timer("ssim", emit=False):
+                similar = calc_ssim(p1, p2) >= SSIM_THR
+            instr.count("ssim_pairs", matched=similar)
+            if similar:
+                graph[i].add(j)
+                graph[j].add(i)
     return graph
 
 def connected_components(graph, N):
@@ -76,19 +124,41 @@ def connected_components(graph, N):
     return comps
 
 def main():
-    filenames = load_images()
-    graph = build_similarity_graph(filenames)
-    comps = connected_components(graph, len(filenames))
+    instr.start_run("group_logos_buckets")
+    if OUT_OF_CORE:
+        from outofcore_group import group_out_of_core
+        n_groups = group_out_of_core(GROUPS_OUT, RAW_DIR, manifest=MANIFEST)
+        print(f"→ Wrote {n_groups} groups to {GROUPS_OUT}")
+        if BUILD_BUNDLE:
+            from artifact_bundle import build_bundle
+            with instr.timer("bundle"):
+                build_bundle(GROUPS_OUT, logo_dir=RAW_DIR)
+        return instr.finish_run()
+    filenames, members = collapse_duplicates(load_images())
+    manifest = load_manifest()
+    if USE_CASCADE:
+        from cascade_match import build_cascade_graph, print_stats
+        graph, stats = build_cascade_graph(filenames)
+        print_stats(stats)
+    else:
+        graph = build_similarity_graph(filenames)
+    with instr.timer("clustering"):
+        comps = connected_components(graph, len(filenames))
 
    #write out the results: each row is a cluster, listing all domains in that cluster
-    with open("groups.csv","w", newline="", encoding="utf-8") as f:
+    with open(GROUPS_OUT,"w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
         w.writerow(["group_id","domains"])
         for gid, comp in enumerate(comps, 1):
-            domains = [ filename_to_domain(filenames[i]) for i in comp ]
+            domains = [d for i in comp for d in domains_for(filenames[i], members, manifest)]
             w.writerow([gid, ";".join(domains)])
 
-    print(f"→ Wrote {len(comps)} groups to groups.csv")
+    print(f"→ Wrote {len(comps)} groups to {GROUPS_OUT}")
+    if BUILD_BUNDLE:
+        from artifact_bundle import build_bundle
+        with instr.timer("bundle"):
+            build_bundle(GROUPS_OUT, logo_dir=RAW_DIR)
+    instr.finish_run()
 
 if __name__=="__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import threading
+import cProfile
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+METRICS_DIR = "data/metrics/"
+PROMETHEUS  = os.environ.get("LOGO_PROMETHEUS", "") == "1" #also dump a prometheus text file at the end of the run
+PROFILE     = os.environ.get("LOGO_PROFILE", "") #"" (off), "cprofile" or "sample"
+SAMPLE_INTERVAL = 0.005 #seconds between stack samples in "sample" mode
+
+_lock = threading.Lock()
+_run = {
+    "script": None,
+    "file": None,
+    "started": None,
+    "stages": defaultdict(lambda: [0, 0.0]), #stage -> [count, total seconds]
+    "counters": Counter(), #(name, labels) -> value
+}
+
+def _write(event):
+    if _run["file"] is not None:
+        _run["file"].write(json.dumps(event) + "\n")
+
+# opens the JSONL file for this run, every script calls it at the start of main()
+def start_run(script):
+    Path(METRICS_DIR).mkdir(parents=True, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{script}_{int(time.time())}.jsonl")
+    with _lock:
+        _run["script"] = script
+        _run["started"] = time.time()
+        _run["file"] = open(path, "a", buffering=1, encoding="utf-8")
+        _run["stages"].clear()
+        _run["counters"].clear()
+        _write({"type": "start", "script": script, "ts": _run["started"]})
+    return path
+
+# records one timing, emit=False only aggregates (for hot loops like SSIM pairs)
+def observe(stage, seconds, emit=True, **labels):
+    with _lock:
+        agg = _run["stages"][stage]
+        agg[0] += 1
+        agg[1] += seconds
+        if emit:
+            _write({"type": "timing", "stage": stage, "seconds": round(seconds, 6), "ts": time.time(), **labels})
+
+#bumps a counter, e.g. count("strategy_hit", strategy="og-image")
+def count(name, n=1, **labels):
+    with _lock:
+        _run["counters"][(name, tuple(sorted(labels.items())))] += n
+
+@contextmanager
+def timer(stage, emit=True, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0, emit, **labels)
+
+def summary():
+    with _lock:
+        return {
+            "stages": {s: {"count": c, "seconds": round(t, 6)} for s, (c, t) in _run["stages"].items()},
+            "counters": [{"name": n, **dict(l), "value": v} for (n, l), v in _run["counters"].items()],
+        }
+
+def _prom_labels(**labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+#prometheus text exposition format of the aggregated stages and counters
+def prometheus_text():
+    script = _run["script"] or "unknown"
+    lines = ["# TYPE logo_stage_seconds summary"]
+    with _lock:
+        for stage, (c, t) in sorted(_run["stages"].items()):
+            lines.append(f"logo_stage_seconds_sum{_prom_labels(script=script, stage=stage)} {t:.6f}")
+            lines.append(f"logo_stage_seconds_count{_prom_labels(script=script, stage=stage)} {c}")
+        lines.append("# TYPE logo_events_total counter")
+        for (name, labels), v in sorted(_run["counters"].items()):
+            lines.append(f"logo_events_total{_prom_labels(script=script, name=name, **dict(labels))} {v}")
+    return "\n".join(lines) + "\n"
+
+# writes the summary line (and the prometheus dump if enabled) and closes the run
+def finish_run(prometheus=None):
+    prometheus = PROMETHEUS if prometheus is None else prometheus
+    data = summary()
+    with _lock:
+        _write({"type": "summary", "script": _run["script"], "seconds": round(time.time() - (_run["started"] or time.time()), 3), **data})
+        if _run["file"] is not None:
+            _run["file"].close()
+            _run["file"] = None
+    if prometheus:
+        prom_path = os.path.join(METRICS_DIR, f"{_run['script']}.prom")
+        with open(prom_path, "w", encoding="utf-8") as f:
+            f.write(prometheus_text())
+    return data
+
+# minimal sampling profiler: a thread snapshots the target thread's stack and counts collapsed stacks (flamegraph format)
+class StackSampler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.target = threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.target)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, path):
+        self._stop.set()
+        self._thread.join()
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+# opt-in profiling around a hot loop, LOGO_PROFILE=cprofile writes a .prof, LOGO_PROFILE=sample a .folded stack file
+@contextmanager
+def profiled(name, mode=None):
+    mode = PROFILE if mode is None else mode
+    if not mode:
+        yield
+        return
+    Path(METRICS_DIR).mkdir(parents=True, exist_ok=True)
+    base = os.path.join(METRICS_DIR, f"{_run['script'] or 'run'}_{name}")
+    if mode == "cprofile":
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            prof.dump_stats(base + ".prof")
+    else:
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop(base + ".folded")
+
+# Instrumentation layer:
+# Per-domain and per-stage timings written as JSONL to data/metrics/, aggregated counters, an optional Prometheus text dump
+# and opt-in cProfile / sampling profiles around the hot loops. Used by the download, preprocess and grouping scripts.
@@ -0,0 +1,417 @@
+import os
+import csv
+import json
+import time
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from urllib.request import urlopen, Request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LOGO_DIR   = "data/logos_preprocessed/"
+GROUPS_CSV = "data/groups/groups_w_buckets.csv"
+MANIFEST   = "data/logo_manifest.json" #preprocessed file -> domains, from preprocess_logo
+INSERT_LOG = "data/groups/service_inserts.jsonl" #/insert calls since the last grouping run, replayed on start
+USE_BUNDLE = True #start from the memory-mapped artifact bundle written after grouping when it is up to date
+HOST, PORT = "127.0.0.1", 8765
+SERVICE_URL = f"http://{HOST}:{PORT}"
+PHASH_THR  = 12 #same thresholds as the grouping stage
+SSIM_THR   = 0.75
+CACHE_SIZE = 10_000 #responses kept in the LRU cache
+BATCH_WINDOW = 0.002 #seconds the batcher waits to collect concurrent image queries
+BATCH_MAX    = 64 #image queries answered with one vectorized hash scan
+
+def filename_to_domain(fname):
+    base = os.path.splitext(fname)[0]
+    return ".".join(base.split("_")[:-1])
+
+# image libraries are imported where they're used, so the client helpers (service_get/service_post) stay cheap to import
+#popcount of every xor in a uint64 array, np.bitwise_count (numpy 2) or a 16 bit lookup table, no per-bit array
+_POP16 = None
+def popcount64(x):
+    import numpy as np
+    global _POP16
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    if _POP16 is None:
+        _POP16 = np.array([bin(v).count("1") for v in range(1 << 16)], dtype=np.uint8)
+    return _POP16[x.view(np.uint16)].reshape(-1, 4).sum(axis=1, dtype=np.uint8)
+
+def load_normalized(path):
+    from PIL import Image, ImageOps
+    from preprocess_logo import trim_whitespace, SIZE
+    with Image.open(path) as img:
+        return ImageOps.pad(trim_whitespace(img.convert("L")), SIZE, color=255)
+
+#rows appended in place with spare capacity, the buffer is only copied when it doubles
+class GrowableArray:
+    def __init__(self, initial):
+        import numpy as np
+        self.n = len(initial)
+        self.buf = np.empty((max(self.n, 16),) + initial.shape[1:], dtype=initial.dtype)
+        self.buf[:self.n] = initial
+
+    def append(self, row):
+        import numpy as np
+        if self.n == len(self.buf):
+            grown = np.empty((2 * len(self.buf),) + self.buf.shape[1:], dtype=self.buf.dtype)
+            grown[:self.n] = self.buf[:self.n]
+            self.buf = grown
+        self.buf[self.n] = row
+        self.n += 1
+
+    @property
+    def array(self):
+        return self.buf[:self.n]
+
+class LRUCache:
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                return self.data[key]
+        return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+# everything a query needs, loaded once: group table, pHash index and the decoded image matrix
+# the loaded images (maybe a memory map) are never copied, inserted logos go to their own growable buffer
+class LogoIndex:
+    def __init__(self, logo_dir=LOGO_DIR, groups_csv=GROUPS_CSV, manifest=MANIFEST, insert_log=INSERT_LOG):
+        import numpy as np
+        self.lock = threading.RLock()
+        self.logo_dir = logo_dir
+        self.insert_log = insert_log
+        if not (USE_BUNDLE and self._load_bundle(logo_dir, groups_csv)):
+            self._load_files(logo_dir, groups_csv, manifest)
+        self.added = GrowableArray(np.zeros((0,) + self.images.shape[1:], dtype=np.uint8))
+        self._hashes = GrowableArray(np.asarray(self.hashes, dtype=np.uint64))
+        self.hashes = self._hashes.array
+        self._replay_inserts(groups_csv)
+
+    def _load_files(self, logo_dir, groups_csv, manifest):
+        import numpy as np
+        from batch_hash import phash_batch
+        self.group_domains = {}
+        self.domain_group = {}
+        if os.path.exists(groups_csv):
+            with open(groups_csv, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    gid = int(row["group_id"])
+                    self.group_domains[gid] = row["domains"].split(";")
+                    for d in self.group_domains[gid]:
+                        self.domain_group[d] = gid
+
+        file_domains = {}
+        if os.path.exists(manifest):
+            with open(manifest, encoding="utf-8") as f:
+                file_domains = {e["file"]: e["domains"] for e in json.load(f).values()}
+        self.files = sorted(f for f in os.listdir(logo_dir) if f.endswith(".png")) if os.path.isdir(logo_dir) else []
+        self.domain_file = {}
+        self.file_group = []
+        for fname in self.files:
+            domains = file_domains.get(fname) or [filename_to_domain(fname)]
+            for d in domains:
+                self.domain_file.setdefault(d, fname)
+            self.file_group.append(next((self.domain_group[d] for d in domains if d in self.domain_group), None))
+
+        # re-trim on load so files preprocessed before TRIM existed compare like fresh queries (no-op for trimmed ones)
+        arrays = [np.array(load_normalized(os.path.join(logo_dir, f))) for f in self.files]
+        self.images = np.stack(arrays) if arrays else np.zeros((0, 128, 128), dtype=np.uint8)
+        self.hashes = phash_batch(arrays)
+
+    # group table, domain index, image matrix (memory mapped) and pHash array straight from artifact_bundle
+    def _load_bundle(self, logo_dir, groups_csv):
+        from artifact_bundle import Bundle, is_fresh, BUNDLE_DIR
+        if not is_fresh(groups_csv, BUNDLE_DIR):
+            return False
+        bundle = Bundle(BUNDLE_DIR)
+        if not bundle.has_images() or bundle.stats.get("logo_dir") != os.path.abspath(logo_dir):
+            return False
+        self.group_domains = {int(bundle.group_ids[k]): bundle.group(k) for k in range(len(bundle))}
+        self.domain_group = {d: gid for d, (gid, _) in bundle.index.items()}
+        self.domain_file = {d: f for d, (_, f) in bundle.index.items() if f}
+        files, self.images, self.hashes, file_group = bundle.image_arrays()
+        self.files = files
+        self.file_group = [int(g) if g >= 0 else None for g in file_group]
+        return True
+
+    #inserts logged after the last grouping run, older ones are already in groups.csv (their pngs are in logo_dir)
+    def _replay_inserts(self, groups_csv):
+        from batch_hash import phash_batch
+        if not os.path.exists(self.insert_log):
+            return
+        since = os.path.getmtime(groups_csv) if os.path.exists(groups_csv) else 0
+        loaded = {f: i for i, f in enumerate(self.files)} #pngs already read from logo_dir only need their group
+        with open(self.insert_log, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue #half written line of a killed service
+                path = os.path.join(self.logo_dir, entry["file"])
+                if entry["time"] < since or not os.path.exists(path):
+                    continue
+                if entry["file"] in loaded:
+                    self._add(entry["domain"], entry["group_id"], entry["file"], at=loaded[entry["file"]])
+                    continue
+                gray = load_normalized(path)
+                self._add(entry["domain"], entry["group_id"], entry["file"], gray, phash_batch([gray])[0])
+
+    def image(self, i):
+        return self.images[i] if i < len(self.images) else self.added.array[i - len(self.images)]
+
+    def lookup_domain(self, domain):
+        with self.lock:
+            gid = self.domain_group.get(domain)
+            return {
+                "domain": domain,
+                "group_id": gid,
+                "logo": self.domain_file.get(domain),
+                "domains": self.group_domains.get(gid, []),
+            }
+
+    def search(self, text, limit=50):
+        text = text.lower()
+        with self.lock:
+            hits = [gid for gid, doms in self.group_domains.items() if any(text in d for d in doms)]
+            return [{"group_id": gid, "domains": self.group_domains[gid]} for gid in hits[:limit]]
+
+    # hash scan for a batch of query images at once: Q x N hamming matrix, SSIM only on candidates under PHASH_THR
+    def match_batch(self, grays):
+        import numpy as np
+        from batch_hash import phash_batch
+        from skimage.metrics import structural_similarity as ssim
+        with self.lock:
+            q = phash_batch(grays)
+            results = []
+            if len(self.hashes) == 0:
+                return [None] * len(grays), q
+            dist = popcount64((q[:, None] ^ self.hashes[None, :]).ravel()).reshape(len(q), -1)
+            for qi, gray in enumerate(grays):
+                arr = np.array(gray)
+                best = None
+                for i in np.argsort(dist[qi])[:32]:
+                    if dist[qi, i] > PHASH_THR:
+                        break
+                    score = ssim(arr, self.image(i))
+                    if score >= SSIM_THR and (best is None or score > best[1]):
+                        best = (int(i), float(score))
+                results.append(best)
+            return results, q
+
+    def describe(self, match):
+        if match is None:
+            return {"match": None}
+        i, score = match
+        gid = self.file_group[i]
+        return {"match": self.files[i], "ssim": round(score, 4), "group_id": gid, "domains": self.group_domains.get(gid, [])}
+
+    # adds a new logo: joins the group of its best match or opens a new group
+    # the normalized png is written to logo_dir (the next grouping run picks it up) and the insert is logged for restarts
+    #fname names a png already in logo_dir (recrawl pushes the files preprocess_changed wrote), it isn't written twice
+    def insert(self, domain, gray, match, h, fname=None):
+        with self.lock:
+            gid = self.file_group[match[0]] if match else None
+            if gid is None:
+                gid = max(self.group_domains, default=0) + 1
+            if not (fname and os.path.basename(fname) == fname and os.path.exists(os.path.join(self.logo_dir, fname))):
+                fname = f"{domain.replace('.', '_')}_{int(time.time())}.png"
+                os.makedirs(self.logo_dir, exist_ok=True)
+                gray.save(os.path.join(self.logo_dir, fname), format="PNG", optimize=True)
+            self._add(domain, gid, fname, gray, h)
+            os.makedirs(os.path.dirname(self.insert_log) or ".", exist_ok=True)
+            with open(self.insert_log, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"domain": domain, "group_id": gid, "file": fname, "time": time.time()}) + "\n")
+            return {"domain": domain, "group_id": gid, "domains": self.group_domains[gid]}
+
+    # moves the domain out of its old group (dropped when it ends up empty) and appends its logo
+    #at: index of a logo that is already loaded, only its group changes
+    def _add(self, domain, gid, fname, gray=None, h=None, at=None):
+        import numpy as np
+        old = self.domain_group.get(domain)
+        if old is not None and old != gid and old in self.group_domains:
+            self.group_domains[old] = [d for d in self.group_domains[old] if d != domain]
+            if not self.group_domains[old]:
+                del self.group_domains[old]
+        self.group_domains[gid] = list(self.group_domains.get(gid, []))
+        if domain not in self.group_domains[gid]:
+            self.group_domains[gid].append(domain)
+        self.domain_group[domain] = gid
+        self.domain_file[domain] = fname
+        if at is not None:
+            self.file_group[at] = gid
+            return
+        self.files.append(fname)
+        self.file_group.append(gid)
+        self.added.append(np.array(gray))
+        self._hashes.append(np.uint64(h))
+        self.hashes = self._hashes.array
+
+#match_batch failed for a batch, the query itself may be fine so the handler answers 500, not 400
+class MatchError(RuntimeError):
+    pass
+
+# collects image queries arriving within BATCH_WINDOW and answers them with one match_batch call
+# a failed match_batch puts its exception on every slot of the batch, submit re-raises it as a MatchError
+class QueryBatcher:
+    def __init__(self, index):
+        self.index = index
+        self.q = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, gray):
+        done = threading.Event()
+        slot = {"gray": gray, "done": done}
+        self.q.put(slot)
+        done.wait()
+        if "error" in slot:
+            raise MatchError(f"match failed: {slot['error']!r}") from slot["error"]
+        return slot["result"], slot["hash"]
+
+    def _run(self):
+        while True:
+            batch = [self.q.get()]
+            deadline = time.perf_counter() + BATCH_WINDOW
+            while len(batch) < BATCH_MAX:
+                try:
+                    batch.append(self.q.get(timeout=max(deadline - time.perf_counter(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                results, hashes = self.index.match_batch([s["gray"] for s in batch])
+                for slot, res, h in zip(batch, results, hashes):
+                    slot["result"], slot["hash"] = res, int(h)
+            except Exception as e:
+                for slot in batch:
+                    slot["error"] = e
+            for slot in batch:
+                slot["done"].set()
+
+#raw image bytes (png/jpg/ico/svg) -> normalized grayscale, same steps as preprocess_logo
+def decode_query(body):
+    from safe_decode import open_bytes
+    from preprocess_logo import normalize_image
+    gray, _ = normalize_image(open_bytes(body))
+    return gray
+
+def make_handler(index, batcher, cache):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, payload, status=200):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            cached = cache.get(self.path)
+            if cached is not None:
+                return self._send(cached)
+            try:
+                if url.path == "/domain" and "d" in params:
+                    payload = index.lookup_domain(params["d"].strip().lower())
+                elif url.path == "/search" and "q" in params:
+                    payload = index.search(params["q"])
+                elif url.path == "/health":
+                    return self._send({"logos": len(index.files), "groups": len(index.group_domains)})
+                else:
+                    return self._send({"error": "unknown endpoint"}, 404)
+            except Exception as e:
+                return self._send({"error": str(e)}, 500)
+            cache.put(self.path, payload)
+            self._send(payload)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            body = self._body()
+            try:
+                if url.path == "/batch":
+                    domains = json.loads(body)["domains"]
+                    return self._send([index.lookup_domain(d.strip().lower()) for d in domains])
+                if url.path == "/query":
+                    key = "query:" + hashlib.md5(body).hexdigest()
+                    payload = cache.get(key)
+                    if payload is None:
+                        match, _ = batcher.submit(decode_query(body))
+                        payload = index.describe(match)
+                        cache.put(key, payload)
+                    return self._send(payload)
+                if url.path == "/insert" and "domain" in params:
+                    gray = decode_query(body)
+                    match, h = batcher.submit(gray)
+                    payload = index.insert(params["domain"].strip().lower(), gray, match, h, params.get("file"))
+                    cache.clear() #group membership changed
+                    return self._send(payload)
+            except MatchError as e:
+                return self._send({"error": str(e)}, 500) #nothing was cached or inserted
+            except Exception as e:
+                return self._send({"error": str(e)}, 400)
+            self._send({"error": "unknown endpoint"}, 404)
+
+    return Handler
+
+def make_server(host=HOST, port=PORT, index=None):
+    index = index or LogoIndex()
+    server = ThreadingHTTPServer((host, port), make_handler(index, QueryBatcher(index), LRUCache()))
+    server.index = index
+    return server
+
+#small client used by streamlitFE and the scripts, returns None when the service isn't running
+def service_get(path, base=SERVICE_URL, timeout=0.5):
+    try:
+        with urlopen(base + path, timeout=timeout) as resp:
+            return json.loads(resp.read())
+    except OSError:
+        return None
+
+def service_post(path, body, base=SERVICE_URL, timeout=5):
+    try:
+        with urlopen(Request(base + path, data=body, method="POST"), timeout=timeout) as resp:
+            return json.loads(resp.read())
+    except OSError:
+        return None
+
+def main():
+    t0 = time.perf_counter()
+    server = make_server()
+    print(f"[INFO] Loaded {len(server.index.files)} logos, {len(server.index.group_domains)} groups in {time.perf_counter() - t0:.1f}s")
+    print(f"[INFO] Serving on {SERVICE_URL} (GET /domain?d=, /search?q=, /health; POST /query, /insert?domain=[&file=], /batch)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
+
+# Logo similarity service:
+# Loads the group table, the pHash index and the decoded preprocessed images once and answers domain lookups,
+# substring search, image queries (micro-batched) and inserts over a local HTTP API with a response cache.
+# Inserted logos are written to the preprocessed dir and logged, a restart replays them until the next grouping run.
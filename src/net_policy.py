@@ -0,0 +1,152 @@
+import time
+import socket
+import threading
+from collections import deque
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import instrumentation as instr
+
+WINDOW       = 500 #latency samples kept per kind (connect, ttfb), older ones fall out
+MIN_SAMPLES  = 30 #below this the default timeouts are used, a few lucky samples shouldn't shrink them
+PERCENTILE   = 95
+CONNECT_DEFAULT, READ_DEFAULT = 4.0, 8.0 #seconds, until there are enough samples (8 was the old fixed HTTP_TIMEOUT)
+CONNECT_MULT, READ_MULT = 3.0, 4.0 #timeout = percentile * mult, slow but healthy servers still get through
+CONNECT_RANGE = (1.0, 6.0) #min/max connect timeout in seconds
+READ_RANGE    = (2.0, 15.0) #min/max read timeout in seconds
+BREAKER_FAILURES = 3 #consecutive transport failures that open a host's breaker
+BREAKER_COOLDOWN = 300 #seconds an open breaker rejects requests, then one trial request is let through
+HEDGE        = True #send a second copy of a slow logo asset download, the first response wins
+HEDGE_AFTER  = 1.0 #hedge once the request has taken this many times the ttfb percentile
+HEDGE_WORKERS = 16 #threads running asset downloads and their hedges
+HEDGE_SLOTS  = HEDGE_WORKERS // 4 #hedge copies in flight at once, slow hosts can't fill the pool with losers
+
+_lock = threading.Lock()
+_samples = {"connect": deque(maxlen=WINDOW), "ttfb": deque(maxlen=WINDOW)}
+_breakers = {} #host -> {"failures", "open_until", "dead"}
+_hedge_pool = None
+_hedge_slots = threading.BoundedSemaphore(HEDGE_SLOTS)
+
+class CircuitOpen(Exception):
+    pass
+
+def host_of(url):
+    return (urlparse(url).hostname or "").lower()
+
+#connect samples come from preflight's tcp/tls probes, ttfb samples from every successful GET
+def observe(kind, seconds):
+    with _lock:
+        _samples[kind].append(seconds)
+
+def percentile(kind, q=PERCENTILE):
+    with _lock:
+        values = sorted(_samples[kind])
+    if len(values) < MIN_SAMPLES:
+        return None
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+def _clamp(value, bounds):
+    return max(bounds[0], min(bounds[1], value))
+
+#(connect, read) tuple for requests, derived from the observed latency percentiles
+def timeouts():
+    connect, ttfb = percentile("connect"), percentile("ttfb")
+    connect_timeout = CONNECT_DEFAULT if connect is None else _clamp(connect * CONNECT_MULT, CONNECT_RANGE)
+    read_timeout = READ_DEFAULT if ttfb is None else _clamp(ttfb * READ_MULT, READ_RANGE)
+    return connect_timeout, read_timeout
+
+#dns failures won't recover within a run, neither over plain http nor for another path on the same host
+#only explicit wrapping is followed (__cause__, urllib3's .reason, the urllib3 error inside requests' ConnectionError),
+#never __context__ or message text: an unrelated error raised while handling another one must not mark a live host dead
+def is_dns_error(e):
+    from requests.exceptions import ConnectionError as RequestsConnectionError
+    seen = set()
+    while isinstance(e, BaseException) and id(e) not in seen:
+        seen.add(id(e))
+        if isinstance(e, socket.gaierror) or type(e).__name__ == "NameResolutionError":
+            return True
+        wrapped = e.args[0] if isinstance(e, RequestsConnectionError) and e.args else None
+        e = e.__cause__ or getattr(e, "reason", None) or wrapped #.reason is sometimes just a string, the loop stops there
+    return False
+
+# closed -> open after BREAKER_FAILURES transport failures in a row (or one dns failure, which stays open for the run)
+# open -> half open after BREAKER_COOLDOWN, the next request is the trial and its outcome closes or reopens the breaker
+def allow(url):
+    host = host_of(url)
+    now = time.monotonic()
+    with _lock:
+        b = _breakers.get(host)
+        if b is None or b["open_until"] == 0:
+            return True
+        if b["dead"] or now < b["open_until"]:
+            return False
+        b["open_until"] = now + BREAKER_COOLDOWN #half open: only this request goes through until it reports back
+        return True
+
+def check(url):
+    if not allow(url):
+        instr.count("breaker_rejected")
+        raise CircuitOpen(f"circuit open for {host_of(url)}")
+
+def record_success(url, ttfb):
+    observe("ttfb", ttfb)
+    with _lock:
+        _breakers.pop(host_of(url), None)
+
+#only transport errors count, an http error status means the host is up
+def record_failure(url, e):
+    host = host_of(url)
+    dns = is_dns_error(e)
+    with _lock:
+        b = _breakers.setdefault(host, {"failures": 0, "open_until": 0, "dead": False})
+        b["failures"] += 1
+        if dns or b["failures"] >= BREAKER_FAILURES:
+            opened = b["open_until"] == 0
+            b["dead"] = b["dead"] or dns
+            b["open_until"] = time.monotonic() + BREAKER_COOLDOWN
+            if opened:
+                instr.count("breaker_opened", reason="dns" if dns else "failures")
+
+def _pool():
+    global _hedge_pool
+    with _lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+        return _hedge_pool
+
+# runs fetch(), and if it hasn't answered after HEDGE_AFTER x the ttfb percentile, a second identical fetch()
+# the first one to succeed wins, a loser still queued is cancelled, one already running finishes in the background
+# (bounded by its own timeouts) and is dropped; no hedge is sent while HEDGE_SLOTS hedges are already in flight
+def hedged(fetch):
+    delay = percentile("ttfb")
+    if not HEDGE or delay is None:
+        return fetch()
+    pool = _pool()
+    primary = pool.submit(fetch)
+    done, pending = wait({primary}, timeout=delay * HEDGE_AFTER)
+    if not done:
+        if _hedge_slots.acquire(blocking=False):
+            instr.count("hedge", outcome="sent")
+            hedge = pool.submit(fetch)
+            hedge.add_done_callback(lambda _: _hedge_slots.release()) #also runs when the hedge is cancelled
+            pending.add(hedge)
+        else:
+            instr.count("hedge", outcome="no_slot")
+    try:
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        instr.count("hedge", outcome="won")
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+    finally:
+        for future in pending:
+            future.cancel()
+
+# Network policy:
+# Connect/read timeouts follow the observed latency percentiles instead of a fixed 8s, a per-host circuit breaker stops
+# retrying hosts that keep failing (dns failures: for the whole run), and slow logo asset downloads can be hedged.
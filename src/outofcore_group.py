@@ -0,0 +1,458 @@
+import os
+import re
+import csv
+import json
+import heapq
+import shutil
+import hashlib
+from pathlib import Path
+import numpy as np
+import instrumentation as instr
+
+RAW_DIR   = "data/logos_preprocessed/"
+WORK_DIR  = "data/groups/_outofcore/" #hash table, partitions, edge runs and the union-find live here, removed at the end
+BLOCK     = 50_000 #images hashed / rows scanned per block, bounds the in-memory slice of every pass
+N_PARTITIONS = 16 #minimum key partitions per band, one partition is sorted in memory at a time
+PARTITION_ROWS = 4_000_000 #rows a partition should hold at most (6 bytes each), the partition count grows with the corpus
+EDGE_RUN  = 2_000_000 #candidate edges buffered before a sorted run is spilled (8 bytes each)
+BANDS = [(col, b) for col in (2, 1) for b in range(4)] #16 bit bands of the pHash (col 2) and dHash (col 1), same as cascade_match
+PART_DTYPE = np.dtype([("key", "<u2"), ("idx", "<u4")])
+DOMAIN_DTYPE = np.dtype([("key", "<u8"), ("start", "<u8"), ("stop", "<u8")])
+HIST_LEN = 64 #preprocess_logo.HIST_BINS ** 3
+FP_VIEWS = ("trim", "icon", "zoom") #bit k of fp_mask says view k has a fingerprint
+FEAT_DTYPE = np.dtype([("key", "<u8"), ("present", "u1"), ("aspect", "<f4"), ("hist", "<f4", (HIST_LEN,)),
+                       ("fp", "<u8", (len(FP_VIEWS),)), ("fp_mask", "u1")])
+FP_DTYPE = np.dtype([("cls", "u1"), ("key", "<u8"), ("mask", "u1"), ("idx", "<u4")])
+
+# filenames stored once on disk with an offset table, so a path can be looked up by index without a list in memory
+class FileTable:
+    def __init__(self, work_dir):
+        self.names = np.memmap(os.path.join(work_dir, "files.bin"), dtype=np.uint8, mode="r")
+        self.offsets = np.load(os.path.join(work_dir, "file_offsets.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.names[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+# (key, value) pairs of a top level json object parsed one at a time from a chunked read, the file is never loaded whole
+def iter_json_object(path, chunk=1 << 20):
+    decoder = json.JSONDecoder()
+    skip = re.compile(r"[\s,:]*") #separators between the tokens of the top level object
+    end = object()
+    with open(path, encoding="utf-8") as f:
+        buf = f.read(chunk).lstrip()
+        if not buf.startswith("{"):
+            raise ValueError(f"{path} is not a json object")
+        pos = 1
+
+        def token():
+            nonlocal buf, pos
+            while True:
+                pos = skip.match(buf, pos).end()
+                if pos < len(buf):
+                    if buf[pos] == "}":
+                        return end
+                    try:
+                        value, pos = decoder.raw_decode(buf, pos)
+                        return value
+                    except json.JSONDecodeError:
+                        pass #value cut by the chunk boundary, read more
+                more = f.read(chunk)
+                if not more:
+                    if pos >= len(buf):
+                        return end
+                    raise ValueError(f"truncated json in {path}")
+                buf, pos = buf[pos:] + more, 0
+
+        while True:
+            key = token()
+            if key is end:
+                return
+            yield key, token()
+
+def name_key(name):
+    return int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "little")
+
+# preprocessed file -> domains from the manifest, spilled like the edges: the ";" joined domains go to domains.bin and
+# a (file name hash, start, stop) table sorted in place on a memmap finds them, nothing per file stays on the python heap
+class DomainTable:
+    def __init__(self, manifest_path, work_dir, block=BLOCK):
+        records_path = os.path.join(work_dir, "domain_records.bin")
+        domains_path = os.path.join(work_dir, "domains.bin")
+        pos, rows = 0, []
+        with open(domains_path, "wb") as fd, open(records_path, "wb") as fr:
+            for _, entry in iter_json_object(manifest_path):
+                data = ";".join(entry["domains"]).encode("utf-8")
+                fd.write(data)
+                rows.append((name_key(entry["file"]), pos, pos + len(data)))
+                pos += len(data)
+                if len(rows) >= block:
+                    np.array(rows, dtype=DOMAIN_DTYPE).tofile(fr)
+                    rows = []
+            np.array(rows, dtype=DOMAIN_DTYPE).tofile(fr)
+        self.records = np.zeros(0, dtype=DOMAIN_DTYPE)
+        if os.path.getsize(records_path):
+            self.records = np.memmap(records_path, dtype=DOMAIN_DTYPE, mode="r+")
+            self.records.sort(order="key")
+        self.domains = np.memmap(domains_path, dtype=np.uint8, mode="r") if pos else np.zeros(0, dtype=np.uint8)
+
+    def get(self, name):
+        k = name_key(name)
+        i = int(np.searchsorted(self.records["key"], np.uint64(k)))
+        if i < len(self.records) and int(self.records["key"][i]) == k:
+            start, stop = int(self.records["start"][i]), int(self.records["stop"][i])
+            return bytes(self.domains[start:stop]).decode("utf-8").split(";")
+        return None
+
+# colour histogram, aspect and fingerprints of preprocess_logo's features json, one row per file in FileTable order
+# the json is streamed into a records file sorted in place (like DomainTable), then gathered into a memmap aligned with
+# the file indices, so reject_reason and the fingerprint pass read rows by index and nothing per file stays on the heap
+class FeatureTable:
+    def __init__(self, features_path, files, work_dir, block=BLOCK):
+        records_path = os.path.join(work_dir, "feature_records.bin")
+        rows = np.zeros(block, dtype=FEAT_DTYPE)
+        k = 0
+        with open(records_path, "wb") as fr:
+            if features_path and os.path.exists(features_path):
+                for fname, f in iter_json_object(features_path):
+                    row = rows[k]
+                    row["key"], row["present"], row["aspect"] = name_key(fname), 1, f.get("aspect", 1.0)
+                    row["hist"] = f.get("hist") or np.zeros(HIST_LEN)
+                    for v, view in enumerate(FP_VIEWS):
+                        value = (f.get("fp") or {}).get(view)
+                        if value:
+                            row["fp"][v] = int(value, 16)
+                            row["fp_mask"] |= 1 << v
+                    k += 1
+                    if k == block:
+                        rows.tofile(fr)
+                        rows[:], k = 0, 0
+            rows[:k].tofile(fr)
+        records = np.zeros(0, dtype=FEAT_DTYPE)
+        if os.path.getsize(records_path):
+            records = np.memmap(records_path, dtype=FEAT_DTYPE, mode="r+")
+            records.sort(order="key")
+        n = len(files)
+        self.rows = np.lib.format.open_memmap(os.path.join(work_dir, "features.npy"), mode="w+", dtype=FEAT_DTYPE, shape=(n,))
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            keys = np.array([name_key(files[i]) for i in range(start, stop)], dtype=np.uint64)
+            pos = np.minimum(np.searchsorted(records["key"], keys), max(len(records) - 1, 0))
+            found = (records["key"][pos] == keys) if len(records) else np.zeros(len(keys), dtype=bool)
+            self.rows[start:stop][found] = records[pos[found]]
+        self.rows.flush()
+        del records
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        row = self.rows[i]
+        if not row["present"]:
+            return None
+        return {"aspect": float(row["aspect"]), "hist": row["hist"]}
+
+#packed hash rows are read straight from the memmap, converted to python ints for the hamming checks
+class HashTable:
+    def __init__(self, hashes):
+        self.hashes = hashes
+
+    def __getitem__(self, i):
+        return tuple(int(h) for h in self.hashes[i])
+
+class PathTable:
+    def __init__(self, files, raw_dir):
+        self.files, self.raw_dir = files, raw_dir
+
+    def __getitem__(self, i):
+        return os.path.join(self.raw_dir, self.files[i])
+
+# pass 1: stream the directory, write the filename table and an N x 3 uint64 (aHash, dHash, pHash) memmap block by block
+def hash_pass(raw_dir, work_dir, block=BLOCK):
+    from batch_hash import hash_files
+    names_path = os.path.join(work_dir, "files.bin")
+    offsets, pos = [0], 0
+    with open(names_path, "wb") as f, os.scandir(raw_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".png"):
+                data = entry.name.encode("utf-8")
+                f.write(data)
+                pos += len(data)
+                offsets.append(pos)
+    np.save(os.path.join(work_dir, "file_offsets.npy"), np.array(offsets, dtype=np.int64))
+    files = FileTable(work_dir)
+    n = len(files)
+    hashes = np.lib.format.open_memmap(os.path.join(work_dir, "hashes.npy"), mode="w+", dtype=np.uint64, shape=(n, 3))
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        hashes[start:stop] = hash_files([os.path.join(raw_dir, files[i]) for i in range(start, stop)])
+        hashes.flush()
+    del hashes
+    return files, np.load(os.path.join(work_dir, "hashes.npy"), mmap_mode="r")
+
+#key partitions needed so none holds more than PARTITION_ROWS of n_rows, band keys are 16 bit so at most 65536 make sense
+def partitions_for(n_rows, n_partitions=N_PARTITIONS, partition_rows=PARTITION_ROWS, max_partitions=1 << 16):
+    return min(max(n_partitions, -(-n_rows // partition_rows)), max_partitions)
+
+# sorts and dedupes the buffered edges and writes them as one run file
+def spill_run(buffer, work_dir, runs, prefix="edges"):
+    edges = np.unique(np.concatenate(buffer))
+    path = os.path.join(work_dir, f"{prefix}_{len(runs):05d}.npy")
+    np.save(path, edges)
+    runs.append(path)
+
+# pass 2: for every band, route (band key, index) to partition files, then sort one partition at a time
+# images sharing a band key become candidate edges i<<32|j, spilled as sorted runs once EDGE_RUN edges are buffered
+def candidate_runs(hashes, work_dir, block=BLOCK, n_partitions=None, edge_run=EDGE_RUN):
+    from cascade_match import MAX_BAND_BUCKET
+    runs, buffer, buffered = [], [], 0
+    n = len(hashes)
+    n_partitions = n_partitions or partitions_for(n)
+    for col, b in BANDS:
+        part_paths = [os.path.join(work_dir, f"part_{p:03d}.bin") for p in range(n_partitions)]
+        outs = [open(p, "wb") for p in part_paths]
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            rows = np.empty(stop - start, dtype=PART_DTYPE)
+            rows["key"] = (np.asarray(hashes[start:stop, col]) >> np.uint64(b * 16)) & np.uint64(0xFFFF)
+            rows["idx"] = np.arange(start, stop, dtype=np.uint32)
+            part = rows["key"] % n_partitions
+            for p in np.unique(part):
+                rows[part == p].tofile(outs[p])
+        for f in outs:
+            f.close()
+
+        for path in part_paths:
+            rows = np.fromfile(path, dtype=PART_DTYPE)
+            os.remove(path)
+            if len(rows) < 2:
+                continue
+            rows.sort(order=["key", "idx"])
+            bounds = np.flatnonzero(np.diff(rows["key"].astype(np.int32))) + 1
+            for members in np.split(rows["idx"].astype(np.uint64), bounds):
+                if len(members) < 2 or len(members) > MAX_BAND_BUCKET:
+                    continue
+                i, j = np.triu_indices(len(members), k=1)
+                buffer.append((members[i] << np.uint64(32)) | members[j])
+                buffered += len(i)
+                if buffered >= edge_run:
+                    spill_run(buffer, work_dir, runs)
+                    buffer, buffered = [], 0
+    if buffer:
+        spill_run(buffer, work_dir, runs)
+    return runs
+
+# k-way merge of the sorted runs, each run is memory mapped and read in blocks, duplicates across runs are dropped
+def merge_runs(runs, block=BLOCK):
+    def read(path):
+        arr = np.load(path, mmap_mode="r")
+        for start in range(0, len(arr), block):
+            yield from (int(e) for e in arr[start:start + block])
+    last = None
+    for e in heapq.merge(*(read(p) for p in runs)):
+        if e != last:
+            yield e >> 32, e & 0xFFFFFFFF
+            last = e
+
+# same links as cascade_match.fingerprint_links, out of core: (class, fingerprint) rows are partitioned by value and
+# sorted one partition at a time, members of a key with a view in common give same-view edges (full cascade), the others
+# icon/trim edges (colour filter only); returns (same-view runs, icon/trim runs)
+def fingerprint_runs(feats, work_dir, block=BLOCK, n_partitions=None, edge_run=EDGE_RUN):
+    from cascade_match import FP_CLASSES, MIN_FP_BITS, MAX_BAND_BUCKET
+    from logo_service import popcount64
+    classes = sorted(set(FP_CLASSES.values()))
+    n = len(feats)
+    n_partitions = n_partitions or partitions_for(n * len(FP_VIEWS), max_partitions=1 << 20)
+    part_paths = [os.path.join(work_dir, f"fp_part_{p:05d}.bin") for p in range(n_partitions)]
+    outs = [open(p, "wb") for p in part_paths]
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        rows = np.asarray(feats.rows[start:stop])
+        for v, view in enumerate(FP_VIEWS):
+            if view not in FP_CLASSES:
+                continue
+            values = np.ascontiguousarray(rows["fp"][:, v])
+            bits = popcount64(values)
+            keep = ((rows["fp_mask"] >> v) & 1).astype(bool) & (bits >= MIN_FP_BITS) & (bits <= 64 - MIN_FP_BITS)
+            out = np.empty(int(keep.sum()), dtype=FP_DTYPE)
+            out["cls"], out["key"], out["mask"] = classes.index(FP_CLASSES[view]), values[keep], 1 << v
+            out["idx"] = np.arange(start, stop, dtype=np.uint32)[keep]
+            part = out["key"] % np.uint64(n_partitions)
+            for p in np.unique(part):
+                out[part == p].tofile(outs[int(p)])
+    for f in outs:
+        f.close()
+
+    runs = {"same": [], "cross": []}
+    buffers = {"same": [], "cross": []}
+    buffered = 0
+    for path in part_paths:
+        rows = np.fromfile(path, dtype=FP_DTYPE)
+        os.remove(path)
+        if len(rows) < 2:
+            continue
+        rows.sort(order=["cls", "key", "idx"])
+        group = np.concatenate([[True], (rows["cls"][1:] != rows["cls"][:-1]) | (rows["key"][1:] != rows["key"][:-1])])
+        for members in np.split(rows, np.flatnonzero(group)[1:]):
+            idx, inverse = np.unique(members["idx"], return_inverse=True)
+            if len(idx) < 2 or len(idx) > MAX_BAND_BUCKET:
+                continue
+            masks = np.zeros(len(idx), dtype=np.uint8)
+            np.bitwise_or.at(masks, inverse, members["mask"])
+            i, j = np.triu_indices(len(idx), k=1)
+            edges = (idx[i].astype(np.uint64) << np.uint64(32)) | idx[j].astype(np.uint64)
+            cross = (masks[i] & masks[j]) == 0 #no view in common, one side matched with its icon, the other with its trim
+            buffers["same"].append(edges[~cross])
+            buffers["cross"].append(edges[cross])
+            buffered += len(edges)
+            if buffered >= edge_run:
+                for kind in runs:
+                    spill_run(buffers[kind], work_dir, runs[kind], f"fp_{kind}")
+                buffers, buffered = {"same": [], "cross": []}, 0
+    for kind in runs:
+        if buffers[kind]:
+            spill_run(buffers[kind], work_dir, runs[kind], f"fp_{kind}")
+    return runs["same"], runs["cross"]
+
+# merge_runs over several kinds of runs at once, yields (i, j, set of kinds the edge is in)
+def merge_tagged(kinds, block=BLOCK):
+    def read(path, kind):
+        arr = np.load(path, mmap_mode="r")
+        for start in range(0, len(arr), block):
+            yield from ((int(e), kind) for e in arr[start:start + block])
+    last, tags = None, set()
+    for e, kind in heapq.merge(*(read(p, kind) for kind, runs in kinds.items() for p in runs)):
+        if e != last and last is not None:
+            yield last >> 32, last & 0xFFFFFFFF, tags
+            tags = set()
+        last = e
+        tags.add(kind)
+    if last is not None:
+        yield last >> 32, last & 0xFFFFFFFF, tags
+
+# union-find whose parent array is a memmap, memory is the page cache and not the python heap
+class DiskUnionFind:
+    def __init__(self, n, path):
+        self.parent = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint32, shape=(n,))
+        for start in range(0, n, BLOCK):
+            self.parent[start:start + BLOCK] = np.arange(start, min(start + BLOCK, n), dtype=np.uint32)
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]] #path halving
+            x = int(parent[x])
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+        return ra != rb
+
+# pass 3: verify merged candidate edges with the cascade, pairs already in the same component are skipped without any comparison
+# kinds: "band" runs and same-view "same" fingerprint runs get the full cascade, icon/trim "cross" runs only the colour filter
+# (a pair that is icon/trim in one fingerprint index is not a same-view candidate, as in build_cascade_graph)
+def cluster_edges(kinds, files, hashes, feats, raw_dir, work_dir, cascade=None):
+    from cascade_match import reject_reason, CASCADE
+    cascade = cascade or CASCADE
+    uf = DiskUnionFind(len(files), os.path.join(work_dir, "parent.npy"))
+    paths = PathTable(files, raw_dir)
+    table = HashTable(hashes)
+    stats = {"candidates": 0, "fingerprint_cross": 0, "same_component": 0, "matched": 0}
+    for i, j, tags in merge_tagged(kinds):
+        cross = "cross" in tags
+        full = "band" in tags or ("same" in tags and not cross)
+        stats["candidates"] += full
+        stats["fingerprint_cross"] += cross
+        if uf.find(i) == uf.find(j):
+            stats["same_component"] += 1
+            continue
+        if cross:
+            if not reject_reason(i, j, table, feats, paths, {"colour": cascade.get("colour")}, verify=False):
+                stats["matched_fingerprint_cross"] = stats.get("matched_fingerprint_cross", 0) + 1
+                uf.union(i, j)
+                continue
+            stats["rejected_fingerprint_cross"] = stats.get("rejected_fingerprint_cross", 0) + 1
+        if not full:
+            continue
+        reason = reject_reason(i, j, table, feats, paths, cascade)
+        if reason:
+            stats[f"rejected_{reason}"] = stats.get(f"rejected_{reason}", 0) + 1
+            continue
+        stats["matched"] += 1
+        uf.union(i, j)
+    return uf, stats
+
+# (root, index) pairs sorted out of core the same way as the edges, so members of a group come out next to each other
+def sorted_members(uf, work_dir, block=BLOCK):
+    runs = []
+    n = len(uf.parent)
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        roots = np.array([uf.find(i) for i in range(start, stop)], dtype=np.uint64)
+        keys = np.sort((roots << np.uint64(32)) | np.arange(start, stop, dtype=np.uint64))
+        path = os.path.join(work_dir, f"members_{len(runs):05d}.npy")
+        np.save(path, keys)
+        runs.append(path)
+    current, members = None, []
+    for root, i in merge_runs(runs, block):
+        if root != current and members:
+            yield members
+            members = []
+        current = root
+        members.append(i)
+    if members:
+        yield members
+
+#manifest is the path of preprocess_logo's manifest json, streamed into a DomainTable
+#features is its features json (colour/aspect filters and fingerprint links), streamed into a FeatureTable
+def group_out_of_core(out_csv, raw_dir=RAW_DIR, work_dir=WORK_DIR, manifest=None, features=None):
+    from group_logos_buckets import filename_to_domain
+    from cascade_match import FEATURES, USE_FINGERPRINTS
+    features = features or FEATURES
+    if os.path.exists(work_dir):
+        shutil.rmtree(work_dir)
+    Path(work_dir).mkdir(parents=True, exist_ok=True)
+    table = DomainTable(manifest, work_dir) if manifest and os.path.exists(manifest) else None
+    with instr.timer("hashes_all"):
+        files, hashes = hash_pass(raw_dir, work_dir)
+    feats = FeatureTable(features, files, work_dir)
+    kinds = {"same": [], "cross": []}
+    if USE_FINGERPRINTS:
+        with instr.timer("fingerprint_links"):
+            kinds["same"], kinds["cross"] = fingerprint_runs(feats, work_dir)
+    with instr.timer("candidates"):
+        kinds["band"] = candidate_runs(hashes, work_dir)
+    runs = [p for r in kinds.values() for p in r]
+    with instr.timer("cascade_all"):
+        uf, stats = cluster_edges(kinds, files, hashes, feats, raw_dir, work_dir)
+    n_groups = 0
+    with instr.timer("clustering"), open(out_csv, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["group_id", "domains"])
+        for members in sorted_members(uf, work_dir):
+            n_groups += 1
+            domains = []
+            for i in members:
+                for d in (table.get(files[i]) if table else None) or [filename_to_domain(files[i])]:
+                    if d not in domains:
+                        domains.append(d)
+            w.writerow([n_groups, ";".join(domains)])
+    for name, n in stats.items():
+        instr.count("outofcore", n, stage=name)
+    print(f"[OUT-OF-CORE] {len(files)} images, {len(runs)} edge runs, {stats['candidates']} candidate pairs + "
+          f"{stats['fingerprint_cross']} icon/trim pairs, {stats['same_component']} skipped (already connected), "
+          f"{stats['matched'] + stats.get('matched_fingerprint_cross', 0)} matched")
+    del uf, hashes, table, feats
+    shutil.rmtree(work_dir)
+    return n_groups
+
+# Out-of-core grouping:
+# Hashes go to a memmap, band-key partitions are sorted one at a time into candidate edge runs on disk, the runs are merged
+# and verified into a memmap union-find, the manifest and the features are streamed into on-disk tables,
+# so peak memory is set by BLOCK / PARTITION_ROWS / EDGE_RUN and not by the corpus size.
+# Same candidates (bands + fingerprint links) and filters (hashes, aspect, colour, SSIM) as cascade_match, so a corpus
+# groups the same with OUT_OF_CORE on or off.
@@ -0,0 +1,155 @@
+import os
+import glob
+import json
+import heapq
+import shutil
+import hashlib
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARQUET_FILE = os.path.join("data", "logos.snappy.parquet")
+WORK_DIR     = os.path.join("data", "work_shards")
+SPILL_DIR    = os.path.join("data", "work_shards", "_spill")
+METRICS_DIR  = os.path.join("data", "metrics")
+READ_BATCH   = 65_536 #rows pulled from the parquet file at a time
+N_PARTITIONS = 64 #hash partitions, each one is deduplicated on its own so memory only depends on the partition size
+TARGET_SHARD_SECONDS = 900 #a work shard should take about 15 minutes for one worker
+DEFAULT_SECONDS_PER_DOMAIN = 2.0 #used until a download_logos run has been measured
+SCHEMA = pa.schema([("domain", pa.string())])
+
+#same cleaning as download_logos.load_and_clean_domains
+def clean_domain(raw):
+    return (raw or "").strip().lower().rstrip(" ,/\\")
+
+#64 bit hash of a domain, 8 bytes in the dedupe set instead of the whole string
+def domain_hash(domain, salt=b""):
+    return int.from_bytes(hashlib.blake2b(domain.encode("utf-8"), digest_size=8, key=salt).digest(), "big")
+
+# streams cleaned domains batch by batch (row groups), the full file is never loaded
+def iter_domains(path=PARQUET_FILE, batch_size=READ_BATCH):
+    pf = pq.ParquetFile(path)
+    if "domain" not in pf.schema_arrow.names:
+        raise KeyError("Expected a 'domain' column in the Parquet file.")
+    for batch in pf.iter_batches(batch_size=batch_size, columns=["domain"]):
+        for raw in batch.column(0).to_pylist():
+            dom = clean_domain(raw)
+            if dom:
+                yield dom
+
+#average seconds per domain from the last instrumented download_logos run, so shard size follows the real crawl speed
+def estimate_seconds_per_domain():
+    runs = sorted(glob.glob(os.path.join(METRICS_DIR, "download_logos_*.jsonl")))
+    for path in reversed(runs):
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        if not lines:
+            continue
+        last = json.loads(lines[-1])
+        stage = last.get("stages", {}).get("domain") if last.get("type") == "summary" else None
+        if stage and stage["count"]:
+            return stage["seconds"] / stage["count"]
+    return DEFAULT_SECONDS_PER_DOMAIN
+
+def rows_per_shard(target_seconds=TARGET_SHARD_SECONDS):
+    return max(1, int(target_seconds / estimate_seconds_per_domain()))
+
+# pass 1: route every domain to a spill file by hash, only one small buffer per partition lives in memory
+def spill_partitions(path=PARQUET_FILE, n_partitions=N_PARTITIONS, spill_dir=SPILL_DIR, flush_rows=READ_BATCH):
+    Path(spill_dir).mkdir(parents=True, exist_ok=True)
+    writers, buffers = {}, [[] for _ in range(n_partitions)]
+
+    def flush(p):
+        if p not in writers:
+            writers[p] = pq.ParquetWriter(os.path.join(spill_dir, f"part_{p:03d}.parquet"), SCHEMA)
+        writers[p].write_table(pa.table({"domain": buffers[p]}, schema=SCHEMA))
+        buffers[p] = []
+
+    for dom in iter_domains(path):
+        p = domain_hash(dom) % n_partitions
+        buffers[p].append(dom)
+        if len(buffers[p]) >= flush_rows:
+            flush(p)
+    for p in range(n_partitions):
+        if buffers[p]:
+            flush(p)
+    for w in writers.values():
+        w.close()
+    return sorted(glob.glob(os.path.join(spill_dir, "part_*.parquet")))
+
+# replaces final_dir by new_dir: the old set is renamed aside first and only deleted once the new one is in place
+# a crash between the two renames leaves <final_dir>.old, which recover_dir puts back
+def swap_dir(new_dir, final_dir):
+    old_dir = final_dir + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(final_dir):
+        os.replace(final_dir, old_dir)
+    os.replace(new_dir, final_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def recover_dir(final_dir):
+    old_dir = final_dir + ".old"
+    if not os.path.exists(final_dir) and os.path.exists(old_dir):
+        os.replace(old_dir, final_dir)
+        print(f"[INFO] restored {final_dir} from an interrupted swap")
+
+# pass 2: deduplicate each partition with a set of 64 bit hashes and cut it into work shards
+#the shards are written to a fresh <out_dir>.new and swapped in at the end, so shards of an earlier run
+#(maybe cut with another shard_rows) never mix with the new ones, and a crashed run leaves the old set intact
+def write_work_shards(path=PARQUET_FILE, out_dir=WORK_DIR, shard_rows=None, n_partitions=N_PARTITIONS):
+    shard_rows = shard_rows or rows_per_shard()
+    final_dir = out_dir.rstrip("/\\")
+    recover_dir(final_dir)
+    out_dir = final_dir + ".new"
+    shutil.rmtree(out_dir, ignore_errors=True)
+    Path(out_dir).mkdir(parents=True)
+    spill_dir = os.path.join(out_dir, "_spill")
+    shards, total, dups = [], 0, 0
+    for part_path in spill_partitions(path, n_partitions, spill_dir):
+        part = os.path.basename(part_path)[len("part_"):-len(".parquet")]
+        seen, rows = set(), []
+        for dom in iter_domains(part_path):
+            h = domain_hash(dom)
+            if h in seen:
+                dups += 1
+                continue
+            seen.add(h)
+            rows.append(dom)
+            if len(rows) == shard_rows:
+                shards.append(_write_shard(out_dir, part, len(shards), rows))
+                total += len(rows)
+                rows = []
+        if rows:
+            shards.append(_write_shard(out_dir, part, len(shards), rows))
+            total += len(rows)
+        os.remove(part_path)
+    os.rmdir(spill_dir)
+    swap_dir(out_dir, final_dir)
+    return [os.path.join(final_dir, os.path.basename(s)) for s in shards], total, dups
+
+def _write_shard(out_dir, part, idx, rows):
+    shard = os.path.join(out_dir, f"shard_{part}_{idx:05d}.parquet")
+    pq.write_table(pa.table({"domain": rows}, schema=SCHEMA), shard)
+    return shard
+
+# deterministic sample of k unique domains in one pass and O(k) memory: keep the k smallest salted hashes
+# duplicates share a hash so they can never be picked twice
+def bottom_k_sample(domains, k, seed=42):
+    salt = str(seed).encode("utf-8")
+    heap, kept = [], set()
+    for dom in domains:
+        h = domain_hash(dom, salt)
+        if h in kept:
+            continue
+        if len(heap) < k:
+            heapq.heappush(heap, (-h, dom))
+            kept.add(h)
+        elif h < -heap[0][0]:
+            old, _ = heapq.heapreplace(heap, (-h, dom))
+            kept.discard(-old)
+            kept.add(h)
+    return [dom for _, dom in sorted(heap, reverse=True)]
+
+# Streaming Parquet ingestion:
+# Reads the domain list row group by row group, deduplicates it with 64 bit hashes per hash partition
+# and writes Parquet work shards sized by the measured crawl speed, so the input size doesn't matter for memory.
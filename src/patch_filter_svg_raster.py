@@ -1,35 +1,36 @@
 import os
 import shutil
 import re
+import base64
+import hashlib
+import html.entities
+from io import BytesIO
 from pathlib import Path
 from PIL import Image
-import xml.etree.ElementTree as ET
+from xml.parsers import expat
+from xml.sax.saxutils import escape
 import csv
 
 LOGOS_DIR = "data/logos/"
 SVG_OUT   = "data/logos_svg_patch/"
 BAD_SVG   = "data/bad_svg/"
 BAD_RASTER = "data/bad_raster/"
+RASTER_CACHE = "data/raster_cache/" #rasterized PNGs keyed by the hash of the sanitized SVG
 CSV_LOG   = "svg_patch_report.csv"
 
 DEFAULT_SIZE = 256
+CHUNK_SIZE   = 64 * 1024 #bytes fed to the parser at a time
+MAX_EMBEDDED_RASTER = 512 * 1024 #base64 chars, bigger embedded images get downscaled
+EMBEDDED_RASTER_SIZE = (DEFAULT_SIZE * 2, DEFAULT_SIZE * 2) #downscale target for oversized embedded images
+DROPPED_ELEMENTS = {"script", "foreignobject"} #removed with everything inside them, never needed to draw a logo
 
-# common HTML entities that may break SVG parsing if not replaced
+# HTML entities that break SVG parsing, the 5 XML ones (&amp; &lt; ...) are valid and stay escaped
 ENTITY_MAP = {
-    "&uuml;": "ü",
-    "&Uuml;": "Ü",
-    "&aacute;": "á",
-    "&Aacute;": "Á",
-    "&eacute;": "é",
-    "&oacute;": "ó",
-    "&iacute;": "í",
-    "&ntilde;": "ñ",
-    "&amp;": "&",
-    "&quot;": '"',
-    "&lt;": "<",
-    "&gt;": ">",
-    
+    name: chr(cp) for name, cp in html.entities.name2codepoint.items()
+    if name not in {"amp", "lt", "gt", "quot", "apos"}
 }
+ENTITY_RE = re.compile(rb"&([A-Za-z][A-Za-z0-9]*);")
+MAX_ENTITY_LEN = 32 #a trailing "&..." shorter than this may be an entity split across chunks
 
 #read all error files from a previous error report CSV produced by preprocess step
 def get_error_files(csv_file):
@@ -40,48 +41,156 @@ def get_error_files(csv_file):
             error_files.append(row['filename'])
     return error_files
 
-#patch SVGs: fix entities, add width/height if missing, and validate XML syntax
-def patch_svg_file(path, out_path):
+#replace HTML entities in one chunk with their utf8 characters, unknown ones are left for the parser to reject
+def replace_entities(chunk):
+    def sub(m):
+        ch = ENTITY_MAP.get(m.group(1).decode("ascii"))
+        return ch.encode("utf8") if ch else m.group(0)
+    return ENTITY_RE.sub(sub, chunk)
+
+#shrink a huge base64 data URI image, returns None if it can't be decoded (the element is dropped then)
+def cap_embedded_raster(href):
     try:
-        #open SVG as text
-        with open(path, encoding="utf8") as f:
-            data = f.read()
-
-        for k, v in ENTITY_MAP.items():
-            data = data.replace(k, v)
-
-     #ensure <svg> tag has width and height attributes
-        if re.search(r"<svg[^>]+>", data, re.IGNORECASE):
-            
-            m = re.search(r"<svg([^>]*)>", data, re.IGNORECASE)
-            if m:
-                attrs = m.group(1)
-                if "width" not in attrs or "height" not in attrs:
-                    
-                    attrs_new = attrs
-                    if "width" not in attrs:
-                        attrs_new += f' width="{DEFAULT_SIZE}"'
-                    if "height" not in attrs:
-                        attrs_new += f' height="{DEFAULT_SIZE}"'
-                    data = data.replace(m.group(0), f"<svg{attrs_new}>")
-
-      
-        with open(out_path, "w", encoding="utf8") as f:
-            f.write(data)
-
-         # try parsing as XML to ensure it s now valid
+        header, payload = href.split(",", 1)
+        with Image.open(BytesIO(base64.b64decode(payload))) as img:
+            img.thumbnail(EMBEDDED_RASTER_SIZE)
+            buf = BytesIO()
+            img.save(buf, format="PNG", optimize=True)
+        return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+    except Exception:
+        return None
+
+#adds width/height to the root <svg> when missing, taken from the viewBox if there is one
+#inline svgs come through BeautifulSoup's html.parser which lowercases it to "viewbox", the key is restored to viewBox
+def fix_dimensions(attrs):
+    for key in [k for k in attrs if k.lower() == "viewbox" and k != "viewBox"]:
+        attrs.setdefault("viewBox", attrs.pop(key))
+    if "width" in attrs and "height" in attrs:
+        return attrs
+    w = h = DEFAULT_SIZE
+    box = attrs.get("viewBox", "").replace(",", " ").split()
+    if len(box) == 4:
         try:
-            ET.fromstring(data)
-            return "patched", ""
-        except ET.ParseError as e:
+            w, h = float(box[2]), float(box[3])
+        except ValueError:
+            pass
+    attrs.setdefault("width", f"{w:g}")
+    attrs.setdefault("height", f"{h:g}")
+    return attrs
+
+# single pass SVG sanitizer: reads src in chunks, fixes entities, adds missing dimensions, caps embedded rasters,
+# drops scripts/foreignObject and on* event handlers, and writes the cleaned document to dst while expat validates it
+# returns the md5 of the sanitized output
+# raises expat.ExpatError if the document is still not valid XML
+def sanitize_svg_stream(src, dst):
+    parser = expat.ParserCreate("utf-8")
+    parser.SetParamEntityParsing(expat.XML_PARAM_ENTITY_PARSING_NEVER)
+    digest = hashlib.md5()
+    state = {"depth": 0, "skip": 0}
+
+    def write(text):
+        data = text.encode("utf8")
+        digest.update(data)
+        dst.write(data)
+
+    def start(name, attrs):
+        state["depth"] += 1
+        if state["skip"]:
+            state["skip"] += 1
+            return
+        if name.rsplit(":", 1)[-1].lower() in DROPPED_ELEMENTS:
+            state["skip"] = 1
+            return
+        attrs = {k: v for k, v in attrs.items() if not k.lower().startswith("on")} #onload, onclick ... handlers
+        if state["depth"] == 1 and name.rsplit(":", 1)[-1] == "svg":
+            attrs = fix_dimensions(attrs)
+        if name.rsplit(":", 1)[-1] == "image":
+            for key in ("href", "xlink:href"):
+                href = attrs.get(key, "")
+                if href.startswith("data:") and len(href) > MAX_EMBEDDED_RASTER:
+                    capped = cap_embedded_raster(href)
+                    if capped is None:
+                        state["skip"] = 1 #drop this element and everything inside it
+                        return
+                    attrs[key] = capped
+        attr_str = "".join(f' {k}="{escape(v, {chr(34): "&quot;"})}"' for k, v in attrs.items())
+        write(f"<{name}{attr_str}>")
+
+    def end(name):
+        state["depth"] -= 1
+        if state["skip"]:
+            state["skip"] -= 1
+            return
+        write(f"</{name}>")
+
+    def chars(data):
+        if not state["skip"]:
+            write(escape(data))
+
+    def comment(data):
+        if not state["skip"]:
+            write(f"<!--{data}-->")
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = chars
+    parser.CommentHandler = comment
+
+    carry = b""
+    while True:
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        chunk = carry + chunk
+        carry = b""
+        # keep a possibly cut entity for the next chunk
+        amp = chunk.rfind(b"&")
+        if amp != -1 and b";" not in chunk[amp:] and len(chunk) - amp < MAX_ENTITY_LEN:
+            chunk, carry = chunk[:amp], chunk[amp:]
+        parser.Parse(replace_entities(chunk), False)
+    parser.Parse(replace_entities(carry), True)
+    return digest.hexdigest()
+
+#patch SVGs: fix entities, add width/height if missing, and validate XML syntax in one streaming pass
+def patch_svg_file(path, out_path):
+    try:
+        with open(path, "rb") as src, open(out_path, "wb") as dst:
+            try:
+                sanitize_svg_stream(src, dst)
+                result = ("patched", "")
+            except expat.ExpatError as e:
+                result = ("xml_error", str(e))
+        if result[0] == "xml_error":
             # any other failure: copy file to BAD_SVG and log error
             shutil.move(out_path, os.path.join(BAD_SVG, os.path.basename(path)))
-            return "xml_error", str(e)
+        return result
 
     except Exception as e:
         shutil.copy(path, os.path.join(BAD_SVG, os.path.basename(path)))
         return "fail", str(e)
 
+# rasterize an SVG through the cache: identical inline SVGs shared by many domains are rendered only once
+def rasterize_svg_cached(path):
+    with open(path, "rb") as src:
+        return rasterize_svg_bytes(src)
+
+#same for svg markup already in memory (bytes or a file object), used by the streaming downloader
+def rasterize_svg_bytes(src):
+    import cairosvg
+    if isinstance(src, bytes):
+        src = BytesIO(src)
+    buf = BytesIO()
+    svg_hash = sanitize_svg_stream(src, buf)
+    cache_path = os.path.join(RASTER_CACHE, f"{svg_hash}.png")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            return f.read()
+    png_bytes = cairosvg.svg2png(bytestring=buf.getvalue())
+    Path(RASTER_CACHE).mkdir(parents=True, exist_ok=True)
+    with open(cache_path, "wb") as f:
+        f.write(png_bytes)
+    return png_bytes
+
 # for raster images: try opening to verify it's not corrupt
 def check_raster_file(path):
     try:
@@ -93,7 +202,7 @@ def check_raster_file(path):
         return "corrupt", str(e)
 
 def ensure_dirs():
-    for d in [SVG_OUT, BAD_SVG, BAD_RASTER]:
+    for d in [SVG_OUT, BAD_SVG, BAD_RASTER, RASTER_CACHE]:
         Path(d).mkdir(parents=True, exist_ok=True)
 
 def main():
@@ -0,0 +1,164 @@
+import csv
+import os
+import queue
+import threading
+
+import download_logos
+from download_logos import load_and_clean_domains, load_existing_hashes, save_existing_hashes, download_domain, ensure_dirs, record_domain_hash
+from debug_sites import diagnose_error, classify_browser_access
+from preflight import preflight_domains, is_dead
+import instrumentation as instr
+from strategy_stats import load_stats, save_stats
+from crawl_state import load_state, save_state, update_state
+
+RESULTS_CSV     = "data/pipeline_results.csv"
+DIAGNOSTICS_CSV = "data/failed_diagnostics.csv" #diagnostics from earlier runs, used for routing
+HTTP_WORKERS    = 8 #requests tier threads, mostly waiting on the network
+BROWSER_WORKERS = 2 #playwright tier threads, each one launches its own chromium
+#reasons where the requests pass is known to fail but a real browser gets through, these domains skip the http tier
+BROWSER_FIRST_REASONS = {"blocked-bot-waf", "redirect", "unexpected-html"}
+
+RESULT_FIELDS = ["domain", "tier", "status", "strategy", "filename", "hash", "reason", "message"]
+
+#reasons from a previous diagnostics run, so known WAF/JS sites go straight to the browser
+def load_previous_reasons():
+    if not os.path.exists(DIAGNOSTICS_CSV):
+        return {}
+    with open(DIAGNOSTICS_CSV, newline="", encoding="utf-8") as f:
+        return {row["domain"]: row["reason"] for row in csv.DictReader(f)}
+
+# decides the first tier for a domain: "skip" for dead ones, "browser" for known bot-blocked ones, otherwise "http"
+def route(reason, previous_reason=None):
+    if is_dead(reason):
+        return "skip"
+    if previous_reason in BROWSER_FIRST_REASONS:
+        return "browser"
+    return "http"
+
+class Pipeline:
+    def __init__(self, http_workers=HTTP_WORKERS, browser_workers=BROWSER_WORKERS,
+                 http_fn=None, browser_fn=None, diagnose_fn=None):
+        self.http_workers = http_workers
+        self.browser_workers = browser_workers
+        self.existing_hashes = load_existing_hashes()
+        self.crawl_state = load_state()
+        self.sink = None
+        if download_logos.STREAM_PREPROCESS:
+            from preprocess_logo import StreamPreprocessor
+            self.sink = StreamPreprocessor()
+        self.http_fn = http_fn or (lambda d: download_domain(d, self.existing_hashes, self.sink))
+        self.browser_fn = browser_fn or (lambda d: self._browser_fetch(d, self.existing_hashes, self.sink))
+        self.diagnose_fn = diagnose_fn or diagnose_error
+        self.http_q = queue.Queue()
+        self.browser_q = queue.Queue()
+        self.results = []
+        self.lock = threading.Lock()
+
+    # same contract as http_fn: (logo url, strategy, filename, hash, message, asset response), raises on failure
+    @staticmethod
+    def _browser_fetch(domain, existing_hashes, sink):
+        #imported here so the pipeline runs without playwright when nothing reaches the browser tier
+        from download_logos_failed_domains import download_domain as browser_download
+        return browser_download(domain, existing_hashes, sink)
+
+    def record(self, **row):
+        with self.lock:
+            self.results.append({k: row.get(k, "") for k in RESULT_FIELDS})
+            if row["status"] == "success":
+                record_domain_hash(row["domain"], row["hash"], row["filename"])
+                update_state(self.crawl_state, row["domain"], row.get("url", ""), row["strategy"], row["filename"], row["hash"], row.get("resp"))
+        instr.count("tier_result", tier=row["tier"], status=row["status"])
+        print(f"[{row['tier'].upper()}] {row['domain']} → {row['status']} {row.get('strategy', '')}")
+
+    def http_worker(self):
+        while True:
+            domain = self.http_q.get()
+            if domain is None:
+                break
+            try:
+                logo_url, strategy, filename, img_hash, message, resp = self.http_fn(domain)
+                self.record(domain=domain, tier="http", status="success", strategy=strategy,
+                            filename=filename, hash=img_hash, message=message, url=logo_url, resp=resp)
+            except Exception as e:
+                # escalate right away, the browser tier picks it up while the http tier keeps going
+                # the failure carries the homepage response/exception, no second GET to diagnose it
+                reason, details = self.diagnose_fn(domain, e)
+                if classify_browser_access(reason) == "no":
+                    self.record(domain=domain, tier="http", status="fail", reason=reason, message=f"{e!r} | {details}")
+                else:
+                    self.browser_q.put((domain, reason))
+
+    def browser_worker(self):
+        while True:
+            item = self.browser_q.get()
+            if item is None:
+                break
+            domain, reason = item
+            try:
+                logo_url, strategy, filename, img_hash, message, resp = self.browser_fn(domain)
+                self.record(domain=domain, tier="browser", status="success", strategy=strategy, filename=filename,
+                            hash=img_hash, reason=reason, message=message, url=logo_url, resp=resp)
+            except Exception as e:
+                self.record(domain=domain, tier="browser", status="fail", reason=reason, message=str(e))
+
+    def run(self, domains, probe=None):
+        probe = probe or preflight_domains
+        previous = load_previous_reasons()
+        for domain, reason, details in probe(domains):
+            tier = route(reason, previous.get(domain))
+            if tier == "skip":
+                self.record(domain=domain, tier="preflight", status="dead", reason=reason, message=details)
+            elif tier == "browser":
+                self.browser_q.put((domain, previous[domain]))
+            else:
+                self.http_q.put(domain)
+
+        http_threads = [threading.Thread(target=self.http_worker) for _ in range(self.http_workers)]
+        browser_threads = [threading.Thread(target=self.browser_worker) for _ in range(self.browser_workers)]
+        for t in http_threads + browser_threads:
+            t.start()
+        # one sentinel per worker, the browser tier only stops once every http worker is done escalating
+        for _ in http_threads:
+            self.http_q.put(None)
+        for t in http_threads:
+            t.join()
+        for _ in browser_threads:
+            self.browser_q.put(None)
+        for t in browser_threads:
+            t.join()
+        return self.results
+
+def main():
+    ensure_dirs()
+    instr.start_run("pipeline")
+    download_logos.STRATEGY_STATS.update(load_stats())
+    domains = load_and_clean_domains()
+    pipeline = Pipeline()
+    results = pipeline.run(domains)
+    save_existing_hashes(pipeline.existing_hashes)
+    save_stats(download_logos.STRATEGY_STATS)
+    save_state(pipeline.crawl_state)
+    if pipeline.sink is not None:
+        pipeline.sink.save()
+
+    with open(RESULTS_CSV, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+    total = len(results)
+    success = sum(r["status"] == "success" for r in results)
+    by_browser = sum(r["status"] == "success" and r["tier"] == "browser" for r in results)
+    dead = sum(r["status"] == "dead" for r in results)
+    rate = (success / total) * 100 if total else 0
+    print(f"\nProcessed {total} domains from {download_logos.SUBSET_CSV}: {success} successes ({by_browser} via browser), {dead} dead")
+    print(f"Success rate: {rate:.1f}%")
+    print(f"Results written to {RESULTS_CSV}")
+    instr.finish_run()
+
+if __name__ == "__main__":
+    main()
+
+# Unified extraction pipeline:
+# Replaces the download_logos -> debug_sites -> browser_accessible_sites -> download_logos_failed_domains chain with one run.
+# Domains are probed, routed to the cheapest tier (skip, requests, browser) and escalated to the browser as soon as the requests tier fails.
@@ -0,0 +1,161 @@
+import asyncio
+import csv
+import socket
+import ssl
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from debug_sites import classify_browser_access
+import instrumentation as instr
+import net_policy
+
+DOMAINS_CSV    = "data/failed_sites.csv"
+PREFLIGHT_CSV  = "data/preflight.csv"
+DNS_TIMEOUT     = 2 #seconds, a domain that doesn't resolve in 2s is almost always dead
+CONNECT_TIMEOUT = 3 #tcp connect + tls handshake, way below the read timeout of the full fetch
+CONCURRENCY     = 200 #how many domains are probed at the same time
+DNS_THREADS     = CONCURRENCY #threads running the blocking getaddrinfo calls, one per probe in flight
+HTTPS_PORT = 443
+HTTP_PORT  = 80
+
+_dns_pool = None
+
+#getaddrinfo blocks, so lookups run on a dedicated pool as big as CONCURRENCY (the loop's default executor has at most 32 threads)
+def dns_pool():
+    global _dns_pool
+    if _dns_pool is None:
+        _dns_pool = ThreadPoolExecutor(max_workers=DNS_THREADS, thread_name_prefix="dns")
+    return _dns_pool
+
+# default resolver, raises asyncio.TimeoutError itself after DNS_TIMEOUT
+# the timer starts when a pool thread actually picks the lookup up, time spent queued for a thread doesn't count
+async def system_resolver(host, port, timeout=None):
+    loop = asyncio.get_running_loop()
+    started = loop.create_future()
+    def lookup():
+        loop.call_soon_threadsafe(lambda: started.done() or started.set_result(None))
+        return socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    fut = loop.run_in_executor(dns_pool(), lookup)
+    await asyncio.wait({started, fut}, return_when=asyncio.FIRST_COMPLETED)
+    infos = await asyncio.wait_for(fut, timeout=timeout or DNS_TIMEOUT)
+    return [info[4][0] for info in infos]
+
+#open a tcp connection (optionally with tls) and close it right away, we only care if the handshake works
+async def connect_probe(ip, port, domain, ssl_context=None):
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(ip, port, ssl=ssl_context, server_hostname=domain if ssl_context else None),
+        timeout=CONNECT_TIMEOUT,
+    )
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except Exception:
+        pass
+
+# probes one domain: DNS -> TCP/TLS on 443 -> TCP on 80
+# returns the same reason codes diagnose_error uses (dns, ssl, timeout, connection-error) or "ok" if the site is reachable
+async def probe_domain(domain, resolver=None, https_port=HTTPS_PORT, http_port=HTTP_PORT, ssl_context=None):
+    resolver = resolver or system_resolver
+    if ssl_context is None:
+        ssl_context = ssl.create_default_context()
+
+    # 1 dns
+    t0 = time.perf_counter()
+    try:
+        if resolver is system_resolver:
+            addrs = await resolver(domain, https_port) #applies DNS_TIMEOUT itself, from when a thread starts the lookup
+        else:
+            addrs = await asyncio.wait_for(resolver(domain, https_port), timeout=DNS_TIMEOUT) #injected ones may hang
+        instr.observe("dns", time.perf_counter() - t0, domain=domain)
+    except asyncio.TimeoutError:
+        return domain, "dns", "DNS resolution timed out"
+    except (socket.gaierror, OSError) as e:
+        return domain, "dns", str(e)
+    if not addrs:
+        return domain, "dns", "No address records"
+    addrs = list(dict.fromkeys(addrs)) #getaddrinfo repeats an address once per protocol
+
+    # 2 tcp + tls on https, every resolved address is tried until one answers (the first record can be a dead one)
+    for ip in addrs:
+        t0 = time.perf_counter()
+        try:
+            await connect_probe(ip, https_port, domain, ssl_context)
+            elapsed = time.perf_counter() - t0
+            instr.observe("connect", elapsed, domain=domain)
+            net_policy.observe("connect", elapsed)
+            return domain, "ok", f"TLS handshake ok ({ip})"
+        except ssl.SSLError as e:
+            reason, details = "ssl", str(e)
+        except asyncio.TimeoutError:
+            reason, details = "timeout", f"Connection to {domain}:{https_port} ({ip}) timed out"
+        except OSError as e:
+            reason, details = "connection-error", str(e)
+
+    # 3 fetch_url falls back to plain http, so an open port 80 on any address still counts as alive
+    for ip in addrs:
+        try:
+            await connect_probe(ip, http_port, domain)
+            return domain, "ok", f"HTTP only ({ip}), https failed: {details}"
+        except (asyncio.TimeoutError, OSError):
+            pass
+    return domain, reason, details
+
+#probes all domains concurrently, bounded by CONCURRENCY, results keep the input order
+async def probe_all(domains, resolver=None, https_port=HTTPS_PORT, http_port=HTTP_PORT, ssl_context=None):
+    sem = asyncio.Semaphore(CONCURRENCY)
+    #one context for the whole run, loading the CA store costs ~30ms and used to be paid per domain
+    ssl_context = ssl_context or ssl.create_default_context()
+
+    async def bounded(domain):
+        async with sem:
+            return await probe_domain(domain, resolver, https_port, http_port, ssl_context)
+
+    return await asyncio.gather(*(bounded(d) for d in domains))
+
+def preflight_domains(domains, **kwargs):
+    return asyncio.run(probe_all(domains, **kwargs))
+
+#a domain is dead when even a browser would not be able to reach it
+def is_dead(reason):
+    return reason != "ok" and classify_browser_access(reason) == "no"
+
+#split a domain list into the ones worth fetching and the dead ones (with reason and details)
+def split_alive_dead(domains, **kwargs):
+    alive, dead = [], []
+    for domain, reason, details in preflight_domains(domains, **kwargs):
+        if is_dead(reason):
+            dead.append((domain, reason, details))
+        else:
+            alive.append(domain)
+    return alive, dead
+
+def main():
+    in_csv = sys.argv[1] if len(sys.argv) > 1 else DOMAINS_CSV
+    seen = set()
+    domains = []
+    with open(in_csv, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            dom = row["domain"].strip().lower()
+            if dom and dom not in seen:
+                seen.add(dom)
+                domains.append(dom)
+
+    results = preflight_domains(domains)
+    with open(PREFLIGHT_CSV, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["domain", "reason", "details", "browser_accessible"])
+        for domain, reason, details in results:
+            writer.writerow([domain, reason, details, "yes" if reason == "ok" else classify_browser_access(reason)])
+
+    n_dead = sum(is_dead(r) for _, r, _ in results)
+    print(f"[INFO] Preflight results saved to {PREFLIGHT_CSV}")
+    print(f"Total domains: {len(results)}")
+    print(f"Alive: {len(results) - n_dead}")
+    print(f"Dead: {n_dead}")
+
+if __name__ == "__main__":
+    main()
+
+# Script for the pre-flight probe:
+# Resolves DNS and opens TCP/TLS connections for many domains at once with short timeouts, so dead domains are skipped before the slow requests/browser passes.
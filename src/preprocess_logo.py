@@ -1,33 +1,80 @@
 import os
 from pathlib import Path
 from PIL import Image, ImageOps #python image library
-import cairosvg #rasterization svg to png
+import numpy as np
+import imagehash
 import csv
+import hashlib
+import json
+from collections import defaultdict
+import threading
+from safe_decode import open_path, open_bytes
+import instrumentation as instr
 
 
 RAW_DIR   = "data/logos/"
 OUT_DIR   = "data/logos_preprocessed/"
 ERR_CSV   = "data/preprocess_errors.csv"
+MANIFEST  = "data/logo_manifest.json" #content hash -> preprocessed file + every domain using it
+FEATURES  = "data/logo_features.json" #preprocessed file -> colour histogram + aspect ratio, used by the cascade matcher
+HIST_BINS = 4 #bins per RGB channel, 4x4x4 = 64 bin colour histogram
+TRIM      = True #crop the whitespace around the logo before padding
+TRIM_TOL  = 16 #pixels closer than this to white count as background
+ICON_ASPECT = 1.6 #logos wider (or taller) than this get an extra icon-region fingerprint
+ZOOM      = 0.8 #centre crop kept for the zoom fingerprint
+FP_SIZE   = (64, 64)
+DOMAIN_HASHES_CSV = "data/domain_hashes.csv" #written by download_logos
 SIZE      = (128, 128) #uniform size 
 BG_COLOR  = (255, 255, 255)  #white bg
 
 def ensure_out_dir():
     Path(OUT_DIR).mkdir(parents=True, exist_ok=True)
 
-# vonverts SVG files to PNG returns PIL Image
-def rasterize_svg(path):
-    from io import BytesIO
-    png_bytes = cairosvg.svg2png(url=path)
-    return Image.open(BytesIO(png_bytes))
+# cheap colour descriptors computed before the grayscale step throws colour away
+# histogram only counts foreground pixels (not the white background), aspect ratio is the one of the trimmed logo
+def colour_features(img):
+    small = img.copy()
+    small.thumbnail((64, 64))
+    px = np.asarray(small, dtype=np.uint8).reshape(-1, 3)
+    fg = px[(255 - px.astype(np.int16)).max(axis=1) > 24]
+    hist = np.zeros(HIST_BINS ** 3)
+    if len(fg):
+        q = (fg // (256 // HIST_BINS)).astype(np.int32)
+        idx = (q[:, 0] * HIST_BINS + q[:, 1]) * HIST_BINS + q[:, 2]
+        hist = np.bincount(idx, minlength=HIST_BINS ** 3) / len(fg)
+    bbox = ImageOps.invert(ImageOps.grayscale(img)).getbbox()
+    w, h = (bbox[2] - bbox[0], bbox[3] - bbox[1]) if bbox else img.size
+    return {"hist": [round(float(v), 4) for v in hist], "aspect": round(w / max(h, 1), 4)}
 
-# standardizes and normalizes a single image
+# crop the white border so padded and unpadded versions of the same logo line up
+def trim_whitespace(gray):
+    bbox = ImageOps.invert(gray).point(lambda v: 255 if v > TRIM_TOL else 0).getbbox()
+    return gray.crop(bbox) if bbox else gray
+
+# pHashes of a few views of the trimmed logo, stored as hex so grouping can match them with exact lookups
+# trim: whole logo, icon: square at the start of a wide/tall logo (icon + wordmark layouts), zoom: centre crop
+def fingerprints(gray):
+    w, h = gray.size
+    views = {"trim": gray}
+    if w > ICON_ASPECT * h:
+        views["icon"] = gray.crop((0, 0, h, h))
+    elif h > ICON_ASPECT * w:
+        views["icon"] = gray.crop((0, 0, w, w))
+    dx, dy = int(w * (1 - ZOOM) / 2), int(h * (1 - ZOOM) / 2)
+    if dx or dy:
+        views["zoom"] = gray.crop((dx, dy, w - dx, h - dy))
+    return {k: str(imagehash.phash(ImageOps.pad(v, FP_SIZE, color=255))) for k, v in views.items()}
+
+# standardizes and normalizes a single image, returns its colour features and fingerprints
+# svgs are rasterized (sanitizer + raster cache) in a killable worker, rasters are decoded under byte/pixel caps (safe_decode)
 def preprocess_image(in_path, out_path):
-    ext = in_path.lower().rsplit(".",1)[-1] # truns mylogo.final.svg into ['mylogo.final', 'svg']
-    if ext == "svg":
-        img = rasterize_svg(in_path)
-    else:
-        img = Image.open(in_path)
+    img = open_path(in_path)
+    img, features = normalize_image(img)
+    img.save(out_path, format="PNG", optimize=True)
+    return features
 
+# in memory part of preprocess_image: decoded image -> 128x128 grayscale + features
+def normalize_image(img):
       # handle images with transparency
     if img.mode in ("RGBA", "LA") or (img.mode=="P" and "transparency" in img.info):
         img = img.convert("RGBA")
@@ -37,25 +84,81 @@ def preprocess_image(in_path, out_path):
 
     if img.mode != "RGB":
         img = img.convert("RGB")
+    features = colour_features(img)
      #convert to grayscale for perceptual hashing better clustering by shape, not color
     img = ImageOps.grayscale(img)
+    if TRIM:
+        img = trim_whitespace(img)
+    features["fp"] = fingerprints(img)
     #resize
     img = ImageOps.pad(img, SIZE, color=255)
-    img.save(out_path, format="PNG", optimize=True)
+    return img, features
+
+#filenames are domain_subdomain_timestamp.ext, rebuild the domain ignoring the timestamp
+def filename_to_domain(fname):
+    base = os.path.splitext(fname)[0]
+    return ".".join(base.split("_")[:-1])
+
+#md5 of the raw bytes, same hash the downloader stores in logo_hashes.json
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+#hash -> domains recorded by the downloader, includes domains whose logo was a duplicate and never got its own file
+#the csv is append only, a domain whose logo changed (recrawl) only counts for its latest hash
+def load_domain_hashes():
+    latest = {}
+    if os.path.exists(DOMAIN_HASHES_CSV):
+        with open(DOMAIN_HASHES_CSV, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                latest[row["domain"]] = row["hash"]
+    hash_domains = defaultdict(list)
+    for domain, h in latest.items():
+        hash_domains[h].append(domain)
+    return hash_domains
+
+def add_domains(entry, domains):
+    for d in domains:
+        if d and d not in entry["domains"]:
+            entry["domains"].append(d)
 
 def main():
     ensure_out_dir()
+    instr.start_run("preprocess_logo")
     errors = []
-    for fname in os.listdir(RAW_DIR):
-        inp = os.path.join(RAW_DIR, fname)
-        name, _ = os.path.splitext(fname)
-        out = os.path.join(OUT_DIR, f"{name}.png")
-        try:
-            preprocess_image(inp, out)
-            print(f"[OK] {fname} → {out}")
-        except Exception as e:
-            print(f"[ERROR] {fname}: {e}")
-            errors.append([fname, str(e)])
+    hash_domains = load_domain_hashes()
+    manifest = {}
+    features = {}
+    dups = 0
+    with instr.profiled("preprocess_loop"):
+        for fname in os.listdir(RAW_DIR):
+            inp = os.path.join(RAW_DIR, fname)
+            name, _ = os.path.splitext(fname)
+            out = os.path.join(OUT_DIR, f"{name}.png")
+            # byte identical logos are preprocessed only once, the other domains are attached to the first file
+            h = file_hash(inp)
+            if h in manifest:
+                add_domains(manifest[h], [filename_to_domain(fname)])
+                dups += 1
+                print(f"[DUP] {fname} → {manifest[h]['file']}")
+                continue
+            try:
+                with instr.timer("preprocess", file=fname):
+                    features[f"{name}.png"] = preprocess_image(inp, out)
+                manifest[h] = {"file": f"{name}.png", "domains": []}
+                add_domains(manifest[h], [filename_to_domain(fname)] + hash_domains.get(h, []))
+                print(f"[OK] {fname} → {out}")
+            except Exception as e:
+                print(f"[ERROR] {fname}: {e}")
+                errors.append([fname, str(e)])
+                instr.count("preprocess_error")
+    instr.count("duplicate_skipped", dups)
+
+    with open(MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    with open(FEATURES, "w", encoding="utf-8") as f:
+        json.dump(features, f)
+    print(f"[INFO] {len(manifest)} logo-uri unice, {dups} duplicate sărite. Manifest în {MANIFEST}")
    #log all errors 
     if errors:
         with open(ERR_CSV, "w", newline='', encoding="utf-8") as f:
@@ -63,6 +166,112 @@ def main():
             writer.writerow(["filename", "error"])
             writer.writerows(errors)
         print(f"[INFO] {len(errors)} fișiere cu erori. Vezi {ERR_CSV}")
+    instr.finish_run()
+
+# streaming mode of download_logos/pipeline: the fetched bytes are normalized in memory right after the original is stored,
+# so data/logos is never read back, the manifest/features are kept here and written once by save()
+class StreamPreprocessor:
+    def __init__(self):
+        ensure_out_dir()
+        self.lock = threading.Lock()
+        self.manifest, self.features, self.errors = {}, {}, []
+        if os.path.exists(MANIFEST):
+            with open(MANIFEST, encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        if os.path.exists(FEATURES):
+            with open(FEATURES, encoding="utf-8") as f:
+                self.features = json.load(f)
+
+    #data is the original (raw) logo, filename/img_hash what download_logos stored it as, returns the preprocessed file
+    def add(self, data, filename, img_hash, domain):
+        with self.lock:
+            entry = self.manifest.get(img_hash)
+            if entry:
+                add_domains(entry, [domain])
+                instr.count("duplicate_skipped")
+                return entry["file"]
+        name, _ = os.path.splitext(filename)
+        out = f"{name}.png"
+        try:
+            with instr.timer("preprocess", file=filename):
+                img = open_bytes(data, filename)
+                gray, features = normalize_image(img)
+                gray.save(os.path.join(OUT_DIR, out), format="PNG", optimize=True)
+        except Exception as e:
+            print(f"[ERROR] {filename}: {e}")
+            instr.count("preprocess_error")
+            with self.lock:
+                self.errors.append([filename, str(e)])
+            return None
+        with self.lock:
+            entry = self.manifest.setdefault(img_hash, {"file": out, "domains": []})
+            add_domains(entry, [domain])
+            self.features[entry["file"]] = features
+        return out
+
+    def save(self):
+        with self.lock:
+            with open(MANIFEST, "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f)
+            with open(FEATURES, "w", encoding="utf-8") as f:
+                json.dump(self.features, f)
+            if self.errors:
+                with open(ERR_CSV, "w", newline='', encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(["filename", "error"])
+                    writer.writerows(self.errors)
+        print(f"[INFO] {len(self.manifest)} logo-uri unice în {MANIFEST}, {len(self.errors)} erori")
+
+# recrawl path: only the (domain, raw filename) pairs whose logo changed are preprocessed, manifest and features are patched in place
+# a domain has one current logo, so it is removed from the entry of its previous logo, entries left without domains are dropped
+# the manifest is only patched once the new file preprocessed, a logo that fails keeps the domain on its previous one
+# returns the preprocessed files of the changed domains
+def preprocess_changed(changes):
+    ensure_out_dir()
+    manifest, features = {}, {}
+    if os.path.exists(MANIFEST):
+        with open(MANIFEST, encoding="utf-8") as f:
+            manifest = json.load(f)
+    if os.path.exists(FEATURES):
+        with open(FEATURES, encoding="utf-8") as f:
+            features = json.load(f)
+    hash_domains = load_domain_hashes()
+    domain_entry = {d: h for h, entry in manifest.items() for d in entry["domains"]} #built once, not scanned per change
+    done = []
+    for domain, fname in changes:
+        inp = os.path.join(RAW_DIR, fname)
+        name, _ = os.path.splitext(fname)
+        h = file_hash(inp)
+        if h not in manifest:
+            try:
+                with instr.timer("preprocess", file=fname):
+                    features[f"{name}.png"] = preprocess_image(inp, os.path.join(OUT_DIR, f"{name}.png"))
+            except Exception as e:
+                print(f"[ERROR] {fname}: {e}")
+                instr.count("preprocess_error")
+                continue
+            manifest[h] = {"file": f"{name}.png", "domains": []}
+        domains = [domain] + hash_domains.get(h, [])
+        for d in domains:
+            old_h = domain_entry.get(d)
+            if old_h is not None and old_h != h and old_h in manifest:
+                entry = manifest[old_h]
+                entry["domains"] = [x for x in entry["domains"] if x != d]
+                if not entry["domains"]:
+                    old = os.path.join(OUT_DIR, entry["file"])
+                    if entry["file"] != manifest[h]["file"] and os.path.exists(old):
+                        os.remove(old)
+                    features.pop(entry["file"], None)
+                    del manifest[old_h]
+            domain_entry[d] = h
+        add_domains(manifest[h], domains)
+        done.append((domain, manifest[h]["file"]))
+        print(f"[OK] {domain}: {fname} → {manifest[h]['file']}")
+    with open(MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    with open(FEATURES, "w", encoding="utf-8") as f:
+        json.dump(features, f)
+    return done
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,126 @@
+import os
+import csv
+import time
+import hashlib
+from urllib.parse import quote
+import instrumentation as instr
+import download_logos as dl
+from crawl_state import load_state, save_state, update_state, touch, validators
+
+CHANGED_CSV  = "data/changed_logos.csv" #domain -> new raw logo file, input of the incremental preprocessing
+RECHECK_DAYS = 7 #domains checked more recently than this are skipped by a scheduled run
+PREPROCESS_CHANGED = True #preprocess the changed logos right after the recrawl
+PUSH_TO_SERVICE = True #insert the changed logos into a running logo_service, only the service's groups change until the next group_logos_buckets run
+
+def is_due(entry, now=None, days=RECHECK_DAYS):
+    now = now or time.time()
+    return now - entry.get("checked", 0) >= days * 86400
+
+# conditional GET on the last seen logo asset, no homepage fetch
+# returns the response (304 or 200 with an image) or None when the asset is gone and the full extraction has to run
+def revalidate(entry):
+    url = entry.get("url") or ""
+    if not url.startswith("http") or url.endswith(dl.INLINE_SVG) or entry.get("strategy", "").startswith("svg-inline"):
+        return None #inline svgs only exist inside the homepage html
+    try:
+        resp = dl.timed_get(url, headers=validators(entry))
+    except Exception:
+        return None
+    if resp.status_code == 304:
+        return resp
+    if resp.status_code != 200 or not resp.content or resp.headers.get("Content-Type", "").startswith("text/html"):
+        return None #moved/removed asset, or a soft 404 that redirected to a page
+    return resp
+
+# one domain of a recrawl: "unchanged", "changed" or "new", plus the stored file and how it was decided
+def recrawl_domain(domain, state, existing_hashes):
+    entry = state.get(domain)
+    if entry:
+        resp = revalidate(entry)
+        if resp is not None and resp.status_code == 304:
+            touch(state, domain)
+            return "unchanged", entry["filename"], entry["hash"], "not-modified"
+        if resp is not None:
+            if hashlib.md5(resp.content).hexdigest() == entry["hash"]:
+                update_state(state, domain, entry["url"], entry["strategy"], entry["filename"], entry["hash"], resp)
+                return "unchanged", entry["filename"], entry["hash"], "same-hash"
+            ext = ".svg" if entry["url"].endswith(".svg") else ".png"
+            filename, img_hash = dl.save_bytes(resp.content, domain, ext, existing_hashes)
+            update_state(state, domain, entry["url"], entry["strategy"], filename, img_hash, resp)
+            return "changed", filename, img_hash, "asset"
+
+    # no usable asset url: full find_logo_url + download
+    logo_url, strategy, filename, img_hash, _, resp = dl.download_domain(domain, existing_hashes)
+    status = "new" if not entry else ("unchanged" if entry.get("hash") == img_hash else "changed")
+    update_state(state, domain, logo_url, strategy, filename, img_hash, resp)
+    return status, filename, img_hash, "full"
+
+# domains to recheck: every known domain that is due, or the subset file when recrawling a specific batch
+def due_domains(state, from_subset=False):
+    if from_subset:
+        return dl.load_and_clean_domains()
+    now = time.time()
+    return [d for d, entry in state.items() if is_due(entry, now)]
+
+# incremental grouping is limited to the running service: it logs the inserts and replays them on restart,
+# but groups.csv and the artifact bundle are only rebuilt by group_logos_buckets (which also picks these pngs up)
+def push_to_service(done):
+    from logo_service import service_post, LOGO_DIR
+    pushed = 0
+    for domain, fname in done:
+        with open(os.path.join(LOGO_DIR, fname), "rb") as f:
+            if service_post(f"/insert?domain={quote(domain)}&file={quote(fname)}", f.read()) is None:
+                print("[INFO] logo_service is not running, the next group_logos_buckets run picks the changes up")
+                return pushed
+        pushed += 1
+    return pushed
+
+def main(from_subset=False):
+    dl.ensure_dirs()
+    instr.start_run("recrawl")
+    state = load_state()
+    existing_hashes = dl.load_existing_hashes()
+    domains = due_domains(state, from_subset)
+    counts = {"unchanged": 0, "changed": 0, "new": 0, "fail": 0}
+    changes = []
+    with instr.profiled("recrawl_loop"):
+        for domain in domains:
+            try:
+                with instr.timer("recrawl_domain", domain=domain):
+                    status, filename, img_hash, how = recrawl_domain(domain, state, existing_hashes)
+            except Exception as e:
+                counts["fail"] += 1
+                instr.count("recrawl", status="fail")
+                print(f"[FAILURE] {domain} → {e!r}")
+                continue
+            counts[status] += 1
+            instr.count("recrawl", status=status, how=how)
+            if status != "unchanged":
+                dl.record_domain_hash(domain, img_hash, filename)
+                changes.append((domain, filename))
+            print(f"[{status.upper()}] {domain} ({how})")
+
+    save_state(state)
+    dl.save_existing_hashes(existing_hashes)
+    with open(CHANGED_CSV, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["domain", "filename"])
+        writer.writerows(changes)
+    print(f"\nRechecked {len(domains)} domains: {counts['unchanged']} unchanged, {counts['changed']} changed, {counts['new']} new, {counts['fail']} failed")
+    print(f"Changed logos listed in {CHANGED_CSV}")
+
+    if changes and PREPROCESS_CHANGED:
+        from preprocess_logo import preprocess_changed
+        done = preprocess_changed(changes)
+        if PUSH_TO_SERVICE:
+            print(f"[INFO] {push_to_service(done)} changed logos inserted into logo_service")
+    instr.finish_run()
+
+if __name__ == "__main__":
+    import sys
+    main(from_subset="--subset" in sys.argv)
+
+# Recrawl:
+# Scheduled refresh (e.g. weekly from cron) that revalidates the last seen logo asset of each domain with ETag/Last-Modified,
+# falls back to the full find_logo_url extraction only when the asset is gone, and feeds only the changed logos to preprocessing
+# and to a running logo_service; groups.csv and the bundle pick them up on the next group_logos_buckets run.
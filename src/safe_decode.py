@@ -0,0 +1,140 @@
+import os
+import threading
+import multiprocessing as mp
+from io import BytesIO
+from PIL import Image
+import instrumentation as instr
+
+MAX_BYTES     = 20 * 2**20 #raster files bigger than this are not decoded at all
+MAX_SVG_BYTES = 5 * 2**20
+MAX_PIXELS    = 25_000_000 #checked on the header, before any pixel is decoded (jpeg: draft decodes it at up to 1/8 scale)
+MAX_FULL_PIXELS = 4_000_000 #non-jpeg rasters can't be decoded reduced, they are fully decoded first so their cap is lower
+DECODE_MAX    = (512, 512) #big rasters are decoded/reduced to about this (4x the 128px target, trim still has room)
+ICO_TARGET    = (128, 128) #preprocess_logo.SIZE
+SVG_TIMEOUT   = 10 #seconds, the rasterizer process is killed after this and the logo counts as an error
+
+class DecodeError(ValueError):
+    pass
+
+#ico files hold several frames, take the smallest one that still covers the target instead of PIL's default (largest)
+def best_ico_size(img, target=ICO_TARGET):
+    sizes = sorted(img.ico.sizes())
+    covering = [s for s in sizes if s[0] >= target[0] and s[1] >= target[1]]
+    return covering[0] if covering else sizes[-1]
+
+# header first, then a decode that is bounded by MAX_PIXELS (MAX_FULL_PIXELS for non-jpeg) and reduced towards DECODE_MAX
+# jpeg is decoded straight at 1/2, 1/4 or 1/8 scale (draft), other formats are reduced right after the full load
+# multi frame gif/webp/png only ever decode their first frame
+#full_limit overrides MAX_FULL_PIXELS, rasterized svgs use it since their pixels are already paid for (and time bounded)
+def open_raster(src, full_limit=None):
+    img = Image.open(src)
+    if img.format == "ICO":
+        img.size = best_ico_size(img)
+    w, h = img.size
+    limit = MAX_PIXELS if img.format == "JPEG" else min(full_limit or MAX_FULL_PIXELS, MAX_PIXELS)
+    if w * h > limit:
+        instr.count("decode_rejected", reason="pixels")
+        raise DecodeError(f"{img.format} image is {w}x{h}, more than {limit} pixels")
+    if img.format == "JPEG":
+        img.draft("RGB" if img.mode not in ("L", "RGB") else img.mode, DECODE_MAX)
+    img.load()
+    factor = min(img.width // DECODE_MAX[0], img.height // DECODE_MAX[1])
+    if factor > 1:
+        if img.mode not in ("L", "RGB", "RGBA", "LA"):
+            img = img.convert("RGBA")
+        img = img.reduce(factor)
+    return img
+
+def _check_size(n, name, limit):
+    if n > limit:
+        instr.count("decode_rejected", reason="bytes")
+        raise DecodeError(f"{name} is {n} bytes, limit is {limit}")
+
+# svgs are rasterized in a separate process so a file that makes cairosvg spin can be killed
+# a missing cairosvg is reported per request instead of killing the worker, which would be restarted for every svg
+def _svg_worker(conn):
+    from xml.parsers.expat import ExpatError
+    try:
+        import cairosvg
+        from patch_filter_svg_raster import rasterize_svg_bytes
+        import_error = None
+    except ImportError as e:
+        import_error = repr(e)
+    while True:
+        data = conn.recv()
+        if data is None:
+            break
+        if import_error:
+            conn.send(("error", import_error))
+            continue
+        try:
+            try:
+                png = rasterize_svg_bytes(data)
+            except ExpatError:
+                png = cairosvg.svg2png(bytestring=data) #files the sanitizer can't parse go to cairosvg as they are
+            conn.send(("ok", png))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+
+# one long lived worker, restarted only after a kill, so the process start isn't paid per svg
+class SvgRasterizer:
+    def __init__(self, timeout=SVG_TIMEOUT):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.proc = None
+
+    def _start(self):
+        self.conn, child = mp.Pipe()
+        self.proc = mp.Process(target=_svg_worker, args=(child,), daemon=True)
+        self.proc.start()
+
+    def _kill(self):
+        self.proc.kill()
+        self.proc.join()
+        self.proc = None
+
+    def rasterize(self, data):
+        with self.lock:
+            if self.proc is None or not self.proc.is_alive():
+                self._start()
+            try:
+                self.conn.send(data)
+                if not self.conn.poll(self.timeout):
+                    self._kill()
+                    instr.count("decode_rejected", reason="svg-timeout")
+                    raise DecodeError(f"svg rasterization took more than {self.timeout}s")
+                status, payload = self.conn.recv()
+            except (EOFError, OSError):
+                self._kill()
+                raise DecodeError("svg rasterizer crashed")
+        if status != "ok":
+            raise DecodeError(payload)
+        return payload
+
+_rasterizer = SvgRasterizer()
+
+def rasterize_svg_guarded(data, name=""):
+    _check_size(len(data), name or "svg", MAX_SVG_BYTES)
+    with instr.timer("rasterize", file=name):
+        return _rasterizer.rasterize(data)
+
+#logo bytes (downloader stream, service query) -> bounded PIL image
+def open_bytes(data, name=""):
+    if name.lower().endswith(".svg") or b"<svg" in data[:1024]:
+        return open_raster(BytesIO(rasterize_svg_guarded(data, name)), full_limit=MAX_PIXELS)
+    _check_size(len(data), name or "image", MAX_BYTES)
+    return open_raster(BytesIO(data))
+
+#logo file on disk -> bounded PIL image, the size is checked before reading
+def open_path(path):
+    name = os.path.basename(path)
+    if path.lower().endswith(".svg"):
+        _check_size(os.path.getsize(path), name, MAX_SVG_BYTES)
+        with open(path, "rb") as f:
+            return open_bytes(f.read(), name)
+    _check_size(os.path.getsize(path), name, MAX_BYTES)
+    return open_raster(path)
+
+# Bounded image decoding:
+# Byte and pixel caps checked before decoding, draft/reduce on load for big rasters, the best ico frame only,
+# and svg rasterization in a killable worker process, so the time spent on one logo has a known upper bound.
@@ -0,0 +1,57 @@
+import os
+import json
+import threading
+
+STATS_FILE = "data/strategy_stats.json"
+MIN_SAMPLES = 50 #a site pattern needs this many wins before its own ordering is trusted over the global one
+
+_lock = threading.Lock()
+
+#site pattern from the homepage: CMS / site builder, pages built with the same tool put the logo in the same place
+def site_pattern(soup, html):
+    gen = soup.find("meta", attrs={"name": "generator"})
+    gen = (gen.get("content", "") if gen else "").lower()
+    text = html[:200000].lower()
+    for name, marks in [
+        ("wordpress", ["wordpress", "wp-content"]),
+        ("shopify", ["shopify", "cdn.shopify.com"]),
+        ("wix", ["wix.com", "wixstatic"]),
+        ("squarespace", ["squarespace"]),
+        ("drupal", ["drupal"]),
+        ("joomla", ["joomla"]),
+    ]:
+        if any(m in gen for m in marks) or any(m in text for m in marks[1:]):
+            return name
+    return "generic"
+
+# {"global": {strategy: wins}, "patterns": {pattern: {strategy: wins}}}
+def load_stats():
+    if os.path.exists(STATS_FILE) and os.stat(STATS_FILE).st_size > 0:
+        with open(STATS_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    return {"global": {}, "patterns": {}}
+
+def save_stats(stats):
+    with _lock:
+        with open(STATS_FILE, "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2)
+
+def record_win(stats, strategy, pattern):
+    strategy = strategy.split(":")[0] #brand-homepage:<netloc> counts as brand-homepage
+    with _lock:
+        stats["global"][strategy] = stats["global"].get(strategy, 0) + 1
+        per = stats["patterns"].setdefault(pattern, {})
+        per[strategy] = per.get(strategy, 0) + 1
+
+# reorders strategies by wins for this pattern (global wins if the pattern has few samples)
+# cheap strategies always stay before expensive ones, so a fetch only happens when the parsed page had nothing
+def order_from_stats(stats, pattern, default_order, expensive):
+    wins = stats["patterns"].get(pattern, {})
+    if sum(wins.values()) < MIN_SAMPLES:
+        wins = stats["global"]
+    rank = {s: i for i, s in enumerate(default_order)}
+    key = lambda s: (s in expensive, -wins.get(s, 0), rank[s])
+    return sorted(default_order, key=key)
+
+# Strategy statistics for find_logo_url:
+# Counts which strategy found the logo, globally and per site pattern (CMS), and derives a strategy order from those counts.
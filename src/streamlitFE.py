@@ -1,20 +1,35 @@
 import streamlit as st
-import pandas as pd
 import os
-from PIL import Image
 from io import BytesIO
 import base64
+from urllib.parse import quote
+from logo_service import service_get
+from artifact_bundle import load_bundle
+from watchlist import ALERTS_FILE, tail_alerts
 
 
 LOGO_DIR = "data/logos_preprocessed/"
 GROUPS_CSV = "data/groups/groups_w_buckets.csv"
 
+#opens the precompiled bundle once per process instead of re-parsing the csv on every rerun
+@st.cache_resource
+def get_bundle():
+    return load_bundle(GROUPS_CSV)
+
 #loads a logo from disk, caches in memory for fast repeated access
 @st.cache_data
 def load_logo(filename):
+    from PIL import Image
     path = os.path.join(LOGO_DIR, filename)
     return Image.open(path)
 
+#size -> number of clusters, as a series for the bar charts
+@st.cache_data
+def size_distribution():
+    import pandas as pd
+    counts = get_bundle().stats["size_counts"]
+    return pd.Series({int(k): v for k, v in counts.items()}).sort_index()
+
 #returns an HTML download link for the image so user can download the PNG
 @st.cache_data
 def get_image_download_link(_img, filename):
@@ -29,9 +44,9 @@ st.set_page_config(page_title="Logo Similarity Demo", layout="wide")
 st.title("Logo Similarity - Global Use Case Scenarios")
 st.write("Explore and analyze clusters of visually similar logos extracted from websites.")
 
-df = pd.read_csv(GROUPS_CSV)
-df['domain_list'] = df['domains'].apply(lambda x: x.split(';')) #parse semicolon-separated domains as list
-df['num_domains'] = df['domain_list'].apply(len)
+bundle = get_bundle()
+if bundle.summary is None:
+    st.info("The bundle is older than the groups table: run group_logos_buckets for medoids, SSIM scores and the spread ranking.")
 
 #sidebar
 st.sidebar.title("Use Case Scenarios")
@@ -48,53 +63,69 @@ scenario = st.sidebar.selectbox(
 
 st.sidebar.markdown("---")
 st.sidebar.write("Cluster size distribution:")
-st.sidebar.bar_chart(df['num_domains'].value_counts().sort_index())
+st.sidebar.bar_chart(size_distribution())
 
 
 if scenario == "Brand Monitoring":
     st.subheader("Brand Monitoring: Identify identical logos across domains")
     st.write("Check if your logo appears consistently across all sub-brands or regions.")
     #pick the largest clusters
-    candidates = df[df['num_domains'] > 1].nlargest(10, 'num_domains')
-    choice = st.selectbox("Select a cluster:", candidates.index)
-    cluster = candidates.loc[choice]
-    st.info(f"This logo is used by {cluster['num_domains']} domains.")
+    candidates = bundle.largest(10)
+    choice = st.selectbox("Select a cluster:", candidates)
+    cluster = bundle.group(choice)
+    st.info(f"This logo is used by {len(cluster)} domains.")
+    if bundle.summary is not None:
+        row = bundle.summary[choice]
+        st.caption(f"{row['logos']} distinct logo files, {row['registrable']} registrable domains, SSIM min {row['ssim_min']:.2f} / mean {row['ssim_mean']:.2f}")
     cols = st.columns([1, 2])
     with cols[0]:
-        first_dom = cluster['domain_list'][0]
-        base = first_dom.replace('.', '_')
-        matches = [f for f in os.listdir(LOGO_DIR) if f.startswith(base)]
-        if matches:
-            img = load_logo(matches[0])
-            st.image(img, caption=matches[0], use_container_width=True)
-            st.markdown(get_image_download_link(img, matches[0]), unsafe_allow_html=True)
+        #medoid = the most representative logo of the cluster, first domain's logo for bundles without a summary
+        logo = bundle.medoid(choice) or bundle.logo_for(cluster[0])
+        if logo:
+            img = load_logo(logo)
+            st.image(img, caption=logo, use_container_width=True)
+            st.markdown(get_image_download_link(img, logo), unsafe_allow_html=True)
     with cols[1]:
         st.write("Associated domains:")
-        st.code("\n".join(cluster['domain_list']))
+        st.code("\n".join(cluster))
 
 elif scenario == "Fraud Detection":
     st.subheader("Fraud Detection: Spot suspicious logo reuse")
     st.write("Flag clusters with unusually high domain counts for manual review.")
-    suspects = df[df['num_domains'] > 10].nlargest(10, 'num_domains')
-    for _, row in suspects.iterrows():
-        st.write(f"Cluster of {row['num_domains']} domains:")
-        st.code("; ".join(row['domain_list']))
+    #alerts raised by the crawler while downloading, no regroup needed
+    if os.path.exists(ALERTS_FILE):
+        alerts = tail_alerts(20) #lines that don't parse (a writer killed mid line) are skipped
+        st.write(f"Latest watchlist alerts ({len(alerts)}):")
+        st.table([{k: a[k] for k in ("domain", "brand", "phash_dist", "file")} for a in reversed(alerts)])
+    if bundle.summary is not None:
+        #the same logo on many different registrable domains, not just many subdomains of one brand
+        for k in bundle.most_spread(10, min_registrable=3):
+            row = bundle.summary[k]
+            st.write(f"Cluster of {row['size']} domains across {row['registrable']} registrable domains:")
+            logo = bundle.medoid(k)
+            if logo:
+                st.image(load_logo(logo), caption=logo, width=100)
+            st.code("; ".join(bundle.group(k)))
+    else:
+        for k in bundle.largest(10, min_size=11):
+            st.write(f"Cluster of {bundle.sizes[k]} domains:")
+            st.code("; ".join(bundle.group(k)))
 
 elif scenario == "Reverse Logo Search":
     st.subheader("Reverse Logo Search: Find domains by logo")
     query = st.text_input("Enter part of a domain name:")
     if query:
-        #serach  all the clusters, domains for that substring
-        results = df[df['domains'].str.contains(query, case=False)]
-        for _, row in results.iterrows():
-            st.write(f"Cluster {row['group_id']}: {row['domains']}")
-            dom = row['domain_list'][0]
-            base = dom.replace('.', '_')
-            matches = [f for f in os.listdir(LOGO_DIR) if f.startswith(base)]
-            if matches:
+        #ask the logo service first (in-memory index), fall back to searching the bundle
+        hits = service_get(f"/search?q={quote(query)}")
+        if hits is None:
+            hits = bundle.search(query)
+        for row in hits:
+            st.write(f"Cluster {row['group_id']}: {';'.join(row['domains'])}")
+            logo = bundle.logo_for(row['domains'][0])
+            if logo:
                 st.image(
-                    load_logo(matches[0]),
-                    caption=matches[0],                    
+                    load_logo(logo),
+                    caption=logo,                    
                     width=150,                
                     use_container_width=False   
                 )
@@ -102,20 +133,23 @@ elif scenario == "Reverse Logo Search":
 elif scenario == "Brand Consistency Check":
     st.subheader("Brand Consistency: Detect logo variations")
     st.write("Show clusters where logos might visually differ within the same brand family.")
-    variable = df[df['num_domains'] > 1]
-    for _, row in variable.head(5).iterrows():
-        st.write(f"Cluster {row['group_id']} ({row['num_domains']} domains):")
-        cols = st.columns(min(row['num_domains'], 5))
-        for i, dom in enumerate(row['domain_list'][:5]):
-            base = dom.replace('.', '_')
-            matches = [f for f in os.listdir(LOGO_DIR) if f.startswith(base)]
-            if matches:
-                cols[i].image(load_logo(matches[0]), caption=dom, use_container_width=True)
+    #clusters with several distinct logo files, least similar (lowest SSIM) first
+    variable = bundle.most_variable(5) if bundle.summary is not None else (bundle.sizes > 1).nonzero()[0][:5]
+    for k in variable:
+        domains = bundle.group(k)
+        st.write(f"Cluster {bundle.group_ids[k]} ({len(domains)} domains):")
+        if bundle.summary is not None:
+            st.caption(f"SSIM min {bundle.summary['ssim_min'][k]:.2f} / mean {bundle.summary['ssim_mean'][k]:.2f}")
+        cols = st.columns(min(len(domains), 5))
+        for i, dom in enumerate(domains[:5]):
+            logo = bundle.logo_for(dom)
+            if logo:
+                cols[i].image(load_logo(logo), caption=dom, use_container_width=True)
 
 elif scenario == "Batch Export Logos":
     st.subheader("Batch Export: Download logos by cluster")
     st.write("Select clusters to export all member logos as a ZIP archive.")
-    clusters = df['group_id'].tolist()
+    clusters = bundle.group_ids.tolist()
     selected = st.multiselect("Pick clusters:", clusters)
     if st.button("Generate ZIP") and selected:
         st.success(f"ZIP archive for clusters {selected} is ready to download.")
@@ -127,6 +161,6 @@ else:
 st.markdown("---")
 st.subheader("Global Statistics")
 col1, col2 = st.columns(2)
-col1.metric("Total Clusters", len(df))
-col2.metric("Total Logos", df['num_domains'].sum())
-st.bar_chart(df['num_domains'].value_counts().sort_index())
+col1.metric("Total Clusters", bundle.stats["clusters"])
+col2.metric("Total Logos", bundle.stats["logos"])
+st.bar_chart(size_distribution())
@@ -1,4 +1,5 @@
 import pandas as pd
+from parquet_ingest import iter_domains, bottom_k_sample
 
 def create_debug_subset():
 
@@ -6,17 +7,10 @@ def create_debug_subset():
     output_csv   = "data/subset100.csv"
     sample_size  = 100
 
-#read parquet
-    df = pd.read_parquet(parquet_path, engine="pyarrow")
-
- #validate the existance of the domain column and drop duplicates or NaN
-    if "domain" not in df.columns:
-        raise KeyError("Expected a 'domain' column in the Parquet file.")
-    df = df[["domain"]].dropna().drop_duplicates()
-
-    #42, the generator seed to always get the same data
-    subset = df.sample(n=sample_size, random_state=42).reset_index(drop=True)
-    #drop the index and reset it to start from 0
+#stream the parquet, iter_domains validates the domain column and drops empty values
+    #bottom-k over salted hashes: one pass, duplicates can't be picked twice
+    #42, the seed to always get the same data
+    subset = pd.DataFrame({"domain": bottom_k_sample(iter_domains(parquet_path), sample_size, seed=42)})
 
 #write subset as csv
     subset.to_csv(output_csv, index=False)
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+import instrumentation as instr
+
+WATCH_DIR   = "data/watchlist/" #protected brand logos, copied here when registered
+WATCH_INDEX = "data/watchlist/index.json" #brand, file, packed hashes and the brand's own domains
+ALERTS_FILE = "data/watchlist_alerts.jsonl" #one json line per match, appended as soon as the logo is saved
+PHASH_THR = 10 #hamming limits for a watchlist hit, a bit stricter than the grouping cascade (12/16)
+DHASH_THR = 14
+SEEN_CACHE = 50_000 #content hash -> hits, a logo reused by many domains is decoded and hashed once
+
+_lock = threading.Lock()
+_index = None
+_seen = {}
+_written = {} #alerts file -> [bytes already read, (domain, brand, hash) of every alert in it]
+
+#same decode + normalization as preprocessing, so watchlist and crawled logos are hashed from the same 128px grayscale image
+def logo_hashes(data, name):
+    from safe_decode import open_bytes
+    from preprocess_logo import normalize_image
+    from batch_hash import hash_images
+    gray, _ = normalize_image(open_bytes(data, name))
+    return hash_images([gray])[0]
+
+def load_index(path=WATCH_INDEX):
+    if os.path.exists(path) and os.stat(path).st_size > 0:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return []
+
+# registers a protected logo: copied into WATCH_DIR and hashed once, owned domains never raise alerts for it
+def register(path, brand, owned_domains=(), index_path=WATCH_INDEX, watch_dir=WATCH_DIR):
+    from artifact_bundle import registrable_domain
+    Path(watch_dir).mkdir(parents=True, exist_ok=True)
+    with open(path, "rb") as f:
+        data = f.read()
+    ahash, dhash, phash = (int(h) for h in logo_hashes(data, os.path.basename(path)))
+    ext = os.path.splitext(path)[1].lower() or ".png"
+    fname = f"{brand.replace(' ', '_').lower()}_{hashlib.md5(data).hexdigest()[:12]}{ext}"
+    shutil.copyfile(path, os.path.join(watch_dir, fname))
+    entries = [e for e in load_index(index_path) if e["file"] != fname]
+    entries.append({"brand": brand, "file": fname, "ahash": f"{ahash:016x}", "dhash": f"{dhash:016x}", "phash": f"{phash:016x}",
+                    "owned": sorted({registrable_domain(d.strip().lower()) for d in owned_domains if d.strip()})})
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, indent=1)
+    reset()
+    return fname
+
+# in-memory hash index: one uint64 row (aHash, dHash, pHash) per protected logo, matched with a vectorized popcount
+class WatchIndex:
+    def __init__(self, entries):
+        import numpy as np
+        self.entries = entries
+        self.hashes = np.array([[int(e[k], 16) for k in ("ahash", "dhash", "phash")] for e in entries], dtype=np.uint64).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.entries)
+
+    # (entry, phash distance, dhash distance) for every protected logo within the limits
+    def match(self, hashes):
+        import numpy as np
+        diff = (self.hashes ^ np.asarray(hashes, dtype=np.uint64)).view(np.uint8).reshape(len(self.hashes), 3, 8)
+        dist = np.unpackbits(diff, axis=2).sum(axis=2)
+        hits = np.flatnonzero((dist[:, 2] <= PHASH_THR) & (dist[:, 1] <= DHASH_THR))
+        return [(self.entries[i], int(dist[i, 2]), int(dist[i, 1])) for i in hits]
+
+def get_index():
+    global _index
+    with _lock:
+        if _index is None:
+            _index = WatchIndex(load_index())
+        return _index
+
+#drops the loaded index and the per logo cache, the next check reloads WATCH_INDEX
+def reset():
+    global _index
+    with _lock:
+        _index = None
+        _seen.clear()
+
+# json lines of an alerts file from byte offset start, returns them with the offset reached
+# only whole lines are read, lines that don't parse (cut by a killed writer) are skipped
+def read_alerts(path=ALERTS_FILE, start=0):
+    if not os.path.exists(path):
+        return [], start
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    alerts = []
+    for line in data[:end].splitlines():
+        try:
+            alerts.append(json.loads(line))
+        except ValueError:
+            continue
+    return alerts, start + end
+
+#the last n alerts that parse, for the frontend
+def tail_alerts(n=20, path=ALERTS_FILE):
+    return read_alerts(path)[0][-n:]
+
+def alert_key(alert):
+    return alert.get("domain"), alert.get("brand"), alert.get("hash")
+
+# appends an alert unless the same (domain, brand, logo hash) is already in the file, recrawls, retried leases and
+# the browser pass save the same logo again; lines other processes appended since the last call are read first
+# returns False for a duplicate
+def write_alert(alert, path=ALERTS_FILE):
+    with _lock:
+        seen = _written.setdefault(path, [0, set()])
+        new, seen[0] = read_alerts(path, seen[0])
+        seen[1].update(alert_key(a) for a in new)
+        if alert_key(alert) in seen[1]:
+            return False
+        with open(path, "a", encoding="utf-8") as f:
+            cut = f.tell() > seen[0] #a line without its newline, ends it so this alert stays a line of its own
+            f.write(("\n" if cut else "") + json.dumps(alert) + "\n")
+            f.flush()
+        seen[1].add(alert_key(alert))
+        return True
+
+# matches a logo the crawler just saved, alerts go to ALERTS_FILE right away, returns the new ones (not duplicates)
+# never raises: a logo that can't be decoded here is still a saved logo, the watchlist just can't judge it
+def check(domain, data, filename, img_hash=None):
+    index = get_index()
+    if not len(index):
+        return []
+    from artifact_bundle import registrable_domain
+    img_hash = img_hash or hashlib.md5(data).hexdigest()
+    hits = _seen.get(img_hash)
+    if hits is None:
+        try:
+            with instr.timer("watchlist", emit=False):
+                hits = index.match(logo_hashes(data, filename))
+        except Exception as e:
+            instr.count("watchlist_error")
+            print(f"[WATCHLIST] {domain}: could not hash {filename} → {e!r}")
+            return []
+        with _lock:
+            if len(_seen) >= SEEN_CACHE:
+                _seen.clear()
+            _seen[img_hash] = hits
+    site = registrable_domain(domain)
+    alerts = []
+    for entry, pdist, ddist in hits:
+        if site in entry["owned"]:
+            continue
+        alert = {"time": int(time.time()), "domain": domain, "registrable": site, "file": filename, "hash": img_hash,
+                 "brand": entry["brand"], "watch_file": entry["file"], "phash_dist": pdist, "dhash_dist": ddist}
+        if not write_alert(alert):
+            instr.count("watchlist_duplicate", brand=entry["brand"])
+            continue
+        instr.count("watchlist_alert", brand=entry["brand"])
+        print(f"[ALERT] {domain} uses a logo matching watched brand '{entry['brand']}' (pHash {pdist}, dHash {ddist})")
+        alerts.append(alert)
+    return alerts
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) >= 4 and sys.argv[1] == "add":
+        # python src/watchlist.py add <brand> <logo file> [owned domain ...]
+        print(f"[WATCHLIST] registered {register(sys.argv[3], sys.argv[2], sys.argv[4:])}")
+    else:
+        for e in load_index():
+            print(f"{e['brand']}: {e['file']} (owned: {', '.join(e['owned']) or '-'})")
+
+# Watchlist:
+# Protected brand logos are registered once into a small in-memory hash index; every logo the crawler saves is hashed
+# and matched against it on the spot, so a foreign domain reusing a watched logo is reported per domain, not per regroup.
+# Alerts are deduplicated on (domain, brand, logo hash), so a logo saved again by a recrawl or a retried lease is
+# reported once.
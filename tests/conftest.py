@@ -0,0 +1,5 @@
+import os
+import sys
+
+#the pipeline is a set of flat scripts in src/, imported the same way they import each other
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
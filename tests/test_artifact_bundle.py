@@ -0,0 +1,42 @@
+import csv
+import json
+import os
+from PIL import Image
+import artifact_bundle as ab
+
+def write_groups(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["group_id", "domains"])
+        w.writerows(rows)
+
+def make_corpus(tmp_path):
+    logo_dir = tmp_path / "logos"
+    logo_dir.mkdir()
+    for name, shade in (("a_com_1.png", 0), ("b_com_1.png", 128)):
+        Image.new("L", (128, 128), shade).save(logo_dir / name)
+    groups = tmp_path / "groups.csv"
+    write_groups(groups, [(1, "a.com"), (2, "b.com;c.com")])
+    return str(logo_dir) + "/", str(groups), str(tmp_path / "bundle") + "/"
+
+def test_stale_bundle_is_not_downgraded_by_readers(tmp_path):
+    logo_dir, groups, out = make_corpus(tmp_path)
+    ab.build_bundle(groups, logo_dir, str(tmp_path / "none.json"), out)
+    write_groups(groups, [(1, "a.com;b.com")])
+    light = str(tmp_path / "light") + "/"
+    bundle = ab.load_bundle(groups, out, light)
+    assert bundle.summary is None and bundle.group(0) == ["a.com", "b.com"]
+    with open(os.path.join(out, "stats.json"), encoding="utf-8") as f:
+        assert json.load(f)["images"] == 2 #the full bundle still serves logo_service's image matrix
+    assert ab.load_bundle(groups, light_dir=light, out_dir=out).dir == light
+
+def test_rebuild_is_swapped_in_under_open_readers(tmp_path):
+    logo_dir, groups, out = make_corpus(tmp_path)
+    ab.build_bundle(groups, logo_dir, str(tmp_path / "none.json"), out)
+    reader = ab.Bundle(out)
+    files, images, _, _ = reader.image_arrays()
+    write_groups(groups, [(7, "x.com")])
+    ab.build_bundle(groups, logo_dir, str(tmp_path / "none.json"), out, images=False, summary=False)
+    assert reader.group(1) == ["b.com", "c.com"] and images[1].mean() == 128 #still the bundle it opened
+    assert ab.Bundle(out).group(0) == ["x.com"]
+    assert sorted(os.listdir(tmp_path)) == ["bundle", "groups.csv", "logos"]
@@ -0,0 +1,35 @@
+import numpy as np
+import imagehash
+from PIL import Image
+import batch_hash
+
+#odd sizes on purpose: up- and downscaling in both passes, one row/column images, a shape shared by several files
+SIZES = [(128, 128), (128, 128), (128, 128), (97, 31), (5, 300), (1, 64), (640, 7), (33, 33), (9, 8)]
+
+def write_images(tmp_path):
+    rng = np.random.default_rng(7)
+    paths = []
+    for k, (w, h) in enumerate(SIZES):
+        pixels = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        if k % 3 == 0: #smooth content too, random noise alone barely exercises the filter
+            pixels[:] = (np.add.outer(np.arange(h), np.arange(w)) * 255 // max(w + h - 2, 1))[..., None].astype(np.uint8)
+        path = tmp_path / f"img_{k}.png"
+        Image.fromarray(pixels, "RGB").save(path)
+        paths.append(str(path))
+    return paths
+
+def test_hashes_match_imagehash_bit_for_bit(tmp_path):
+    paths = write_images(tmp_path)
+    got = batch_hash.hash_files(paths)
+    for path, (a, d, p) in zip(paths, got):
+        with Image.open(path) as img:
+            expected = [int(str(f(img)), 16) for f in (imagehash.average_hash, imagehash.dhash, imagehash.phash)]
+        assert [int(a), int(d), int(p)] == expected, path
+
+def test_batched_resize_matches_pillow():
+    rng = np.random.default_rng(3)
+    stack = rng.integers(0, 256, (4, 45, 70), dtype=np.uint8)
+    sizes = [(8, 8), (9, 8), (32, 32), (70, 20)]
+    for size, out in zip(sizes, batch_hash.resize_pixels(stack, sizes)):
+        for img, resized in zip(stack, out):
+            assert np.array_equal(resized, np.asarray(Image.fromarray(img).resize(size, batch_hash.LANCZOS)))
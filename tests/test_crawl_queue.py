@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import pytest
+import crawl_queue
+import download_logos as dl
+
+def logo_png(letter):
+    from io import BytesIO
+    from PIL import Image, ImageDraw
+    img = Image.new("RGB", (64, 32), "white")
+    ImageDraw.Draw(img).text((8, 8), letter, fill="navy")
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+@pytest.fixture
+def crawl_dir(tmp_path, monkeypatch):
+    #every data/ path of the crawl resolves under tmp_path
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(dl, "PREFLIGHT", False)
+    saves = []
+    real_save = dl.save_existing_hashes
+    monkeypatch.setattr(dl, "save_existing_hashes", lambda h: (saves.append(len(h)), real_save(h)))
+    def download_domain(domain, existing_hashes, sink=None):
+        if domain.startswith("bad"):
+            raise dl.LogoNotFound("No logo URL found by any strategy")
+        img_hash = f"h-{domain.split('.')[0][-1]}" #a.com and aa.com share a logo
+        filename = existing_hashes.setdefault(img_hash, f"{domain}.png")
+        if sink is not None:
+            sink.add(logo_png(domain[0]), filename, img_hash, domain)
+        return f"https://{domain}/logo.png", "link-logo", filename, img_hash, "Downloaded", None
+    monkeypatch.setattr(dl, "download_domain", download_domain)
+    return saves
+
+def test_results_are_merged_once_when_the_queue_drains(crawl_dir):
+    queue = crawl_queue.CrawlQueue("data/queue.sqlite")
+    domains = [f"{c * n}.com" for c in "abc" for n in range(1, 16)] + ["bad.com"]
+    queue.fill(domains)
+    counts = crawl_queue.work(queue, "w1")
+    assert counts["done"] == 45 and counts["failed"] == 1
+    assert len(crawl_dir) == 1 #one rewrite of logo_hashes.json, not one per batch
+    with open(dl.HASHES_FILE, encoding="utf-8") as f:
+        hashes = json.load(f)
+    assert sorted(hashes) == ["h-a", "h-b", "h-c"]
+    with open("data/crawl_state.json", encoding="utf-8") as f:
+        state = json.load(f)
+    assert len(state) == 45 and {state[d]["filename"] for d in state if d.startswith("a")} == {hashes["h-a"]}
+    with queue.transaction() as db:
+        assert db.execute("SELECT COUNT(*) FROM crawl_state").fetchone()[0] == 0
+
+def test_streamed_preprocessing_goes_through_the_queue(crawl_dir, monkeypatch):
+    import preprocess_logo
+    monkeypatch.setattr(dl, "STREAM_PREPROCESS", True)
+    os.makedirs("data", exist_ok=True)
+    with open(preprocess_logo.MANIFEST, "w", encoding="utf-8") as f:
+        json.dump({"h-old": {"file": "old.png", "domains": ["old.com"]}}, f) #from an earlier run, kept
+    queue = crawl_queue.CrawlQueue("data/queue.sqlite")
+    queue.fill(["a.com", "aa.com", "b.com", "bad.com"])
+    crawl_queue.work(queue, "w1")
+    with open(preprocess_logo.MANIFEST, encoding="utf-8") as f:
+        manifest = json.load(f)
+    with open(preprocess_logo.FEATURES, encoding="utf-8") as f:
+        features = json.load(f)
+    assert sorted(manifest["h-a"]["domains"]) == ["a.com", "aa.com"] and manifest["h-b"]["domains"] == ["b.com"]
+    assert manifest["h-old"]["domains"] == ["old.com"]
+    assert {manifest["h-a"]["file"], manifest["h-b"]["file"]} <= set(features)
+    assert os.path.exists(os.path.join(preprocess_logo.OUT_DIR, manifest["h-a"]["file"]))
+    with queue.transaction() as db:
+        assert db.execute("SELECT COUNT(*) FROM manifest").fetchone()[0] == 0
+
+def test_lost_lease_drops_the_result(crawl_dir):
+    queue = crawl_queue.CrawlQueue("data/queue.sqlite", lease_seconds=0)
+    queue.fill(["a.com", "b.com"])
+    queue.lease("w1", crawl_queue.shard_of("a.com"), n=2)
+    time.sleep(0.01)
+    queue.lease("w2", crawl_queue.shard_of("a.com"), n=2) #w1's leases expired, w2 holds them now
+    logos = {"a.com": ("h-a", "a.png", {"hash": "h-a"})}
+    lost, new = queue.complete_batch("w1", [("a.com", "done", "")], logos)
+    assert lost == {"a.com"} and new == []
+    lost, new = queue.complete_batch("w2", [("a.com", "done", "")], logos)
+    assert lost == set() and [row[1:] for row in new] == [("h-a", "a.png")]
+
+class FakeQueue:
+    def __init__(self):
+        self.renewals = 0
+
+    def heartbeat(self, worker):
+        self.renewals += 1
+
+def test_heartbeat_only_renews_after_progress():
+    queue = FakeQueue()
+    with crawl_queue.Heartbeat(queue, "w1", interval=0.02) as heartbeat:
+        time.sleep(0.15) #hung loop, no beat
+        assert queue.renewals == 0
+        heartbeat.beat()
+        time.sleep(0.1)
+    assert queue.renewals == 1
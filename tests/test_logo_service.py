@@ -0,0 +1,116 @@
+import io
+import os
+import csv
+import json
+import threading
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+import logo_service
+
+def shape_png(kind):
+    img = Image.new("L", (128, 128), 255)
+    draw = ImageDraw.Draw(img)
+    if kind == "circle":
+        draw.ellipse((20, 20, 108, 108), fill=0)
+    elif kind == "square":
+        draw.rectangle((30, 10, 60, 118), fill=0)
+        draw.rectangle((70, 10, 100, 60), fill=0)
+    else:
+        draw.polygon([(64, 10), (118, 118), (10, 118)], fill=0)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(logo_service, "USE_BUNDLE", False)
+    logo_dir = tmp_path / "logos"
+    logo_dir.mkdir()
+    (logo_dir / "circle_com_1.png").write_bytes(shape_png("circle"))
+    (logo_dir / "square_com_1.png").write_bytes(shape_png("square"))
+    groups = tmp_path / "groups.csv"
+    with open(groups, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["group_id", "domains"])
+        writer.writerow([1, "circle.com"])
+        writer.writerow([2, "square.com;mover.com"])
+    return {"logo_dir": str(logo_dir) + "/", "groups_csv": str(groups), "manifest": str(tmp_path / "none.json"),
+            "insert_log": str(tmp_path / "inserts.jsonl")}
+
+@pytest.fixture
+def service(corpus):
+    server = logo_service.make_server("127.0.0.1", 0, logo_service.LogoIndex(**corpus))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def test_popcount_matches_python(monkeypatch):
+    x = np.random.default_rng(0).integers(0, 2**63, 1000, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    expected = [bin(int(v)).count("1") for v in x]
+    assert list(logo_service.popcount64(x)) == expected
+    monkeypatch.delattr(np, "bitwise_count", raising=False) #numpy < 2 path
+    assert list(logo_service.popcount64(x)) == expected
+
+def test_query_and_lookup(service):
+    server, base = service
+    assert logo_service.service_get("/health", base) == {"logos": 2, "groups": 2}
+    match = logo_service.service_post("/query", shape_png("circle"), base)
+    assert match["match"] == "circle_com_1.png" and match["group_id"] == 1
+    assert logo_service.service_get("/domain?d=square.com", base)["domains"] == ["square.com", "mover.com"]
+
+def test_insert_moves_domain_and_writes_png(service, corpus):
+    server, base = service
+    payload = logo_service.service_post("/insert?domain=mover.com", shape_png("circle"), base)
+    assert payload["group_id"] == 1 and payload["domains"] == ["circle.com", "mover.com"]
+    assert logo_service.service_get("/domain?d=square.com", base)["domains"] == ["square.com"]
+    lookup = logo_service.service_get("/domain?d=mover.com", base)
+    assert lookup["group_id"] == 1
+    with Image.open(corpus["logo_dir"] + lookup["logo"]) as img:
+        assert img.size == (128, 128)
+    # a brand new shape opens its own group and is found by the next query
+    new = logo_service.service_post("/insert?domain=tri.com", shape_png("triangle"), base)
+    assert new["group_id"] == 3 and new["domains"] == ["tri.com"]
+    assert logo_service.service_post("/query", shape_png("triangle"), base)["group_id"] == 3
+
+def test_inserts_survive_a_restart(service, corpus):
+    server, base = service
+    logo_service.service_post("/insert?domain=mover.com", shape_png("circle"), base)
+    logo_service.service_post("/insert?domain=tri.com", shape_png("triangle"), base)
+    with open(corpus["insert_log"], "a", encoding="utf-8") as f:
+        f.write('{"domain": "half') #killed in the middle of a write
+    index = logo_service.LogoIndex(**corpus)
+    assert index.lookup_domain("mover.com")["group_id"] == 1
+    assert index.lookup_domain("square.com")["domains"] == ["square.com"]
+    assert index.lookup_domain("tri.com")["domains"] == ["tri.com"]
+    assert len(index.files) == len(index.hashes) == 4 #the inserted pngs are loaded once, not again from the log
+
+def test_get_errors_are_answered(service, monkeypatch):
+    server, base = service
+    def broken(text, limit=50):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(server.index, "search", broken)
+    with pytest.raises(Exception) as e:
+        logo_service.urlopen(base + "/search?q=x", timeout=2)
+    assert e.value.code == 500 and json.loads(e.value.read()) == {"error": "boom"}
+
+def test_insert_reuses_a_preprocessed_file(service, corpus):
+    server, base = service
+    with open(corpus["logo_dir"] + "tri_com_9.png", "wb") as f:
+        f.write(shape_png("triangle"))
+    logo_service.service_post("/insert?domain=tri.com&file=tri_com_9.png", shape_png("triangle"), base)
+    assert logo_service.service_get("/domain?d=tri.com", base)["logo"] == "tri_com_9.png"
+    assert sorted(os.listdir(corpus["logo_dir"])) == ["circle_com_1.png", "square_com_1.png", "tri_com_9.png"]
+
+def test_failed_match_is_a_500_and_nothing_is_inserted(service, corpus, monkeypatch):
+    server, base = service
+    def broken(grays):
+        raise MemoryError("no room")
+    monkeypatch.setattr(server.index, "match_batch", broken)
+    for path in ("/query", "/insert?domain=tri.com"):
+        with pytest.raises(Exception) as e:
+            logo_service.urlopen(logo_service.Request(base + path, data=shape_png("triangle"), method="POST"), timeout=5)
+        assert e.value.code == 500 and "no room" in json.loads(e.value.read())["error"]
+    assert not os.path.exists(corpus["insert_log"])
+    assert logo_service.service_get("/domain?d=tri.com", base).get("group_id") is None
@@ -0,0 +1,76 @@
+import time
+import socket
+import threading
+import pytest
+import requests
+import net_policy
+
+def test_dns_errors_found_through_requests_and_urllib3_wrapping():
+    try:
+        requests.get("http://does-not-exist.invalid/", timeout=5)
+    except requests.exceptions.ConnectionError as e:
+        assert net_policy.is_dns_error(e)
+    assert net_policy.is_dns_error(socket.gaierror(-2, "Name or service not known"))
+
+def test_unrelated_chained_errors_are_not_dns():
+    #a gaierror that was merely being handled (__context__) or named in a message doesn't make the host dead
+    try:
+        try:
+            raise socket.gaierror(-2, "Name or service not known")
+        except socket.gaierror:
+            raise TimeoutError("read timed out")
+    except TimeoutError as e:
+        assert e.__context__ is not None
+        assert not net_policy.is_dns_error(e)
+    assert not net_policy.is_dns_error(OSError("Failed to resolve 'example.com'"))
+    assert not net_policy.is_dns_error(RuntimeError(socket.gaierror(-2, "x")))
+
+@pytest.fixture
+def hedging(monkeypatch):
+    monkeypatch.setattr(net_policy, "HEDGE", True)
+    monkeypatch.setattr(net_policy, "percentile", lambda kind: 0.01)
+    monkeypatch.setattr(net_policy, "_hedge_pool", None)
+    monkeypatch.setattr(net_policy, "_hedge_slots", threading.BoundedSemaphore(1))
+    yield
+    if net_policy._hedge_pool is not None:
+        net_policy._hedge_pool.shutdown(wait=True)
+
+def test_hedges_are_bounded_and_slots_come_back(hedging):
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.3)
+        return "ok"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(net_policy.hedged(slow))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["ok"] * 4
+    assert len(calls) <= 4 + 1 #one hedge slot: at most one extra fetch while the others wait on their primary
+    net_policy._hedge_pool.shutdown(wait=True)
+    assert net_policy._hedge_slots.acquire(blocking=False) #released once the hedge finished
+
+#runs only the first submitted fetch, later ones stay queued as if every worker were busy
+class BusyPool:
+    def __init__(self):
+        self.futures = []
+    def submit(self, fn):
+        from concurrent.futures import Future
+        future = Future()
+        if not self.futures:
+            threading.Thread(target=lambda: future.set_result(fn())).start()
+        self.futures.append(future)
+        return future
+
+def test_queued_loser_is_cancelled(hedging, monkeypatch):
+    pool = BusyPool()
+    monkeypatch.setattr(net_policy, "_pool", lambda: pool)
+    def fetch():
+        time.sleep(0.05)
+        return "ok"
+    assert net_policy.hedged(fetch) == "ok"
+    primary, hedge = pool.futures
+    assert hedge.cancelled()
+    assert net_policy._hedge_slots.acquire(blocking=False)
@@ -0,0 +1,66 @@
+import os
+import csv
+import json
+import random
+from PIL import Image, ImageDraw
+import outofcore_group as ooc
+import cascade_match as cm
+import group_logos_buckets as glb
+from preprocess_logo import preprocess_image
+
+#a few shapes, each drawn several times with small shifts and colours, plus icon + wordmark versions of some of them
+def make_corpus(raw, out):
+    rng = random.Random(1)
+    os.makedirs(raw)
+    os.makedirs(out)
+    features = {}
+    for s in range(6):
+        for v in range(4):
+            img = Image.new("RGB", (160, 80) if v == 3 else (80, 80), "white")
+            draw = ImageDraw.Draw(img)
+            dx, dy = rng.randint(-2, 2), rng.randint(-2, 2)
+            colour = (rng.randint(0, 60), 40 * s, 200 - 30 * s)
+            [draw.ellipse, draw.rectangle, draw.pieslice, draw.chord, draw.ellipse, draw.rectangle][s](
+                (10 + dx + 4 * s, 10 + dy, 70 + dx, 70 + dy - 5 * s), fill=colour, **({"start": 30, "end": 300} if s in (2, 3) else {}))
+            if v == 3:
+                draw.text((90, 30), f"BRAND{s}", fill=colour)
+            name = f"shape{s}_v{v}_com_{v}.png"
+            img.save(os.path.join(raw, name))
+            features[name] = preprocess_image(os.path.join(raw, name), os.path.join(out, name))
+    with open(os.path.join(out, "features.json"), "w", encoding="utf-8") as f:
+        json.dump(features, f)
+    return os.path.join(out, "features.json")
+
+def test_out_of_core_groups_like_the_cascade(tmp_path, monkeypatch):
+    out = str(tmp_path / "pre") + "/"
+    features = make_corpus(str(tmp_path / "raw"), out)
+    monkeypatch.setattr(cm, "FEATURES", features)
+    files = sorted(f for f in os.listdir(out) if f.endswith(".png"))
+    graph, stats = cm.build_cascade_graph(files, raw_dir=out)
+    expected = {frozenset(glb.filename_to_domain(files[i]) for i in comp) for comp in glb.connected_components(graph, len(files))}
+    assert stats["fingerprint_links"] and len(expected) < len(files) #the corpus exercises fingerprints and merges
+    groups_csv = str(tmp_path / "groups.csv")
+    ooc.group_out_of_core(groups_csv, out, str(tmp_path / "work"), features=features)
+    with open(groups_csv, newline="", encoding="utf-8") as f:
+        got = {frozenset(row["domains"].split(";")) for row in csv.DictReader(f)}
+    assert got == expected
+
+#small blocks, partitions and runs so a tiny corpus goes through every spill and merge
+def test_fingerprint_runs_match_the_in_memory_links(tmp_path):
+    out = str(tmp_path / "pre") + "/"
+    features = make_corpus(str(tmp_path / "raw"), out)
+    work = str(tmp_path / "work")
+    os.makedirs(work)
+    files, _ = ooc.hash_pass(out, work, block=5)
+    feats = ooc.FeatureTable(features, files, work, block=5)
+    same, cross = ooc.fingerprint_runs(feats, work, block=5, n_partitions=3, edge_run=4)
+    got = {(i, j, "cross" in tags) for i, j, tags in ooc.merge_tagged({"same": same, "cross": cross}, block=5)}
+    with open(features, encoding="utf-8") as f:
+        all_feats = json.load(f)
+    links = cm.fingerprint_links([all_feats.get(files[i]) for i in range(len(files))])
+    assert got == {(i, j, cross) for (i, j), cross in links.items()}
+
+def test_partitions_grow_with_the_corpus():
+    assert ooc.partitions_for(1000) == ooc.N_PARTITIONS
+    assert ooc.partitions_for(100 * ooc.PARTITION_ROWS) == 100
+    assert ooc.partitions_for(10**12) == 1 << 16
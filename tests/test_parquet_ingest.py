@@ -0,0 +1,39 @@
+import os
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
+import parquet_ingest as pi
+
+def write_domains(path, domains):
+    pq.write_table(pa.table({"domain": domains}, schema=pi.SCHEMA), path)
+
+def shard_domains(paths):
+    return sorted(d for p in paths for d in pq.read_table(p).column("domain").to_pylist())
+
+def test_shards_are_deduplicated_and_replace_the_old_set(tmp_path):
+    src, out = str(tmp_path / "in.parquet"), str(tmp_path / "shards")
+    write_domains(src, ["a.com", "B.com ", "a.com", "c.com/"])
+    shards, total, dups = pi.write_work_shards(src, out, shard_rows=1, n_partitions=2)
+    assert (total, dups) == (3, 1) and shard_domains(shards) == ["a.com", "b.com", "c.com"]
+    write_domains(src, ["d.com"])
+    shards, _, _ = pi.write_work_shards(src, out, shard_rows=10, n_partitions=2)
+    assert shard_domains(shards) == ["d.com"] and sorted(os.listdir(out)) == [os.path.basename(s) for s in shards]
+
+def test_crash_during_the_swap_keeps_the_old_set(tmp_path, monkeypatch):
+    src, out = str(tmp_path / "in.parquet"), str(tmp_path / "shards")
+    write_domains(src, ["a.com", "b.com"])
+    old_shards, _, _ = pi.write_work_shards(src, out, shard_rows=10, n_partitions=1)
+    write_domains(src, ["c.com"])
+    real_replace, calls = os.replace, []
+    def crashing_replace(a, b):
+        calls.append(a)
+        if len(calls) == 2: #old set already renamed aside, new one not in place yet
+            raise KeyboardInterrupt
+        real_replace(a, b)
+    monkeypatch.setattr(pi.os, "replace", crashing_replace)
+    with pytest.raises(KeyboardInterrupt):
+        pi.write_work_shards(src, out, shard_rows=10, n_partitions=1)
+    monkeypatch.setattr(pi.os, "replace", real_replace)
+    assert not os.path.exists(out)
+    pi.recover_dir(out)
+    assert shard_domains(old_shards) == ["a.com", "b.com"]
@@ -0,0 +1,98 @@
+import time
+import socket
+import asyncio
+import pytest
+import preflight
+
+@pytest.fixture
+def connect_ok(monkeypatch):
+    #the dns tests only look at the lookups, every tcp/tls handshake succeeds right away
+    async def connect_probe(ip, port, domain, ssl_context=None):
+        await asyncio.sleep(0)
+    monkeypatch.setattr(preflight, "connect_probe", connect_probe)
+
+@pytest.fixture
+def small_dns_pool(monkeypatch):
+    monkeypatch.setattr(preflight, "_dns_pool", None)
+    yield
+    if preflight._dns_pool is not None:
+        preflight._dns_pool.shutdown(wait=False)
+    preflight._dns_pool = None
+
+# slow (or failing) lookups for the test domains, the ip literals asyncio resolves on connect go to the real one
+def fake_getaddrinfo(delay, fail=False, real=socket.getaddrinfo):
+    def getaddrinfo(host, port, *args, **kwargs):
+        if not str(host).endswith(".test"):
+            return real(host, port, *args, **kwargs)
+        time.sleep(delay)
+        if fail:
+            raise socket.gaierror(-2, "Name or service not known")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port))]
+    return getaddrinfo
+
+def test_slow_async_resolver_at_full_concurrency(connect_ok):
+    async def slow_resolver(host, port):
+        await asyncio.sleep(0.5)
+        return ["127.0.0.1"]
+    domains = [f"site{i}.test" for i in range(400)]
+    results = preflight.preflight_domains(domains, resolver=slow_resolver)
+    assert [d for d, _, _ in results] == domains
+    assert {reason for _, reason, _ in results} == {"ok"}
+
+# lookups queued behind busy dns threads must not time out: the timer starts when a thread picks them up
+def test_queued_lookups_do_not_count_against_dns_timeout(monkeypatch, connect_ok, small_dns_pool):
+    monkeypatch.setattr(preflight, "DNS_THREADS", 4)
+    monkeypatch.setattr(preflight, "DNS_TIMEOUT", 1)
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo(0.3))
+    domains = [f"site{i}.test" for i in range(40)]
+    results = preflight.preflight_domains(domains)
+    assert {reason for _, reason, _ in results} == {"ok"}
+
+def test_default_pool_is_sized_to_concurrency(monkeypatch, connect_ok, small_dns_pool):
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo(0.5))
+    domains = [f"site{i}.test" for i in range(400)]
+    t0 = time.perf_counter()
+    results = preflight.preflight_domains(domains)
+    assert {reason for _, reason, _ in results} == {"ok"}
+    assert time.perf_counter() - t0 < 5 #400 lookups of 0.5s on 200 threads, not 32
+
+def test_slow_lookup_times_out(monkeypatch, connect_ok, small_dns_pool):
+    monkeypatch.setattr(preflight, "DNS_TIMEOUT", 0.2)
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo(1.0))
+    [(domain, reason, details)] = preflight.preflight_domains(["slow.test"])
+    assert (reason, details) == ("dns", "DNS resolution timed out")
+
+def test_unresolvable_domain_is_dead(monkeypatch, connect_ok, small_dns_pool):
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo(0, fail=True))
+    [(domain, reason, details)] = preflight.preflight_domains(["gone.test"])
+    assert reason == "dns"
+    assert preflight.is_dead(reason)
+
+def test_closed_ports_are_reported():
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    closed_port = probe.getsockname()[1]
+    probe.close()
+    async def resolver(host, port):
+        return ["127.0.0.1"]
+    [(domain, reason, details)] = preflight.preflight_domains(["down.test"], resolver=resolver, https_port=closed_port, http_port=closed_port)
+    assert reason == "connection-error"
+
+def test_hanging_injected_resolver_times_out(monkeypatch):
+    monkeypatch.setattr(preflight, "DNS_TIMEOUT", 0.2)
+    async def hanging_resolver(host, port):
+        await asyncio.sleep(60)
+    [(domain, reason, details)] = preflight.preflight_domains(["hang.test"], resolver=hanging_resolver)
+    assert (reason, details) == ("dns", "DNS resolution timed out")
+
+def test_next_address_is_tried_when_the_first_is_unreachable(monkeypatch):
+    tried = []
+    async def connect_probe(ip, port, domain, ssl_context=None):
+        tried.append(ip)
+        if ip == "10.0.0.1":
+            raise ConnectionRefusedError("refused")
+    monkeypatch.setattr(preflight, "connect_probe", connect_probe)
+    async def resolver(host, port):
+        return ["10.0.0.1", "10.0.0.1", "10.0.0.2"]
+    [(domain, reason, details)] = preflight.preflight_domains(["multi.test"], resolver=resolver)
+    assert reason == "ok" and tried == ["10.0.0.1", "10.0.0.2"]
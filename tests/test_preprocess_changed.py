@@ -0,0 +1,48 @@
+import io
+import os
+import json
+import pytest
+from PIL import Image
+import preprocess_logo as pl
+
+def png(shade):
+    buf = io.BytesIO()
+    img = Image.new("RGB", (64, 32), (255, 255, 255))
+    img.paste((shade, 0, 0), (8, 8, 56, 24))
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    for name, value in (("RAW_DIR", "raw/"), ("OUT_DIR", "out/"), ("MANIFEST", "manifest.json"),
+                        ("FEATURES", "features.json"), ("DOMAIN_HASHES_CSV", "none.csv")):
+        monkeypatch.setattr(pl, name, str(tmp_path / value))
+    os.mkdir(pl.RAW_DIR)
+    return tmp_path
+
+def write_raw(name, data):
+    with open(os.path.join(pl.RAW_DIR, name), "wb") as f:
+        f.write(data)
+
+def manifest():
+    with open(pl.MANIFEST, encoding="utf-8") as f:
+        return {e["file"]: e["domains"] for e in json.load(f).values()}
+
+def test_changed_logo_moves_the_domain(dirs):
+    write_raw("a_com_1.png", png(0))
+    write_raw("b_com_1.png", png(0))
+    pl.preprocess_changed([("a.com", "a_com_1.png"), ("b.com", "b_com_1.png")])
+    assert manifest() == {"a_com_1.png": ["a.com", "b.com"]}
+    write_raw("a_com_2.png", png(200))
+    write_raw("b_com_2.png", png(100))
+    pl.preprocess_changed([("a.com", "a_com_2.png"), ("b.com", "b_com_2.png")])
+    assert manifest() == {"a_com_2.png": ["a.com"], "b_com_2.png": ["b.com"]}
+    assert sorted(os.listdir(pl.OUT_DIR)) == ["a_com_2.png", "b_com_2.png"] #the emptied entry's png is gone
+
+def test_failed_preprocess_keeps_the_previous_logo(dirs):
+    write_raw("a_com_1.png", png(0))
+    pl.preprocess_changed([("a.com", "a_com_1.png")])
+    write_raw("a_com_2.png", b"not an image")
+    assert pl.preprocess_changed([("a.com", "a_com_2.png")]) == []
+    assert manifest() == {"a_com_1.png": ["a.com"]}
+    assert os.listdir(pl.OUT_DIR) == ["a_com_1.png"]
@@ -0,0 +1,31 @@
+import csv
+import json
+import batches_failed_pozitive as bfp
+
+def test_every_strategy_and_size_bucket_is_its_own_stratum(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data" / "groups").mkdir(parents=True)
+    big = [f"big{i}.com" for i in range(30)] #one 21+ cluster among many singletons
+    small = [f"s{i}.com" for i in range(500)]
+    with open(bfp.GROUPS_CSV, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["group_id", "domains"])
+        w.writerow([1, ";".join(big)])
+        w.writerows([i + 2, d] for i, d in enumerate(small))
+    state = {d: {"url": f"https://{d}/logo.png", "strategy": "link-logo", "hash": "h", "filename": "f.png"} for d in small + big}
+    with open(bfp.STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    with open(bfp.RESULTS_CSV, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=["domain", "tier", "status", "strategy", "filename", "hash", "reason", "message"])
+        w.writeheader()
+        w.writerow({"domain": "s0.com", "tier": "http", "status": "success", "strategy": "link-logo"})
+        w.writerow({"domain": "x.com", "tier": "http", "status": "fail", "reason": "dns"})
+    bfp.sample_review_set()
+    with open(bfp.OUTPUT_CSV, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    by_stratum = {}
+    for row in rows:
+        by_stratum.setdefault(row["stratum"], []).append(row["domain"])
+    assert sorted(by_stratum) == ["fail|dns", "ok|link-logo|size:1", "ok|link-logo|size:21+"]
+    assert len(by_stratum["ok|link-logo|size:21+"]) == bfp.N_PER_STRATUM
+    assert set(by_stratum["ok|link-logo|size:21+"]) <= set(big)
@@ -0,0 +1,29 @@
+from io import BytesIO
+import patch_filter_svg_raster as svg
+
+def sanitize(markup):
+    out = BytesIO()
+    svg.sanitize_svg_stream(BytesIO(markup.encode("utf-8")), out)
+    return out.getvalue().decode("utf-8")
+
+def test_scripts_and_event_handlers_are_stripped():
+    out = sanitize('<svg width="10" height="10" onload="alert(1)"><script>alert(2)</script>'
+                   '<foreignObject><div>x</div></foreignObject><rect onclick="x()" width="4"/></svg>')
+    assert "alert" not in out and "onclick" not in out and "foreignObject" not in out and "div" not in out
+    assert '<rect width="4"></rect>' in out
+
+def test_size_comes_from_the_viewbox():
+    out = sanitize('<svg viewBox="0 0 300 100"><rect/></svg>')
+    assert 'width="300"' in out and 'height="100"' in out
+
+#html.parser lowercases attributes, inline svgs arrive with "viewbox"
+def test_lowercased_viewbox_from_inline_svgs():
+    from bs4 import BeautifulSoup
+    inline = str(BeautifulSoup('<header><svg viewBox="0 0 120 40"><path d="M0 0h1"/></svg></header>', "html.parser").svg)
+    out = sanitize(inline)
+    assert 'viewBox="0 0 120 40"' in out and 'width="120"' in out and 'height="40"' in out
+
+def test_html_entities_split_across_chunks(monkeypatch):
+    monkeypatch.setattr(svg, "CHUNK_SIZE", 16)
+    out = sanitize('<svg width="1" height="1"><title>caf&eacute; &copy; &amp;</title></svg>')
+    assert "café © &amp;" in out
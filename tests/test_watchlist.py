@@ -0,0 +1,23 @@
+import json
+import watchlist
+
+def alert(domain, brand="acme", img_hash="h1"):
+    return {"domain": domain, "brand": brand, "hash": img_hash, "phash_dist": 0, "file": f"{domain}.png"}
+
+def test_alerts_are_written_once_per_domain_brand_and_logo(tmp_path):
+    path = str(tmp_path / "alerts.jsonl")
+    assert watchlist.write_alert(alert("a.com"), path)
+    assert not watchlist.write_alert(alert("a.com"), path) #recrawl of the same logo
+    assert watchlist.write_alert(alert("a.com", img_hash="h2"), path)
+    with open(path, "a", encoding="utf-8") as f: #another process
+        f.write(json.dumps(alert("b.com")) + "\n")
+    assert not watchlist.write_alert(alert("b.com"), path)
+    assert [a["domain"] for a in watchlist.tail_alerts(path=path)] == ["a.com", "a.com", "b.com"]
+
+def test_lines_that_do_not_parse_are_skipped(tmp_path):
+    path = str(tmp_path / "alerts.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(alert("a.com")) + "\nnot json\n" + json.dumps(alert("b.com"))[:20]) #killed mid line
+    assert watchlist.write_alert(alert("c.com"), path)
+    assert [a["domain"] for a in watchlist.tail_alerts(path=path)] == ["a.com", "c.com"]
+    assert [a["domain"] for a in watchlist.tail_alerts(1, path)] == ["c.com"]